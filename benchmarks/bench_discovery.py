@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+Compare source discovery with os.walk and per-file os.path.isfile against lib.discovery.
+
+A synthetic tree of empty files (by default 1,000,000 files in 1,000 directories, a quarter of them .tif)
+is created in the scratch directory, or reused if it already exists.  The tree is then scanned with the
+previous os.walk implementation of utils.find_images and with discovery.iter_tree, and a text file list of
+all the .tif files is checked with per-file os.path.isfile and with discovery.iter_filelist.  Run it on the
+file system the archives live on; the gain on a local disk with a warm cache is much smaller than on NFS or
+Lustre.
+
+Example:
+    python benchmarks/bench_discovery.py --threads 32 /scratch/bench_discovery
+"""
+
+import argparse
+import os
+import sys
+import time
+
+__bench_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__bench_dir__))
+
+from lib import discovery
+
+TARGET_EXTS = ['.tif']
+FILE_EXTS = ['.tif', '.xml', '.til', '.txt']
+
+
+def legacy_find_tree(inpath, target_exts):
+    ## directory scan as it was in utils.find_images before lib.discovery
+    image_list = []
+    for root, dirs, files in os.walk(inpath):
+        for f in files:
+            if os.path.splitext(f)[1].lower() in target_exts:
+                image_list.append(os.path.join(root, f).replace('\\', '/'))
+    return image_list
+
+
+def legacy_find_filelist(paths, target_exts):
+    return [p for p in paths if os.path.isfile(p) and os.path.splitext(p)[1].lower() in target_exts]
+
+
+def make_tree(treedir, nfiles, ndirs):
+    marker = os.path.join(treedir, '.complete_{}_{}'.format(nfiles, ndirs))
+    if os.path.isfile(marker):
+        print("Reusing tree {}".format(treedir))
+        return
+    print("Creating {} files in {} directories under {}".format(nfiles, ndirs, treedir))
+    per_dir = max(nfiles // ndirs, 1)
+    for d in range(ndirs):
+        ## two levels, like <archive>/<order>/<scene files>
+        subdir = os.path.join(treedir, 'order{:03d}'.format(d % 100), 'scene{:05d}'.format(d))
+        os.makedirs(subdir, exist_ok=True)
+        for i in range(per_dir):
+            ext = FILE_EXTS[i % len(FILE_EXTS)]
+            open(os.path.join(subdir, 'img{:06d}{}'.format(i, ext)), 'w').close()
+    open(marker, 'w').close()
+
+
+def timed(func, *args):
+    t0 = time.time()
+    result = func(*args)
+    return result, time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark source image discovery")
+    parser.add_argument("scratch", help="directory for the synthetic tree")
+    parser.add_argument("--files", type=int, default=1000000, help="number of files (default 1000000)")
+    parser.add_argument("--dirs", type=int, default=1000, help="number of leaf directories (default 1000)")
+    parser.add_argument("--threads", type=int, default=discovery.ARGDEF_THREADS,
+                        help="discovery threads (default {})".format(discovery.ARGDEF_THREADS))
+    args = parser.parse_args()
+
+    treedir = os.path.join(os.path.abspath(args.scratch), 'tree')
+    make_tree(treedir, args.files, args.dirs)
+
+    legacy, legacy_time = timed(legacy_find_tree, treedir, TARGET_EXTS)
+    found, found_time = timed(lambda: list(discovery.iter_tree(treedir, TARGET_EXTS, threads=args.threads)))
+    if sorted(legacy) != sorted(found):
+        print("ERROR: directory scan results differ ({} vs {} files)".format(len(legacy), len(found)))
+    print("tree     os.walk: {:8.2f}s   discovery ({} threads): {:8.2f}s   {} images".format(
+        legacy_time, args.threads, found_time, len(found)))
+
+    legacy, legacy_time = timed(legacy_find_filelist, found, TARGET_EXTS)
+    checked, checked_time = timed(lambda: list(discovery.iter_filelist(found, TARGET_EXTS, threads=args.threads)))
+    if legacy != checked:
+        print("ERROR: file list results differ ({} vs {} files)".format(len(legacy), len(checked)))
+    print("filelist isfile:  {:8.2f}s   discovery ({} threads): {:8.2f}s   {} images".format(
+        legacy_time, args.threads, checked_time, len(checked)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+Compare per-scene wall time of ortho_functions.process_image between the GDAL execution backends.
+
+Every source image is processed once per backend (and per --repeat) into a separate subdirectory of
+the destination directory, so outputs of the two backends can also be compared after the run.
+
+Example:
+    python benchmarks/bench_gdal_backend.py -p 3413 -r 10 --repeat 3 input_dir scratch_dir
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+__bench_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__bench_dir__))
+
+from lib import gdal_backend, ortho_functions, utils
+
+#### Create Loggers
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+
+def main():
+    parent_parser, pos_arg_keys = ortho_functions.build_parent_argument_parser()
+    parser = argparse.ArgumentParser(
+        parents=[parent_parser],
+        description="Benchmark process_image with each GDAL execution backend"
+    )
+    parser.add_argument("--backends", nargs='+', choices=gdal_backend.BACKENDS, default=gdal_backend.BACKENDS,
+                        help="backends to benchmark (default={})".format(' '.join(gdal_backend.BACKENDS)))
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="number of times each scene is processed per backend (default 1)")
+    parser.add_argument("-v", "--verbose", action='store_true', default=False,
+                        help='log processing messages')
+    args = parser.parse_args()
+
+    src = os.path.abspath(args.src)
+    dstdir = os.path.abspath(args.dst)
+    if args.epsg is None:
+        parser.error("--epsg argument is required")
+
+    lso = logging.StreamHandler()
+    lso.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    lso.setFormatter(logging.Formatter('%(asctime)s %(levelname)s- %(message)s', '%m-%d-%Y %H:%M:%S'))
+    logger.addHandler(lso)
+
+    if os.path.isdir(src):
+        image_list = utils.find_images(src, False, ortho_functions.exts)
+    elif os.path.splitext(src)[1].lower() == '.txt':
+        image_list = utils.find_images(src, True, ortho_functions.exts)
+    else:
+        image_list = [src]
+    if len(image_list) == 0:
+        parser.error("No images found: {}".format(src))
+
+    timings = {backend: {} for backend in args.backends}
+    for srcfp in sorted(image_list):
+        srcfn = os.path.basename(srcfp)
+        for backend in args.backends:
+            args.gdal_backend = backend
+            backend_dstdir = os.path.join(dstdir, backend)
+            if not os.path.isdir(backend_dstdir):
+                os.makedirs(backend_dstdir)
+            info = ortho_functions.ImageInfo(srcfp, backend_dstdir, args.wd, args)
+            for _ in range(args.repeat):
+                utils.delete_temp_files([info.dstfp])
+                t0 = time.perf_counter()
+                err = ortho_functions.process_image(srcfp, info.dstfp, args)
+                elapsed = time.perf_counter() - t0
+                if err != 0:
+                    print("{}: processing failed with backend {}".format(srcfn, backend))
+                    break
+                timings[backend].setdefault(srcfn, []).append(elapsed)
+
+    #### Report
+    print("{:<80} {}".format("scene", " ".join(["{:>12}".format(b) for b in args.backends])))
+    for srcfn in sorted(set().union(*[t.keys() for t in timings.values()])):
+        row = []
+        for backend in args.backends:
+            runs = timings[backend].get(srcfn)
+            row.append("{:>12.2f}".format(statistics.median(runs)) if runs else "{:>12}".format("failed"))
+        print("{:<80} {}".format(srcfn, " ".join(row)))
+
+    print()
+    for backend in args.backends:
+        runs = [statistics.median(v) for v in timings[backend].values()]
+        if runs:
+            print("{}: {} scenes, mean {:.2f} s/scene, median {:.2f} s/scene, total {:.2f} s".format(
+                backend, len(runs), statistics.mean(runs), statistics.median(runs), sum(runs)))
+
+
+if __name__ == '__main__':
+    main()
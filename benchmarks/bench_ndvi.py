@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+Compare throughput of the pgc_ndvi block kernel against the previous mask-based implementation.
+
+A synthetic 8-band UInt16 raster is written to the scratch directory (only the red and nir bands hold data,
+the other bands are left sparse), then read back block by block.  Each block is run through both kernels and
+only the kernel time is counted, so the numbers are not affected by disk speed.  The outputs of the two
+kernels are also compared.
+
+Example:
+    python benchmarks/bench_ndvi.py --size 20000 --outtype Int16 scratch_dir
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+from osgeo import gdal
+
+__bench_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__bench_dir__))
+
+import pgc_ndvi
+from lib import spectral_index
+
+gdal.UseExceptions()
+
+RED_BAND = 5
+NIR_BAND = 7
+BLOCK_SIZE = 256
+
+
+def legacy_ndvi_block(red_array, nir_array, red_nodata, nir_nodata, outtype, ndvi_nodata=-9999, tol=0.00001):
+    ## kernel as it was in pgc_ndvi.calc_ndvi before the NormalizedDifferenceKernel rewrite
+    red_mask = (red_array == red_nodata)
+    if red_array[red_mask].size > 0:
+        nir_mask = (nir_array == nir_nodata)
+        if nir_array[nir_mask].size > 0:
+            divzero_mask = abs(nir_array + red_array) < tol
+            if red_array[divzero_mask].size > 0:
+                ndvi_mask = red_mask | nir_mask | divzero_mask
+            else:
+                ndvi_mask = red_mask | nir_mask
+        else:
+            divzero_mask = abs(nir_array + red_array) < tol
+            if red_array[divzero_mask].size > 0:
+                ndvi_mask = red_mask | divzero_mask
+            else:
+                ndvi_mask = red_mask
+    else:
+        nir_mask = (nir_array == nir_nodata)
+        if nir_array[nir_mask].size > 0:
+            divzero_mask = abs(nir_array + red_array) < tol
+            if red_array[divzero_mask].size > 0:
+                ndvi_mask = nir_mask | divzero_mask
+            else:
+                ndvi_mask = nir_mask
+        else:
+            divzero_mask = abs(nir_array + red_array) < tol
+            if red_array[divzero_mask].size > 0:
+                ndvi_mask = divzero_mask
+            else:
+                ndvi_mask = numpy.full_like(red_array, fill_value=0, dtype=bool)
+
+    ndvi_array = numpy.full_like(red_array, fill_value=ndvi_nodata, dtype=numpy.float32)
+    red_asfloat = numpy.array(red_array, dtype=numpy.float32)
+    nir_asfloat = numpy.array(nir_array, dtype=numpy.float32)
+
+    if ndvi_array[~ndvi_mask].size > 0:
+        ndvi_array[~ndvi_mask] = numpy.divide(numpy.subtract(nir_asfloat[~ndvi_mask], red_asfloat[~ndvi_mask]),
+                                              numpy.add(nir_asfloat[~ndvi_mask], red_asfloat[~ndvi_mask]))
+
+    if outtype == 'Int16':
+        ndvi_scaled = numpy.full_like(ndvi_array, fill_value=ndvi_nodata, dtype=numpy.int16)
+        if ndvi_scaled[~ndvi_mask].size > 0:
+            ndvi_scaled[~ndvi_mask] = numpy.array(ndvi_array[~ndvi_mask]*1000.0, dtype=numpy.int16)
+        ndvi_array = ndvi_scaled
+    return ndvi_array
+
+
+def make_synthetic_raster(path, size, seed=0):
+    """Write an 8-band UInt16 raster with realistic red/nir values and a nodata collar"""
+    rng = numpy.random.default_rng(seed)
+    ds = gdal.GetDriverByName('GTiff').Create(
+        path, size, size, 8, gdal.GDT_UInt16,
+        options=['TILED=YES', 'BLOCKXSIZE={}'.format(BLOCK_SIZE), 'BLOCKYSIZE={}'.format(BLOCK_SIZE),
+                 'SPARSE_OK=TRUE', 'BIGTIFF=YES']
+    )
+    ds.SetGeoTransform([0, 2, 0, size * 2, 0, -2])
+    collar = size // 20
+    for yoff in range(0, size, BLOCK_SIZE):
+        ny = min(BLOCK_SIZE, size - yoff)
+        red = rng.integers(50, 1200, (ny, size), dtype=numpy.uint16)
+        nir = (red * rng.uniform(0.5, 3.0, (ny, size))).clip(1, 2047).astype(numpy.uint16)
+        red[:, :collar] = 0
+        nir[:, :collar] = 0
+        if yoff < collar:
+            red[:collar - yoff, :] = 0
+        ds.GetRasterBand(RED_BAND).WriteArray(red, 0, yoff)
+        ds.GetRasterBand(NIR_BAND).WriteArray(nir, 0, yoff)
+    ds = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pgc_ndvi block kernel")
+    parser.add_argument("dst", help="scratch directory for the synthetic raster")
+    parser.add_argument("--size", type=int, default=20000,
+                        help="width and height of the synthetic raster in pixels (default 20000)")
+    parser.add_argument("-t", "--outtype", choices=pgc_ndvi.outtypes, default='Float32',
+                        help="output data type (default Float32)")
+    parser.add_argument("--keep", action='store_true', default=False,
+                        help="keep the synthetic raster for later runs")
+    args = parser.parse_args()
+
+    dstdir = os.path.abspath(args.dst)
+    if not os.path.isdir(dstdir):
+        os.makedirs(dstdir)
+    srcfp = os.path.join(dstdir, 'bench_ndvi_{}.tif'.format(args.size))
+    if not os.path.isfile(srcfp):
+        print("Writing synthetic {0} x {0} 8-band raster: {1}".format(args.size, srcfp))
+        make_synthetic_raster(srcfp, args.size)
+
+    ds = gdal.Open(srcfp)
+    red_band = ds.GetRasterBand(RED_BAND)
+    nir_band = ds.GetRasterBand(NIR_BAND)
+    xblocksize, yblocksize = red_band.GetBlockSize()
+    kernel = spectral_index.NormalizedDifferenceKernel(xblocksize * yblocksize, args.outtype, 0, 0)
+
+    legacy_time = 0.0
+    kernel_time = 0.0
+    max_diff = 0
+    for yoff in range(0, ds.RasterYSize, yblocksize):
+        block_ny = min(yblocksize, ds.RasterYSize - yoff)
+        for xoff in range(0, ds.RasterXSize, xblocksize):
+            block_nx = min(xblocksize, ds.RasterXSize - xoff)
+            red_array = red_band.ReadAsArray(xoff, yoff, block_nx, block_ny)
+            nir_array = nir_band.ReadAsArray(xoff, yoff, block_nx, block_ny)
+
+            t0 = time.perf_counter()
+            legacy = legacy_ndvi_block(red_array, nir_array, 0, 0, args.outtype)
+            t1 = time.perf_counter()
+            result = kernel.compute(nir_array, red_array)
+            t2 = time.perf_counter()
+
+            legacy_time += t1 - t0
+            kernel_time += t2 - t1
+            max_diff = max(max_diff, float(numpy.abs(legacy.astype(numpy.float64) - result).max()))
+    ds = None
+
+    mpix = args.size * args.size / 1e6
+    print("{:<10} {:>10} {:>10}".format("kernel", "seconds", "MPix/s"))
+    print("{:<10} {:>10.2f} {:>10.1f}".format("legacy", legacy_time, mpix / legacy_time))
+    print("{:<10} {:>10.2f} {:>10.1f}".format("current", kernel_time, mpix / kernel_time))
+    print("speedup {:.2f}x, max abs difference {}".format(legacy_time / kernel_time, max_diff))
+
+    if not args.keep:
+        os.remove(srcfp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+Benchmark ortho_functions.process_image on synthetic scenes.
+
+Synthetic DigitalGlobe-style scenes (see synthetic_scene.py) of the given sizes and band counts and a synthetic DEM
+are written to the scratch directory, or reused if they already exist.  Each scene is then processed with every
+combination of --threads, --format and --gtiff-compression, with and without the DEM.  The wall time of each run
+and the stage timings logged by process_image (warp, calc_stats, pyramids, ...) are written as JSON to --output,
+together with the commit, GDAL version and host, so results of different commits can be compared offline.  Given a
+--baseline result file, the median wall time of each configuration is compared with it.
+
+Example:
+    python benchmarks/bench_ortho.py --size 8192 8192 --bands 1 4 8 --threads 1 4 \\
+        --gtiff-compression lzw zstd --repeat 3 --output results_new.json --baseline results_old.json scratch_dir
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from osgeo import gdal
+
+__bench_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__bench_dir__))
+
+from lib import ortho_functions, perf, utils
+from synthetic_scene import FORMAT_EXTS, SyntheticScene, write_dem
+
+#### Create Loggers
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+EPSG = '3413'
+CONFIG_KEYS = ['scene', 'dem', 'threads', 'format', 'gtiff_compression']
+
+
+class StageRecordCollector(logging.Handler):
+    """Collects the stage timing records logged by process_image"""
+
+    def __init__(self):
+        super(StageRecordCollector, self).__init__(logging.INFO)
+        self.records = []
+
+    def emit(self, record):
+        stage_times = perf.parse_stage_times(record.getMessage())
+        if stage_times is not None and stage_times.get('task') == 'ortho':
+            self.records.append(stage_times)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__bench_dir__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_config_key(result):
+    return tuple([result[k] for k in CONFIG_KEYS])
+
+
+def summarize(results):
+    """Return the median wall time of the successful runs of each configuration"""
+    runs = {}
+    for result in results:
+        if result['rc'] == 0:
+            runs.setdefault(get_config_key(result), []).append(result['wall'])
+    return dict([(key, statistics.median(walls)) for key, walls in runs.items()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark process_image on synthetic scenes")
+    parser.add_argument("scratch", help="directory for the synthetic scenes and outputs")
+    parser.add_argument("--size", type=int, nargs=2, default=[4096, 4096], metavar=('XSIZE', 'YSIZE'),
+                        help="scene size in pixels (default 4096 4096)")
+    parser.add_argument("--bands", type=int, nargs='+', default=[4], help="scene band counts (default 4)")
+    parser.add_argument("--source-format", choices=sorted(FORMAT_EXTS), default='NITF',
+                        help="scene file format (default NITF)")
+    parser.add_argument("--threads", type=int, nargs='+', default=[1], help="--threads settings (default 1)")
+    parser.add_argument("--format", nargs='+', choices=sorted(ortho_functions.formats), default=['GTiff'],
+                        help="output --format settings (default GTiff)")
+    parser.add_argument("--gtiff-compression", nargs='+', choices=ortho_functions.gtiff_compressions,
+                        default=['lzw'], help="--gtiff-compression settings, for GTiff and COG output (default lzw)")
+    parser.add_argument("--dem", choices=['yes', 'no', 'both'], default='both',
+                        help="orthorectify with the synthetic DEM, without it, or both (default both)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per configuration (default 1)")
+    parser.add_argument("--output", help="result file (default <scratch>/bench_ortho_<time>.json)")
+    parser.add_argument("--baseline", help="result file of an earlier run to compare with")
+    parser.add_argument("-v", "--verbose", action='store_true', default=False, help='log processing messages')
+    args = parser.parse_args()
+
+    started = datetime.datetime.now()
+    scratch = os.path.abspath(args.scratch)
+    srcdir = os.path.join(scratch, 'scenes')
+    dstdir = os.path.join(scratch, 'output')
+    for d in (srcdir, dstdir):
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    output = args.output or os.path.join(scratch, 'bench_ortho_{}.json'.format(started.strftime('%Y%m%d%H%M%S')))
+
+    lso = logging.StreamHandler()
+    lso.setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    lso.setFormatter(logging.Formatter('%(asctime)s %(levelname)s- %(message)s', '%m-%d-%Y %H:%M:%S'))
+    logger.addHandler(lso)
+    collector = StageRecordCollector()
+    logger.addHandler(collector)
+
+    #### Write scenes and a DEM covering all of them
+    scenes = []
+    for index, bands in enumerate(args.bands):
+        scene = SyntheticScene(srcdir, bands, args.size[0], args.size[1], args.source_format, index=index)
+        print("Writing scene {}".format(scene.name))
+        scene.write()
+        scenes.append(scene)
+    bounds = list(zip(*[scene.get_bounds() for scene in scenes]))
+    demfp = os.path.join(srcdir, 'synthetic_dem_{}x{}.tif'.format(*args.size))
+    write_dem(demfp, (min(bounds[0]), min(bounds[1]), max(bounds[2]), max(bounds[3])))
+    dem_settings = {'yes': [True], 'no': [False], 'both': [True, False]}[args.dem]
+
+    #### Run each configuration
+    results = []
+    configs = []
+    for fmt, threads, dem in itertools.product(args.format, args.threads, dem_settings):
+        for compression in (args.gtiff_compression if fmt in ('GTiff', 'COG') else [None]):
+            configs.append((fmt, threads, dem, compression))
+
+    for scene, (fmt, threads, dem, compression), repeat in itertools.product(scenes, configs, range(args.repeat)):
+        cmd = [scene.srcfp, dstdir, '--epsg', EPSG, '--threads', str(threads), '--format', fmt]
+        if compression:
+            cmd += ['--gtiff-compression', compression]
+        if dem:
+            cmd += ['--dem', demfp]
+        parent_parser, pos_arg_keys = ortho_functions.build_parent_argument_parser()
+        process_args = argparse.ArgumentParser(parents=[parent_parser]).parse_args(cmd)
+
+        info = ortho_functions.ImageInfo(scene.srcfp, dstdir, None, process_args)
+        utils.delete_temp_files([info.dstfp])
+        collector.records = []
+        t0 = time.perf_counter()
+        rc = ortho_functions.process_image(scene.srcfp, info.dstfp, process_args)
+        wall = time.perf_counter() - t0
+        output_bytes = os.path.getsize(info.dstfp) if os.path.isfile(info.dstfp) else None
+
+        stage_times = collector.records[-1] if collector.records else {'stages': [], 'total': None}
+        results.append({
+            'scene': scene.name,
+            'bands': scene.bands,
+            'xsize': scene.xsize,
+            'ysize': scene.ysize,
+            'source_format': scene.format,
+            'dem': dem,
+            'threads': threads,
+            'format': fmt,
+            'gtiff_compression': compression,
+            'repeat': repeat,
+            'rc': rc,
+            'wall': wall,
+            'output_bytes': output_bytes,
+            'stages': stage_times['stages'],
+            'total': stage_times['total'],
+        })
+        print("{} bands {} dem {} threads {} format {} compression {}: {} in {:.2f}s".format(
+            scene.name, scene.bands, 'yes' if dem else 'no', threads, fmt, compression,
+            'ok' if rc == 0 else 'FAILED', wall))
+
+        ## remove the output and its sidecars before the next configuration
+        for fp in [fp for fp in os.listdir(dstdir) if fp.startswith(os.path.splitext(info.dstfn)[0])]:
+            fp = os.path.join(dstdir, fp)
+            if os.path.isdir(fp):
+                shutil.rmtree(fp)
+            else:
+                os.remove(fp)
+
+    #### Write results
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': get_commit(),
+            'gdal_version': gdal.__version__,
+            'python_version': platform.python_version(),
+            'host': platform.node(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'started': started.isoformat(),
+            'command': sys.argv,
+            'results': results,
+        }, f, indent=2)
+    print("Results written to {}".format(output))
+
+    #### Compare with the baseline
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        old = summarize(baseline['results'])
+        new = summarize(results)
+        print()
+        print("Median wall time (s), baseline commit {} vs this run".format(baseline.get('commit')))
+        print("{:<90} {:>10} {:>10} {:>8}".format('scene / dem / threads / format / compression', 'baseline',
+                                                   'current', 'ratio'))
+        for key in sorted(set(old) & set(new), key=str):
+            print("{:<90} {:>10.2f} {:>10.2f} {:>8.2f}".format(' / '.join([str(k) for k in key]), old[key],
+                                                                 new[key], new[key] / old[key]))
+
+
+if __name__ == '__main__':
+    main()
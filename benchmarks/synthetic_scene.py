@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+"""
+Synthetic DigitalGlobe-style scenes for the ortho benchmarks.
+
+A scene is a raw (level 1B) image with a rational polynomial camera model: pixel data with some texture, the four
+corner GCPs in WGS84 that the NITF IGEOLO field gives GDAL, an RPC model and a DG-style XML metadata file with the
+IMD fields that process_image reads (SATID, FIRSTLINETIME, MEANSUNEL and the ABSCALFACTOR/EFFECTIVEBANDWIDTH of
+each band).  GTiff scenes carry the RPCs in the GeoTIFF RPC tag, NITF scenes in an .RPB file next to the image as
+delivered by DigitalGlobe.  The camera model looks slightly off nadir, so the warp depends on the DEM.
+
+write_dem writes a smooth synthetic DEM (EPSG:4326, Float32, meters above the ellipsoid) covering a scene.
+
+Example:
+    python benchmarks/synthetic_scene.py --bands 4 --size 8192 8192 --format NITF scratch_dir
+"""
+
+import argparse
+import math
+import os
+
+import numpy
+from osgeo import gdal, osr
+
+gdal.UseExceptions()
+
+SENSOR = 'WV02'
+ACQUISITION_TIME = '2016-07-15T12:34:56.000000Z'
+MEAN_SUN_ELEVATION = 35.0
+
+# scene center, in west Greenland (EPSG:3413)
+DEFAULT_CENTER = (69.2, -50.0)
+
+# ground sample distance in meters of panchromatic and multispectral scenes
+PAN_GSD = 0.5
+MULTI_GSD = 2.0
+
+BAND_NAMES = {
+    1: ['BAND_P'],
+    4: ['BAND_B', 'BAND_G', 'BAND_R', 'BAND_N'],
+    8: ['BAND_C', 'BAND_B', 'BAND_G', 'BAND_Y', 'BAND_R', 'BAND_RE', 'BAND_N', 'BAND_N2'],
+}
+
+# (ABSCALFACTOR, EFFECTIVEBANDWIDTH) typical of WV02 metadata
+BAND_CALIBRATION = {
+    'BAND_P': (5.678345e-02, 2.846000e-01),
+    'BAND_C': (9.295654e-03, 4.730000e-02),
+    'BAND_B': (7.260513e-03, 5.430000e-02),
+    'BAND_G': (5.488586e-03, 6.300000e-02),
+    'BAND_Y': (4.299927e-03, 3.740000e-02),
+    'BAND_R': (7.347107e-03, 5.740000e-02),
+    'BAND_RE': (3.931427e-03, 3.930000e-02),
+    'BAND_N': (9.676361e-03, 9.890000e-02),
+    'BAND_N2': (6.113434e-03, 9.960000e-02),
+}
+
+FORMAT_EXTS = {'GTiff': '.tif', 'NITF': '.ntf'}
+
+HEIGHT_OFFSET = 500.0
+HEIGHT_SCALE = 500.0
+
+# sample shift, as a fraction of the sample scale, per normalized height: the terrain displacement of the model
+VIEW_OBLIQUITY = 0.01
+
+WRITE_ROWS = 512
+METERS_PER_DEGREE = 111320.0
+
+
+class SyntheticScene(object):
+    """Geometry and file names of a synthetic scene"""
+
+    def __init__(self, dstdir, bands=4, xsize=4096, ysize=4096, fmt='NITF', center=DEFAULT_CENTER, index=0):
+        if bands not in BAND_NAMES:
+            raise ValueError("Band count must be one of {}".format(sorted(BAND_NAMES)))
+        if fmt not in FORMAT_EXTS:
+            raise ValueError("Format must be one of {}".format(sorted(FORMAT_EXTS)))
+        self.bands = bands
+        self.xsize = xsize
+        self.ysize = ysize
+        self.format = fmt
+        self.center_lat, self.center_lon = center
+        self.gsd = PAN_GSD if bands == 1 else MULTI_GSD
+        self.prod_code = 'P1BS' if bands == 1 else 'M1BS'
+        self.catid = '10300100{:08X}'.format(index)
+        self.name = '{}_20160715123456_{}_16JUL15123456-{}-500123456{:03d}_01_P001'.format(
+            SENSOR, self.catid, self.prod_code, index)
+        self.srcfp = os.path.join(dstdir, self.name + FORMAT_EXTS[fmt])
+        self.xmlfp = os.path.join(dstdir, self.name + '.xml')
+        self.rpbfp = os.path.join(dstdir, self.name + '.RPB')
+
+        ## half the scene extent in degrees
+        self.lat_scale = ysize * self.gsd / 2.0 / METERS_PER_DEGREE
+        self.lon_scale = xsize * self.gsd / 2.0 / (METERS_PER_DEGREE * math.cos(math.radians(self.center_lat)))
+
+    def get_rpc(self):
+        """Return the RPC model as GDAL RPC metadata: line = -lat, sample = lon + VIEW_OBLIQUITY * height"""
+        line_num = [0.0] * 20
+        line_num[2] = -1.0
+        samp_num = [0.0] * 20
+        samp_num[1] = 1.0
+        samp_num[3] = VIEW_OBLIQUITY
+        den = [1.0] + [0.0] * 19
+        return {
+            'LINE_OFF': str(self.ysize / 2.0),
+            'SAMP_OFF': str(self.xsize / 2.0),
+            'LAT_OFF': str(self.center_lat),
+            'LONG_OFF': str(self.center_lon),
+            'HEIGHT_OFF': str(HEIGHT_OFFSET),
+            'LINE_SCALE': str(self.ysize / 2.0),
+            'SAMP_SCALE': str(self.xsize / 2.0),
+            'LAT_SCALE': str(self.lat_scale),
+            'LONG_SCALE': str(self.lon_scale),
+            'HEIGHT_SCALE': str(HEIGHT_SCALE),
+            'LINE_NUM_COEFF': ' '.join([repr(c) for c in line_num]),
+            'LINE_DEN_COEFF': ' '.join([repr(c) for c in den]),
+            'SAMP_NUM_COEFF': ' '.join([repr(c) for c in samp_num]),
+            'SAMP_DEN_COEFF': ' '.join([repr(c) for c in den]),
+        }
+
+    def get_corners(self):
+        """Return the (pixel, line, lon, lat) of the corners at the height offset: UL, UR, LR, LL"""
+        corners = []
+        for pixel, line in ((0, 0), (self.xsize, 0), (self.xsize, self.ysize), (0, self.ysize)):
+            lat = self.center_lat + (self.ysize / 2.0 - line) / (self.ysize / 2.0) * self.lat_scale
+            lon = self.center_lon + (pixel - self.xsize / 2.0) / (self.xsize / 2.0) * self.lon_scale
+            corners.append((pixel, line, lon, lat))
+        return corners
+
+    def get_bounds(self, margin=0.2):
+        """Return (minlon, minlat, maxlon, maxlat) of the scene, grown by a fraction on each side"""
+        corners = self.get_corners()
+        lons = [c[2] for c in corners]
+        lats = [c[3] for c in corners]
+        dlon = (max(lons) - min(lons)) * margin
+        dlat = (max(lats) - min(lats)) * margin
+        return min(lons) - dlon, min(lats) - dlat, max(lons) + dlon, max(lats) + dlat
+
+    def write(self):
+        """Write the image, RPCs and metadata, unless the scene already exists"""
+        if os.path.isfile(self.srcfp) and os.path.isfile(self.xmlfp):
+            return
+        if self.format == 'GTiff':
+            self._write_raster(self.srcfp, 'GTiff', ['TILED=YES', 'BIGTIFF=IF_SAFER'])
+        else:
+            ## NITF does not take GCPs and RPCs in Create, so the image is written as a GTiff and copied
+            tmpfp = os.path.splitext(self.srcfp)[0] + '_tmp.tif'
+            self._write_raster(tmpfp, 'GTiff', ['TILED=YES', 'BIGTIFF=IF_SAFER'])
+            gdal.Translate(self.srcfp, tmpfp, format='NITF', creationOptions=['ICORDS=G'])
+            gdal.GetDriverByName('GTiff').Delete(tmpfp)
+            self._write_rpb()
+        self._write_xml()
+
+    def _write_raster(self, path, driver_name, options):
+        driver = gdal.GetDriverByName(driver_name)
+        ds = driver.Create(path, self.xsize, self.ysize, self.bands, gdal.GDT_UInt16, options)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        gcps = [gdal.GCP(lon, lat, 0, pixel, line, '', gcp_id) for (pixel, line, lon, lat), gcp_id in
+                zip(self.get_corners(), ('UpperLeft', 'UpperRight', 'LowerRight', 'LowerLeft'))]
+        ds.SetGCPs(gcps, srs.ExportToWkt())
+        ds.SetMetadata(self.get_rpc(), 'RPC')
+
+        ## 11 bit values with some texture, so the outputs compress like real imagery
+        rng = numpy.random.default_rng(0)
+        x = numpy.arange(self.xsize, dtype=numpy.float32)
+        for yoff in range(0, self.ysize, WRITE_ROWS):
+            rows = min(WRITE_ROWS, self.ysize - yoff)
+            y = numpy.arange(yoff, yoff + rows, dtype=numpy.float32)[:, numpy.newaxis]
+            base = 600 + 250 * numpy.sin(x / 97.0) + 250 * numpy.cos(y / 131.0)
+            for band_num in range(1, self.bands + 1):
+                noise = rng.integers(0, 120, size=(rows, self.xsize))
+                data = numpy.clip(base * (0.6 + 0.1 * band_num) + noise, 1, 2047).astype(numpy.uint16)
+                ds.GetRasterBand(band_num).WriteArray(data, 0, yoff)
+        ds = None
+
+    def _write_rpb(self):
+        rpc = self.get_rpc()
+
+        def coefficients(key):
+            return ',\n'.join(['\t\t\t{:+.15E}'.format(float(c)) for c in rpc[key].split()])
+
+        lines = [
+            'satId = "{}";'.format(SENSOR),
+            'bandId = "{}";'.format('P' if self.bands == 1 else 'Multi'),
+            'SpecId = "RPC00B";',
+            'BEGIN_GROUP = IMAGE',
+            '\terrBias = -1.00;',
+            '\terrRand = -1.00;',
+            '\tlineOffset = {};'.format(rpc['LINE_OFF']),
+            '\tsampOffset = {};'.format(rpc['SAMP_OFF']),
+            '\tlatOffset = {};'.format(rpc['LAT_OFF']),
+            '\tlongOffset = {};'.format(rpc['LONG_OFF']),
+            '\theightOffset = {};'.format(rpc['HEIGHT_OFF']),
+            '\tlineScale = {};'.format(rpc['LINE_SCALE']),
+            '\tsampScale = {};'.format(rpc['SAMP_SCALE']),
+            '\tlatScale = {};'.format(rpc['LAT_SCALE']),
+            '\tlongScale = {};'.format(rpc['LONG_SCALE']),
+            '\theightScale = {};'.format(rpc['HEIGHT_SCALE']),
+            '\tlineNumCoef = (\n{});'.format(coefficients('LINE_NUM_COEFF')),
+            '\tlineDenCoef = (\n{});'.format(coefficients('LINE_DEN_COEFF')),
+            '\tsampNumCoef = (\n{});'.format(coefficients('SAMP_NUM_COEFF')),
+            '\tsampDenCoef = (\n{});'.format(coefficients('SAMP_DEN_COEFF')),
+            'END_GROUP = IMAGE',
+            'END;',
+        ]
+        with open(self.rpbfp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _write_xml(self):
+        band_elems = []
+        for band in BAND_NAMES[self.bands]:
+            abscal, effbandw = BAND_CALIBRATION[band]
+            band_elems.append(
+                '    <{0}>\n'
+                '      <ABSCALFACTOR>{1:.6e}</ABSCALFACTOR>\n'
+                '      <EFFECTIVEBANDWIDTH>{2:.6e}</EFFECTIVEBANDWIDTH>\n'
+                '    </{0}>'.format(band, abscal, effbandw))
+        xml = '\n'.join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<isd>',
+            '  <IMD>',
+            '    <VERSION>28.3</VERSION>',
+            '    <PRODUCTLEVEL>LV1B</PRODUCTLEVEL>',
+            '    <BANDID>{}</BANDID>'.format('P' if self.bands == 1 else 'Multi'),
+            '    <NUMROWS>{}</NUMROWS>'.format(self.ysize),
+            '    <NUMCOLUMNS>{}</NUMCOLUMNS>'.format(self.xsize),
+        ] + band_elems + [
+            '    <IMAGE>',
+            '      <SATID>{}</SATID>'.format(SENSOR),
+            '      <CATID>{}</CATID>'.format(self.catid),
+            '      <FIRSTLINETIME>{}</FIRSTLINETIME>'.format(ACQUISITION_TIME),
+            '      <MEANSUNEL>{}</MEANSUNEL>'.format(MEAN_SUN_ELEVATION),
+            '      <MEANOFFNADIRVIEWANGLE>10.0</MEANOFFNADIRVIEWANGLE>',
+            '      <CLOUDCOVER>0.000</CLOUDCOVER>',
+            '    </IMAGE>',
+            '  </IMD>',
+            '</isd>',
+        ])
+        with open(self.xmlfp, 'w') as f:
+            f.write(xml + '\n')
+
+
+def write_dem(dstfp, bounds, resolution=0.0005):
+    """Write a smooth Float32 DEM in EPSG:4326 covering (minlon, minlat, maxlon, maxlat), unless it exists"""
+    if os.path.isfile(dstfp):
+        return
+    minlon, minlat, maxlon, maxlat = bounds
+    xsize = max(int(math.ceil((maxlon - minlon) / resolution)), 2)
+    ysize = max(int(math.ceil((maxlat - minlat) / resolution)), 2)
+    ds = gdal.GetDriverByName('GTiff').Create(dstfp, xsize, ysize, 1, gdal.GDT_Float32, ['TILED=YES'])
+    ds.SetGeoTransform([minlon, resolution, 0, maxlat, 0, -resolution])
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetProjection(srs.ExportToWkt())
+    x = numpy.arange(xsize, dtype=numpy.float32)
+    y = numpy.arange(ysize, dtype=numpy.float32)[:, numpy.newaxis]
+    elevation = HEIGHT_OFFSET + 300 * numpy.sin(x / 40.0) * numpy.cos(y / 55.0) + 2 * y
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(-9999)
+    band.WriteArray(elevation.astype(numpy.float32))
+    ds = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic DigitalGlobe-style scene and DEM")
+    parser.add_argument("dst", help="output directory")
+    parser.add_argument("--bands", type=int, choices=sorted(BAND_NAMES), default=4, help="band count (default 4)")
+    parser.add_argument("--size", type=int, nargs=2, default=[4096, 4096], metavar=('XSIZE', 'YSIZE'),
+                        help="image size in pixels (default 4096 4096)")
+    parser.add_argument("--format", choices=sorted(FORMAT_EXTS), default='NITF', help="image format (default NITF)")
+    args = parser.parse_args()
+
+    dstdir = os.path.abspath(args.dst)
+    if not os.path.isdir(dstdir):
+        os.makedirs(dstdir)
+    scene = SyntheticScene(dstdir, args.bands, args.size[0], args.size[1], args.format)
+    scene.write()
+    demfp = os.path.join(dstdir, 'synthetic_dem.tif')
+    write_dem(demfp, scene.get_bounds())
+    print(scene.srcfp)
+    print(demfp)
+
+
+if __name__ == '__main__':
+    main()
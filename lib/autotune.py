@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+Automatic choice of --parallel-processes and --threads (--auto-parallel).
+
+Candidate splits of the CPUs between processes and threads (e.g. 16 x 1, 8 x 2, 4 x 4, 2 x 8 on 16 CPUs) are each
+run on a short sample of the task queue, so the calibration itself produces finished outputs.  The samples are
+taken across the range of task costs so each candidate gets a comparable mix of scenes.  For each candidate the
+throughput (source bytes, or tasks if the costs are unknown, per second) is measured along with the system CPU
+utilization and I/O wait from /proc/stat.  The remaining tasks run with the split that had the highest throughput.
+"""
+
+import logging
+import multiprocessing as mp
+import re
+import time
+
+from lib import taskhandler
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+# number of candidate process counts (cpus, cpus / 2, cpus / 4, ...)
+MAX_CANDIDATES = 4
+
+# each candidate runs this many waves of tasks, one task per process per wave
+CALIBRATION_WAVES = 1
+
+PROC_STAT = '/proc/stat'
+
+THREADS_ARG_PATTERN = re.compile(r'--threads (\S+)')
+
+
+class ParallelConfig(object):
+    """A split of the CPUs into processes x threads and its measured performance"""
+
+    def __init__(self, processes, threads):
+        self.processes = processes
+        self.threads = threads
+        self.throughput = None
+        self.cpu_utilization = None
+        self.iowait = None
+
+    def __str__(self):
+        return '{} processes x {} threads'.format(self.processes, self.threads)
+
+
+def get_candidate_configs(cpus, task_count=None, max_candidates=MAX_CANDIDATES):
+    """
+    Return the candidate ParallelConfigs for a number of CPUs, from the most processes to the most threads.
+    Process counts are not larger than task_count.
+    """
+    configs = []
+    processes = cpus
+    while processes >= 1 and len(configs) < max_candidates:
+        if task_count is None or processes <= task_count:
+            configs.append(ParallelConfig(processes, cpus // processes))
+        processes //= 2
+    if len(configs) == 0:
+        configs.append(ParallelConfig(1, cpus))
+    return configs
+
+
+def read_cpu_times(path=PROC_STAT):
+    """Return (total, idle, iowait) jiffies summed over all CPUs, or None if /proc/stat is not available"""
+    try:
+        with open(path) as f:
+            fields = f.readline().split()
+    except (IOError, OSError):
+        return None
+    if len(fields) < 6 or fields[0] != 'cpu':
+        return None
+    values = [int(v) for v in fields[1:]]
+    ## user nice system idle iowait irq softirq steal [guest guest_nice, included in user and nice]
+    total = sum(values[:8])
+    return total, values[3], values[4]
+
+
+def get_cpu_usage(start, end):
+    """Return (CPU utilization, I/O wait) as fractions of the CPU time between two read_cpu_times results"""
+    if start is None or end is None or end[0] <= start[0]:
+        return None, None
+    total = float(end[0] - start[0])
+    idle = end[1] - start[1]
+    iowait = end[2] - start[2]
+    return (total - idle - iowait) / total, iowait / total
+
+
+def set_task_threads(task, threads):
+    """Set the thread count of a task, in its command and in the argument namespaces of its method arguments"""
+    task.cmd = THREADS_ARG_PATTERN.sub('--threads {}'.format(threads), task.cmd)
+    for arg in task.method_arg_list or []:
+        if hasattr(arg, 'threads'):
+            arg.threads = threads
+
+
+def select_samples(tasks, configs, waves=CALIBRATION_WAVES):
+    """
+    Return a list of task samples, one per config, and the remaining tasks.  Tasks are taken at even intervals
+    through the queue ordered by cost and dealt to the configs in turn, so each sample covers the same range of
+    costs.
+    """
+    sample_sizes = [config.processes * waves for config in configs]
+    ordered = taskhandler.order_tasks_by_cost(tasks)
+    total = sum(sample_sizes)
+    indices = [i * len(ordered) // total for i in range(total)]
+
+    samples = [[] for _ in configs]
+    position = 0
+    for index in indices:
+        while len(samples[position]) >= sample_sizes[position]:
+            position = (position + 1) % len(configs)
+        samples[position].append(ordered[index])
+        position = (position + 1) % len(configs)
+
+    sampled = set(indices)
+    remaining = [task for index, task in enumerate(ordered) if index not in sampled]
+    return samples, remaining
+
+
+def run_with_config(tasks, config, in_process=False):
+    """Run tasks with a ParallelConfig and return the dict of task name to return code"""
+    for task in tasks:
+        set_task_threads(task, config.threads)
+    task_handler = taskhandler.ParallelTaskHandler(config.processes, in_process)
+    return task_handler.run_tasks(tasks)
+
+
+def run_auto_parallel(tasks, in_process=False, cpus=None, waves=CALIBRATION_WAVES):
+    """
+    Calibrate the processes x threads split on samples of the task queue, run the remaining tasks with the
+    best split, and return the dict of task name to return code for all tasks
+    """
+    if cpus is None:
+        cpus = mp.cpu_count()
+    configs = get_candidate_configs(cpus, len(tasks))
+    if len(configs) == 1 or len(tasks) < sum([c.processes * waves for c in configs]) * 2:
+        ## too few tasks for the calibration to pay off
+        config = configs[0]
+        logger.info("Auto parallel: %i tasks, too few to calibrate, using %s", len(tasks), config)
+        return run_with_config(tasks, config, in_process)
+
+    samples, remaining = select_samples(tasks, configs, waves)
+    results = {}
+    for config, sample in zip(configs, samples):
+        cost = sum([task.cost if task.cost is not None else 0 for task in sample])
+        cpu_start = read_cpu_times()
+        t0 = time.time()
+        results.update(run_with_config(sample, config, in_process))
+        elapsed = max(time.time() - t0, 1e-6)
+        config.cpu_utilization, config.iowait = get_cpu_usage(cpu_start, read_cpu_times())
+        if cost > 0:
+            config.throughput = cost / elapsed
+            throughput_str = '{:.1f} MB/s'.format(config.throughput / 1024.0 / 1024.0)
+        else:
+            config.throughput = len(sample) / elapsed
+            throughput_str = '{:.3f} tasks/s'.format(config.throughput)
+        logger.info("Auto parallel calibration: %s, %i tasks in %.1fs, %s, CPU %s, I/O wait %s", config,
+                    len(sample), elapsed, throughput_str, format_fraction(config.cpu_utilization),
+                    format_fraction(config.iowait))
+
+    best = max(configs, key=lambda c: c.throughput)
+    logger.info("Auto parallel: using %s (--parallel-processes %i --threads %i) for the remaining %i tasks",
+                best, best.processes, best.threads, len(remaining))
+    results.update(run_with_config(remaining, best, in_process))
+    return results
+
+
+def format_fraction(value):
+    return 'n/a' if value is None else '{:.0f}%'.format(value * 100)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""
+In-memory catalog of the auto DEM GeoPackage.
+
+With --dem auto, each image gets the best ranked DEM whose footprint contains the image footprint.  The
+GeoPackage lists the DEM footprints in one layer per spatial reference, each feature with a rank and the DEM
+path.  A DemCatalog reads all layers once, keeps the footprints in memory and indexes their envelopes per layer
+in an STR packed R-tree, so a lookup transforms the image footprint once per layer and tests containment only
+against the DEMs whose envelope contains the image envelope.  get_catalog keeps one catalog per GeoPackage in
+each process, shared by pgc_ortho while planning and by process_image in every task, and reloads it if the
+file changes.
+
+Lookups give the same result as a scan of every feature: the lowest rank wins, and among equal ranks the first
+feature in layer order.
+"""
+
+import configparser
+import logging
+import math
+import os
+import platform
+
+from osgeo import gdal, ogr, osr
+
+from lib import metadata_cache
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+NODE_CAPACITY = 16
+MAX_RANK = 9999  # features ranked this or higher are never selected
+
+_catalog_instances = {}
+
+
+def get_gpkg_path(config_file_path):
+    """
+    Return the auto DEM GeoPackage path from the config file given with --config-file.  Raises RuntimeError if
+    the config file or the GeoPackage cannot be found.
+    """
+    if not config_file_path or not os.path.isfile(config_file_path):
+        raise RuntimeError("Config file not found: {}. Please provide a valid config file path for 'auto' DEM "
+                           "setting.".format(config_file_path))
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_file_path)
+    except configparser.Error as e:
+        raise RuntimeError("Error reading config file: {}. Please ensure the config file exists and is correctly "
+                           "formatted for 'auto' DEM.".format(e))
+
+    gpkg_path = config.get("default", "gpkg_path", fallback=None)
+    if platform.system() == "Windows":
+        gpkg_path = config.get("windows", "gpkg_path", fallback=gpkg_path)
+
+    if not gpkg_path:
+        raise RuntimeError("gpkg_path not found in config file. Please check the config file format.")
+    if not os.path.isfile(gpkg_path):
+        raise RuntimeError("The gpkg file does not exist at the expected location: {}".format(gpkg_path))
+    return gpkg_path
+
+
+def get_catalog(gpkg_path):
+    """
+    Return the catalog of a GeoPackage, reusing one instance per process while the file is unchanged.
+    """
+    signature = metadata_cache.get_file_signature(gpkg_path)
+    catalog = _catalog_instances.get(gpkg_path)
+    if catalog is None or catalog.signature != signature:
+        catalog = DemCatalog(gpkg_path)
+        _catalog_instances[gpkg_path] = catalog
+    return catalog
+
+
+def envelope_contains(outer, inner):
+    """Return True if envelope outer (minx, maxx, miny, maxy, as from ogr.Geometry.GetEnvelope) contains inner"""
+    return outer[0] <= inner[0] and outer[1] >= inner[1] and outer[2] <= inner[2] and outer[3] >= inner[3]
+
+
+def envelopes_intersect(a, b):
+    return a[0] <= b[1] and a[1] >= b[0] and a[2] <= b[3] and a[3] >= b[2]
+
+
+def merge_envelopes(envelopes):
+    return (min([e[0] for e in envelopes]), max([e[1] for e in envelopes]),
+            min([e[2] for e in envelopes]), max([e[3] for e in envelopes]))
+
+
+class STRtree(object):
+    """
+    Static R-tree of (envelope, value) items packed with the Sort-Tile-Recursive algorithm.  Envelopes are
+    (minx, maxx, miny, maxy) tuples.
+    """
+
+    def __init__(self, items, node_capacity=NODE_CAPACITY):
+        self.size = len(items)
+        ## a node is (envelope, children, is_leaf); leaf children are the items themselves
+        nodes = [(envelope, value, True) for envelope, value in items]
+        while len(nodes) > 1:
+            nodes = self._pack(nodes, node_capacity)
+        self.root = nodes[0] if nodes else None
+
+    @staticmethod
+    def _pack(nodes, node_capacity):
+        """Return the parent nodes of one level: nodes are cut into vertical slices by x, then into runs by y"""
+        parent_count = int(math.ceil(len(nodes) / float(node_capacity)))
+        slice_count = int(math.ceil(math.sqrt(parent_count)))
+        slice_size = slice_count * node_capacity
+        nodes = sorted(nodes, key=lambda node: node[0][0] + node[0][1])
+        parents = []
+        for i in range(0, len(nodes), slice_size):
+            vertical_slice = sorted(nodes[i:i + slice_size], key=lambda node: node[0][2] + node[0][3])
+            for j in range(0, len(vertical_slice), node_capacity):
+                children = vertical_slice[j:j + node_capacity]
+                parents.append((merge_envelopes([child[0] for child in children]), children, False))
+        return parents
+
+    def query_containing(self, envelope):
+        """Return the values of the items whose envelope contains the given envelope"""
+        return self._query(lambda node_envelope: envelope_contains(node_envelope, envelope))
+
+    def query_intersecting(self, envelope):
+        """Return the values of the items whose envelope intersects the given envelope"""
+        return self._query(lambda node_envelope: envelopes_intersect(node_envelope, envelope))
+
+    def _query(self, predicate):
+        ## the predicate must hold for a node if it holds for any item below it
+        values = []
+        stack = [self.root] if self.root is not None and predicate(self.root[0]) else []
+        while stack:
+            node_envelope, children, is_leaf = stack.pop()
+            if is_leaf:
+                values.append(children)
+            else:
+                stack.extend([child for child in children if predicate(child[0])])
+        return values
+
+
+class DemLayer(object):
+    """Footprints of one GeoPackage layer and an index of their envelopes"""
+
+    def __init__(self, name, spatial_ref, entries):
+        self.name = name
+        self.spatial_ref = spatial_ref
+        self.entries = entries
+        self.tree = STRtree([(entry[2].GetEnvelope(), entry) for entry in entries])
+        self.transforms = {}
+
+    def transform(self, geometry, spatial_ref):
+        """Return the geometry transformed from spatial_ref to the layer's spatial reference"""
+        key = spatial_ref.ExportToWkt()
+        if key not in self.transforms:
+            if spatial_ref.IsSame(self.spatial_ref):
+                self.transforms[key] = None
+            else:
+                self.transforms[key] = osr.CoordinateTransformation(spatial_ref, self.spatial_ref)
+        coordinate_transformer = self.transforms[key]
+        if coordinate_transformer is None:
+            return geometry
+        geometry = geometry.Clone()
+        geometry.Transform(coordinate_transformer)
+        return geometry
+
+
+class DemCatalog(object):
+    """DEM footprints of an auto DEM GeoPackage"""
+
+    def __init__(self, gpkg_path):
+        self.gpkg_path = gpkg_path
+        self.signature = metadata_cache.get_file_signature(gpkg_path)
+        self.path_field = "windowspath" if platform.system() == "Windows" else "dempath"
+        self.layers = []
+
+        try:
+            dataset = gdal.OpenEx(gpkg_path, gdal.OF_VECTOR)
+        except Exception as e:
+            raise RuntimeError("Error opening the GeoPackage file: {}".format(e))
+        if dataset is None:
+            raise RuntimeError("Error opening the GeoPackage file: {}".format(gpkg_path))
+
+        ## entries are (rank, order, geometry, dempath); order is the position in a scan of all layers
+        order = 0
+        for i in range(dataset.GetLayerCount()):
+            layer = dataset.GetLayerByIndex(i)
+            if layer is None or layer.GetSpatialRef() is None:
+                continue
+            layer_defn = layer.GetLayerDefn()
+            has_path = layer_defn.GetFieldIndex(self.path_field) >= 0
+            if layer_defn.GetFieldIndex('rank') < 0:
+                raise RuntimeError("Auto DEM layer {} has no 'rank' field".format(i))
+
+            entries = []
+            layer.ResetReading()
+            for feature in layer:
+                order += 1
+                geometry = feature.GetGeometryRef()
+                if geometry is None:
+                    logger.debug("Skipping feature %s in layer %d because its geometry is None", feature.GetFID(), i)
+                    continue
+                rank = feature['rank']
+                if rank is None or rank >= MAX_RANK:
+                    continue
+                dempath = feature.GetField(self.path_field) if has_path else None
+                entries.append((rank, order, geometry.Clone(), dempath, has_path))
+            self.layers.append(DemLayer(layer.GetName(), layer.GetSpatialRef().Clone(), entries))
+
+        del dataset
+        logger.debug("Loaded %i DEM footprints from %s", sum([len(layer.entries) for layer in self.layers]),
+                     gpkg_path)
+
+    def find_dem(self, geometry_wkt, spatial_ref):
+        """
+        Return the path of the best ranked DEM containing the geometry, or None if no DEM contains it.
+
+        Parameters:
+            geometry_wkt (wkt): Geometry of input image
+            spatial_ref (osr.SpatialReference): spatial reference of the geometry
+        """
+        image_geometry = ogr.CreateGeometryFromWkt(geometry_wkt)
+        selected = None
+        for layer in self.layers:
+            layer_geometry = layer.transform(image_geometry, spatial_ref)
+            for entry in layer.tree.query_containing(layer_geometry.GetEnvelope()):
+                if selected is not None and entry[:2] > selected[:2]:
+                    continue
+                try:
+                    if layer_geometry.Within(entry[2]):
+                        selected = entry
+                except Exception as e:
+                    raise RuntimeError("Error processing feature in auto DEM layer {}: {}".format(layer.name, e))
+
+        if selected is None:
+            return None
+        if not selected[4]:
+            raise RuntimeError("Error getting '{}' field: not found in {}".format(self.path_field, self.gpkg_path))
+        return selected[3]
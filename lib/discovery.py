@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+Source image discovery for the processing scripts.
+
+Directory trees are scanned with os.scandir, one directory per task in a thread pool, and matching paths are
+yielded as soon as their directory has been read.  Directory entry types come from the scandir results, so
+files found in a tree are never stat'ed individually.  File lists are checked with os.path.isfile in batches
+spread over the same kind of thread pool, keeping the order of the list.  On network file systems (NFS,
+Lustre) most of the time is spent waiting on metadata round trips, which the threads overlap.
+
+Matching follows utils.find_images: a file matches if its lowercased extension is in target_exts, directory
+symlinks are not followed, and paths use forward slashes.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import os
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+ARGDEF_THREADS = 16
+ISFILE_BATCH_SIZE = 256
+
+# above this many distinct pattern lengths, ExcludeMatcher uses the automaton
+MAX_WINDOW_LENGTHS = 8
+
+
+def _scan_directory(path):
+    """Return the file names and subdirectory paths of one directory"""
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        ## like os.walk, list directory symlinks as directories but do not descend into them
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    else:
+                        files.append(entry.name)
+                except OSError:
+                    files.append(entry.name)
+    except OSError as e:
+        logger.debug("Cannot scan directory %s: %s", path, e)
+    return path, files, subdirs
+
+
+def iter_tree(inpath, target_exts, threads=ARGDEF_THREADS):
+    """
+    Yield the paths of files under inpath whose lowercased extension is in target_exts.
+
+    Subdirectories are scanned in parallel, so paths are not yielded in os.walk order.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        pending = {executor.submit(_scan_directory, inpath)}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                root, files, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_directory, subdir))
+                for f in files:
+                    if os.path.splitext(f)[1].lower() in target_exts:
+                        yield os.path.join(root, f).replace('\\', '/')
+
+
+def _check_files(paths, target_exts):
+    return [os.path.splitext(p)[1].lower() in target_exts and os.path.isfile(p) for p in paths]
+
+
+def iter_filelist(paths, target_exts, threads=ARGDEF_THREADS, batch_size=ISFILE_BATCH_SIZE,
+                  log_level=logging.DEBUG):
+    """
+    Yield the paths from a list that exist and whose lowercased extension is in target_exts, in list order.
+
+    The existence checks run in batches of batch_size paths in a thread pool, with a bounded number of
+    batches in flight.  Paths that are skipped are logged at log_level.
+    """
+    threads = max(threads, 1)
+    in_flight = collections.deque()
+
+    def finish_batch():
+        batch, future = in_flight.popleft()
+        for path, ok in zip(batch, future.result()):
+            if ok:
+                yield path
+            else:
+                logger.log(log_level, "File in textfile does not exist or has an invalid extension: %s", path)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        batch = []
+        for path in paths:
+            batch.append(path.rstrip('\n').rstrip('\r'))
+            if len(batch) == batch_size:
+                in_flight.append((batch, executor.submit(_check_files, batch, target_exts)))
+                batch = []
+                if len(in_flight) > threads * 2:
+                    yield from finish_batch()
+        if batch:
+            in_flight.append((batch, executor.submit(_check_files, batch, target_exts)))
+        while in_flight:
+            yield from finish_batch()
+
+
+def iter_images(inpath, is_filelist, target_exts, threads=ARGDEF_THREADS, log_level=logging.DEBUG):
+    """
+    Yield source image paths from a directory tree, or from a text file path or list of paths if is_filelist.
+    """
+    if is_filelist:
+        if type(inpath) is str:
+            with open(inpath, 'r') as textfile_fp:
+                inpath = textfile_fp.read().splitlines()
+        return iter_filelist(inpath, target_exts, threads=threads, log_level=log_level)
+    else:
+        return iter_tree(inpath, target_exts, threads=threads)
+
+
+class ExcludeMatcher(object):
+    """
+    Index of exclude list patterns (scene IDs, file names or paths), built once and shared by the callers.
+
+    `scene_id in matcher` is an exact set lookup.  match(path) returns a pattern that equals path or is a
+    substring of it, or None.  If the patterns have only a few distinct lengths, the substrings of path with
+    those lengths are looked up in the set.  Otherwise an Aho-Corasick automaton over all patterns is built
+    on the first call, so each path is scanned once regardless of the number of patterns.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = set([p.strip() for p in patterns if p.strip() != ''])
+        self.lengths = sorted(set([len(p) for p in self.patterns]))
+        self._goto = None
+        self._fail = None
+        self._out = None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def __contains__(self, item):
+        return item in self.patterns
+
+    def match(self, path):
+        """Return a pattern found in path, or None if path is not excluded"""
+        if len(self.patterns) == 0:
+            return None
+        if path in self.patterns:
+            return path
+
+        ## Exclude lists are mostly scene IDs of a few fixed lengths: look up every substring of those lengths
+        if len(self.lengths) <= MAX_WINDOW_LENGTHS:
+            for length in self.lengths:
+                for i in range(len(path) - length + 1):
+                    if path[i:i + length] in self.patterns:
+                        return path[i:i + length]
+            return None
+
+        if self._goto is None:
+            self._build()
+
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        for i, char in enumerate(path):
+            c = ord(char)
+            while state and (state << 21 | c) not in goto:
+                state = fail[state]
+            state = goto.get(state << 21 | c, 0)
+            if out[state]:
+                return path[i + 1 - out[state]:i + 1]
+        return None
+
+    def _build(self):
+        ## Transitions are kept in one dict keyed by (state << 21 | code point) rather than a dict per node,
+        ## which keeps the automaton for tens of thousands of scene IDs to a manageable size.
+        goto = {}
+        out = [0]
+        children = [[]]
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                c = ord(char)
+                key = state << 21 | c
+                child = goto.get(key)
+                if child is None:
+                    child = goto[key] = len(out)
+                    out.append(0)
+                    children.append([])
+                    children[state].append((c, child))
+                state = child
+            out[state] = len(pattern)
+
+        ## breadth first, so the failure state of each node is final before its children are visited
+        fail = [0] * len(out)
+        queue = collections.deque([child for c, child in children[0]])
+        while queue:
+            state = queue.popleft()
+            for c, child in children[state]:
+                f = fail[state]
+                while f and (f << 21 | c) not in goto:
+                    f = fail[f]
+                fail[child] = goto.get(f << 21 | c, 0)
+                if not out[child]:
+                    out[child] = out[fail[child]]
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+
+def get_exclude_matcher(exclude_list):
+    """
+    Return an ExcludeMatcher for an ExcludeMatcher, a path to a text file of patterns (one per line) or a
+    list or set of patterns.
+    """
+    if isinstance(exclude_list, ExcludeMatcher):
+        return exclude_list
+    if isinstance(exclude_list, str):
+        with open(exclude_list, 'r') as f:
+            return ExcludeMatcher(f.read().splitlines())
+    return ExcludeMatcher(exclude_list)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+GDAL execution backends used by the ortho pipeline.
+
+Each backend exposes the gdal_translate, gdalwarp, gdalbuildvrt and gdaladdo operations used by
+ortho_functions.  The options are given as the same command line option strings the utilities accept,
+so both backends produce identical outputs.  The shell backend runs the command line utilities through
+taskhandler.exec_cmd, while the in-process backend drives gdal.Translate/gdal.Warp/gdal.BuildVRT and
+BuildOverviews directly, avoiding process startup and sharing one GDAL block cache for the whole run.
+"""
+
+import logging
+import re
+
+from osgeo import gdal
+
+from lib import taskhandler
+
+gdal.UseExceptions()
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+BACKENDS = ['inprocess', 'shell']
+ARGDEF_BACKEND = 'inprocess'
+
+CONFIG_OPTION_PATTERN = re.compile(r'--config\s+(?P<key>\S+)\s+(?P<value>\S+)\s*')
+
+OVERVIEW_RESAMPLING_DICT = {
+    'near': 'NEAREST',
+    'nearest': 'NEAREST',
+}
+
+_backend_cache = {}
+
+
+def split_config_options(options):
+    """
+    Separate '--config KEY VALUE' pairs from a GDAL utility option string.
+
+    Returns a dict of config options and the remaining option string.
+    """
+    config_options = {}
+    for match in CONFIG_OPTION_PATTERN.finditer(options):
+        config_options[match.group('key')] = match.group('value')
+    remaining = CONFIG_OPTION_PATTERN.sub('', options).strip()
+    return config_options, remaining
+
+
+def get_backend(name=None):
+    """
+    Return the backend instance for the given name, reusing one instance per process.
+    """
+    if name is None:
+        name = ARGDEF_BACKEND
+    if name not in BACKENDS:
+        raise ValueError("GDAL backend must be one of {} but was '{}'".format(BACKENDS, name))
+    if name not in _backend_cache:
+        if name == 'shell':
+            _backend_cache[name] = ShellBackend()
+        else:
+            _backend_cache[name] = InProcessBackend()
+    return _backend_cache[name]
+
+
+def get_backend_from_args(args):
+    """
+    Return the backend selected by the --gdal-backend argument, defaulting to ARGDEF_BACKEND
+    if the argument namespace does not carry the option.
+    """
+    return get_backend(getattr(args, 'gdal_backend', None))
+
+
+class ShellBackend(object):
+    """Runs GDAL operations as command line utilities in a subprocess"""
+
+    name = 'shell'
+
+    def translate(self, src, dst, options=''):
+        cmd = 'gdal_translate {} "{}" "{}"'.format(options, src, dst)
+        return taskhandler.exec_cmd(cmd)
+
+    def warp(self, src, dst, options=''):
+        cmd = 'gdalwarp {} "{}" "{}"'.format(options, src, dst)
+        return taskhandler.exec_cmd(cmd)
+
+    def build_vrt(self, dst, srcs, options=''):
+        cmd = 'gdalbuildvrt {} "{}" "{}"'.format(options, dst, '" "'.join(srcs))
+        return taskhandler.exec_cmd(cmd)
+
+    def build_overviews(self, path, resampling, levels, options=''):
+        cmd = 'gdaladdo {} -r {} "{}" {}'.format(options, resampling, path, ' '.join([str(l) for l in levels]))
+        return taskhandler.exec_cmd(cmd)
+
+
+class InProcessBackend(object):
+    """Runs GDAL operations through the GDAL Python API in the current process"""
+
+    name = 'inprocess'
+
+    def translate(self, src, dst, options=''):
+        logger.debug("gdal.Translate %s: %s -> %s", options, src, dst)
+        return self._run(lambda opts: gdal.Translate(dst, src, options=opts), options)
+
+    def warp(self, src, dst, options=''):
+        logger.debug("gdal.Warp %s: %s -> %s", options, src, dst)
+        return self._run(lambda opts: gdal.Warp(dst, src, options=opts), options)
+
+    def build_vrt(self, dst, srcs, options=''):
+        logger.debug("gdal.BuildVRT %s: %s -> %s", options, srcs, dst)
+        return self._run(lambda opts: gdal.BuildVRT(dst, srcs, options=opts), options)
+
+    def build_overviews(self, path, resampling, levels, options=''):
+        logger.debug("BuildOverviews %s %s: %s", resampling, levels, path)
+        resampling = OVERVIEW_RESAMPLING_DICT.get(resampling.lower(), resampling.upper())
+        return self._run(
+            lambda opts: gdal.Open(path, gdal.GA_Update).BuildOverviews(resampling, [int(l) for l in levels]),
+            options
+        )
+
+    def _run(self, operation, options):
+        config_options, options = split_config_options(options)
+
+        ## GDAL_CACHEMAX only takes effect when the block cache is created, so set the shared cache
+        ## size directly instead of passing it as a scoped config option
+        cachemax = config_options.pop('GDAL_CACHEMAX', None)
+        if cachemax is not None:
+            gdal.SetCacheMax(int(cachemax) * 1024 * 1024)
+
+        err = 0
+        se = ''
+        ## gdal.config_options() needs GDAL 3.7, so set the options and restore the previous values by hand
+        saved_options = dict([(key, gdal.GetConfigOption(key)) for key in config_options])
+        try:
+            for key, value in config_options.items():
+                gdal.SetConfigOption(key, value)
+            result = operation(options)
+            if result is None:
+                err = 1
+            ## Release the dataset so the output is flushed to disk
+            result = None
+        except RuntimeError as e:
+            err = 1
+            se = str(e)
+        finally:
+            for key, value in saved_options.items():
+                gdal.SetConfigOption(key, value)
+
+        if err != 0:
+            logger.error("Error found in GDAL operation: %s %s", options, se)
+        return err, '', se
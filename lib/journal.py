@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+Per-output journal of the processing stages completed for an ortho image.
+
+process_image records each expensive stage (warp, calc_stats, pyramids) in a small JSON sidecar next to the
+output, {base}_journal.json, once the stage has finished, with the path, size and modification time of the file it
+produced.  The finished output is recorded as the 'done' stage with its CRC32 as well, and the warp with its CRC32,
+dimensions and nodata values so it can be verified before it is reused.  A record is only trusted
+while its file is unchanged, so a stage that was interrupted while writing, or a file changed by a later stage
+that was interrupted, is never mistaken for a complete one.  A job killed while building pyramids resumes from
+the recorded warp instead of warping again, and pgc_ortho treats an output as finished only if its journal
+records it as done.  The journal is written to a temporary file and renamed into place, so it is never seen
+half written.
+"""
+
+import json
+import logging
+import os
+import time
+import zlib
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+JOURNAL_SUFFIX = '_journal.json'
+CHUNK_SIZE = 64 * 1024 * 1024
+
+STAGE_WARP = 'warp'
+STAGE_CALC_STATS = 'calc_stats'
+STAGE_PYRAMIDS = 'pyramids'
+STAGE_DONE = 'done'
+
+
+def get_journal_path(dstfp):
+    return os.path.splitext(dstfp)[0] + JOURNAL_SUFFIX
+
+
+def file_crc32(path, chunk_size=CHUNK_SIZE):
+    """Return the CRC32 of a file"""
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return crc
+
+
+class Journal(object):
+    """Stages recorded for one output file"""
+
+    def __init__(self, dstfp):
+        self.dstfp = dstfp
+        self.path = get_journal_path(dstfp)
+        self.stages = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    self.stages = json.load(f)['stages']
+            except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning("Ignoring unreadable journal %s: %s", self.path, e)
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def record(self, stage, path, checksum=False, **properties):
+        """
+        Record a stage as complete with the file it produced, its CRC32 if checksum is True, and any other
+        JSON serializable properties given as keyword arguments
+        """
+        st = os.stat(path)
+        entry = dict(properties)
+        entry.update({'path': path, 'size': st.st_size, 'mtime': st.st_mtime, 'time': time.time()})
+        if checksum:
+            entry['crc32'] = file_crc32(path)
+        self.stages[stage] = entry
+        self._write()
+
+    def is_complete(self, stage):
+        """Return True if the stage is recorded and the file it produced is unchanged"""
+        entry = self.stages.get(stage)
+        if entry is None:
+            return False
+        try:
+            st = os.stat(entry['path'])
+        except OSError:
+            return False
+        return st.st_size == entry['size'] and st.st_mtime == entry['mtime']
+
+    def verify_checksum(self, stage):
+        """Return True if the stage is complete and the CRC32 of its file matches the recorded one"""
+        return (self.is_complete(stage) and 'crc32' in self.stages[stage] and
+                file_crc32(self.stages[stage]['path']) == self.stages[stage]['crc32'])
+
+    def reset(self):
+        """Forget all stages and remove the journal file"""
+        self.stages = {}
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _write(self):
+        tmp = self.path + '.part'
+        with open(tmp, 'w') as f:
+            json.dump({'output': self.dstfp, 'stages': self.stages}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
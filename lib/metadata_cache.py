@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+Persistent cache of parsed image metadata for the ortho pipeline.
+
+ImageInfo locates and parses the vendor metadata file and opens the raster for its footprint, both while
+pgc_ortho builds the task queue and again inside each task.  This module stores those results in an SQLite
+file given with --metadata-cache, keyed by the source path, size and modification time, so each image is
+parsed once across planning and processing runs.  Entries are ignored when the source file changes.
+
+The cache is an optimization only: if the database cannot be opened or written (e.g. locking problems on a
+network file system), a warning is logged and processing continues without it.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+SQLITE_TIMEOUT = 60  # seconds
+
+KIND_METADATA = 'metadata'
+KIND_FOOTPRINT = 'footprint'
+
+_cache_instances = {}
+
+
+def get_cache(path):
+    """
+    Return the cache for the given database path, reusing one instance per process.  Instances are keyed by the
+    process id so that forked workers open their own connection instead of using the parent's.
+    """
+    key = (os.getpid(), os.path.abspath(path))
+    if key not in _cache_instances:
+        _cache_instances[key] = MetadataCache(key[1])
+    return _cache_instances[key]
+
+
+def get_cache_from_args(args):
+    """
+    Return the cache selected by the --metadata-cache argument, or None if caching is not enabled.
+    """
+    path = getattr(args, 'metadata_cache', None)
+    if path is None:
+        return None
+    return get_cache(path)
+
+
+def get_file_signature(path):
+    """
+    Return (size, mtime) of a file, or None if it does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+class MetadataCache(object):
+    """SQLite backed key/value store of JSON entries per (source path, kind)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.enabled = True
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+            with self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries ("
+                    "srcfp TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, "
+                    "value TEXT NOT NULL, PRIMARY KEY (srcfp, kind))"
+                )
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def get(self, srcfp, kind):
+        """
+        Return the cached dict for srcfp, or None if there is no entry or srcfp changed since it was stored.
+        """
+        if not self.enabled:
+            return None
+        signature = get_file_signature(srcfp)
+        if signature is None:
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT size, mtime, value FROM entries WHERE srcfp = ? AND kind = ?",
+                (os.path.abspath(srcfp), kind)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+        if row is None or (row[0], row[1]) != signature:
+            return None
+        return json.loads(row[2])
+
+    def put(self, srcfp, kind, value):
+        """
+        Store a JSON serializable dict for srcfp under its current size and mtime.
+        """
+        if not self.enabled:
+            return
+        signature = get_file_signature(srcfp)
+        if signature is None:
+            return
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO entries (srcfp, kind, size, mtime, value) VALUES (?, ?, ?, ?, ?)",
+                    (os.path.abspath(srcfp), kind, signature[0], signature[1], json.dumps(value))
+                )
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def _disable(self, e):
+        logger.warning("Metadata cache %s is not usable, continuing without it: %s", self.path, e)
+        self.enabled = False
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+            self.conn = None
@@ -12,7 +12,7 @@ import numpy
 from numpy import flatnonzero
 from osgeo import gdal, ogr, osr
 
-from lib import utils
+from lib import discovery, utils
 
 logger = logging.getLogger("logger")
 logger.setLevel(logging.DEBUG)
@@ -1034,20 +1034,22 @@ def copyall(srcfile, dstdir):
             logger.warning(e)
 
 def getExcludeList(exclude_arg):
+    """
+    Return a discovery.ExcludeMatcher of the scene IDs or file name patterns given by the --exclude option
+    """
     if exclude_arg == 'pgc_exclude_list':
         # If pgc_exclude_list is  specified, read it from the API
         # TODO make this a configuration value or a command line option
         url = "https://scene-assessment.pgc.umn.edu/exclude-list"
         response = requests.get(url, verify=False)
         # Convert JSON response to a set of lines
-        exclude_list = set([line.rstrip() for line in os.linesep.join(response.json()).splitlines()])
+        exclude_list = discovery.ExcludeMatcher(os.linesep.join(response.json()).splitlines())
         logger.info(f"Successfully fetched pgc_exclude_list from API with {len(exclude_list)} scenes")
     elif exclude_arg is not None:
         if not os.path.isfile(exclude_arg):
             logger.error("Value for option --exclude-list is not a valid file")
-        f = open(exclude_arg, 'r')
-        exclude_list = set([line.rstrip() for line in f.readlines()])
+        exclude_list = discovery.get_exclude_matcher(exclude_arg)
         logger.info(f"Successfully fetched exclude list from file with {len(exclude_list)} scenes")
     else:
-        exclude_list = set()
+        exclude_list = discovery.ExcludeMatcher()
     return exclude_list
@@ -1,6 +1,10 @@
 
 import argparse
+import collections
+import copy
 import glob
+import hashlib
+import json
 import logging
 import math
 import os
@@ -8,14 +12,14 @@ import platform
 import re
 import shutil
 import tarfile
-import configparser
 from datetime import datetime
 from xml.dom import minidom
 from xml.etree import ElementTree as ET
 
+import numpy as np
 from osgeo import gdal, gdalconst, ogr, osr
 
-from lib import taskhandler, utils
+from lib import dem_catalog, gdal_backend, journal, metadata_cache, perf, staging, stream_writer, utils, warp_cache
 from lib import VERSION
 from lib.utils import Vendor, ImageType, OutputType
 
@@ -37,7 +41,12 @@ stretches = ["ns", "rf", "mr", "rd", "au"]
 resamples = ["near", "bilinear", "cubic", "cubicspline", "lanczos"]
 gtiff_compressions = ["jpeg95", "lzw", "jpeg75", "zstd"]
 exts = ['.ntf', '.tif']
+output_writers = ['stream', 'translate']
 ARGDEF_THREADS = 1
+ARGDEF_OUTPUT_WRITER = 'translate'
+AUTO_DEM_VRT_MARGIN = 0.05  # fraction of the image extent added on each side when picking the tiles of a VRT DEM
+STAGE_WINDOW_PAD = 64  # pixels added on each side of the source window staged for a target extent
+STAGE_WINDOW_MAX_FRACTION = 0.5  # stage the whole raster if the window covers more of it than this
 
 # slurm partitions as of 7/3/2024: update here for acceptable inputs to '--queue' arg if cluster partitions change
 slurm_partitions = ['batch','big_mem','low_priority']
@@ -394,20 +403,31 @@ class ImageInfo:
         # Get image metadata as an Etree dictionary and set image type
         self.image_type = None
 
+        self.metadata_cache = metadata_cache.get_cache_from_args(args)
+        cached = self.metadata_cache.get(self.srcfp, metadata_cache.KIND_METADATA) if self.metadata_cache else None
+        if cached and metadata_cache.get_file_signature(cached['metapath']) == tuple(cached['metapath_signature']):
+            logger.debug("Using cached metadata for %s", self.srcfn)
+            _mp = cached['metapath']
+        else:
+            cached = None
+
         if self.vendor == Vendor.DG:
-            _mp = get_dg_metadata_path(self.srcfp, self.regex)
-            if _mp is None:
-                _mp = extract_dg_metadata_file(self.srcfp, self.regex, wd)
+            if not cached:
+                _mp = get_dg_metadata_path(self.srcfp, self.regex)
+                if _mp is None:
+                    _mp = extract_dg_metadata_file(self.srcfp, self.regex, wd)
             _func = utils.get_dg_metadata_as_xml
             self.image_type = IMAGE_TYPE_DICT[self.prod_code[0]]
 
         elif self.vendor == Vendor.GE and self.sat == "GE01":
-            _mp = get_ge_metadata_path(self.srcfp)
+            if not cached:
+                _mp = get_ge_metadata_path(self.srcfp)
             _func = utils.get_ge_metadata_as_xml
             self.image_type = IMAGE_TYPE_DICT[self.band_name]
 
         elif self.vendor == Vendor.GE and self.sat == "IK01":
-            _mp = get_ik_metadata_path(self.srcfp, self.regex)
+            if not cached:
+                _mp = get_ik_metadata_path(self.srcfp, self.regex)
             _func = utils.get_ik_metadata_as_xml
             self.image_type = IMAGE_TYPE_DICT[self.band_name]
 
@@ -416,14 +436,26 @@ class ImageInfo:
 
         if _mp:
             self.metapath = _mp
-            self.metad_etree = _func(self.metapath)
+            if cached:
+                self.metad_etree = ET.ElementTree(ET.fromstring(cached['xml']))
+            else:
+                self.metad_etree = _func(self.metapath)
+                if self.metadata_cache:
+                    self.metadata_cache.put(self.srcfp, metadata_cache.KIND_METADATA, {
+                        'metapath': self.metapath,
+                        'metapath_signature': metadata_cache.get_file_signature(self.metapath),
+                        'xml': ET.tostring(self.metad_etree.getroot(), encoding='unicode'),
+                    })
         else:
             raise RuntimeError(f"Cannot find metadata file")
 
         # Initialize attribs set by get_image_stats
+        self.raster_footprint = None
         self.extent = ''
         self.extent_geom = None
         self.image_geom = None
+        self.xsize = None
+        self.ysize = None
         self.minlat = None
         self.minlon = None
         self.maxlat = None
@@ -443,13 +475,7 @@ class ImageInfo:
             if _err != 0:
                 raise RuntimeError(f"Error in stats calculation")
 
-        self.dstfn = "{}_{}{}{}{}".format(
-            os.path.splitext(self.srcfn)[0],
-            utils.get_bit_depth(args.outtype),
-            self.stretch,
-            self.epsg,
-            formats[args.format]
-        )
+        self.dstfn = get_output_filename(self.srcfn, args, self.stretch, self.epsg)
         self.dstfp = os.path.join(self.dstdir, self.dstfn)
         if args.wd is not None:
             wd = args.wd
@@ -457,65 +483,30 @@ class ImageInfo:
             wd = self.dstdir
         self.localdst = os.path.join(wd, self.dstfn)
         self.rawvrt = os.path.splitext(self.localdst)[0] + "_raw.vrt"
-        self.warpfile = os.path.splitext(self.localdst)[0] + "_warp.tif"
+        if getattr(args, 'single_pass', False):
+            self.warpfile = os.path.splitext(self.localdst)[0] + "_warp.vrt"
+        else:
+            self.warpfile = os.path.splitext(self.localdst)[0] + "_warp.tif"
         self.vrtfile = os.path.splitext(self.localdst)[0] + "_vrt.vrt"
 
     def get_image_stats(self, args):
         rc = 0
         # If image_geom is already set, this method was already run, skip running it again
         if not self.image_geom:
-            try:
-                ds = gdal.Open(self.src_image, gdalconst.GA_ReadOnly)
-            except RuntimeError:
-                logger.error("Cannot open dataset: %s", self.src_image)
+            footprint = self.get_raster_footprint()
+            if footprint is None:
                 rc = 1
             else:
                 if self.bands is None:
-                    self.bands = ds.RasterCount
-
-                ##  Get extent from GCPs
-                num_gcps = ds.GetGCPCount()
-                if num_gcps == 4:
-                    gcps = ds.GetGCPs()
-                    proj = ds.GetGCPProjection()
-                    gcp_dict = {}
-                    id_dict = {"UpperLeft": 1,
-                               "1": 1,
-                               "UpperRight": 2,
-                               "2": 2,
-                               "LowerLeft": 4,
-                               "4": 4,
-                               "LowerRight": 3,
-                               "3": 3}
-
-                    for gcp in gcps:
-                        gcp_dict[id_dict[gcp.Id]] = [float(gcp.GCPPixel), float(gcp.GCPLine), float(gcp.GCPX),
-                                                     float(gcp.GCPY), float(gcp.GCPZ)]
-                    ulx = gcp_dict[1][2]
-                    uly = gcp_dict[1][3]
-                    urx = gcp_dict[2][2]
-                    ury = gcp_dict[2][3]
-                    llx = gcp_dict[4][2]
-                    lly = gcp_dict[4][3]
-                    lrx = gcp_dict[3][2]
-                    lry = gcp_dict[3][3]
-                    xsize = gcp_dict[1][0] - gcp_dict[2][0]
-                    ysize = gcp_dict[1][1] - gcp_dict[4][1]
-
-                else:
-                    xsize = ds.RasterXSize
-                    ysize = ds.RasterYSize
-                    proj = ds.GetProjectionRef()
-                    gtf = ds.GetGeoTransform()
-                    ulx = gtf[0] + 0 * gtf[1] + 0 * gtf[2]
-                    uly = gtf[3] + 0 * gtf[4] + 0 * gtf[5]
-                    urx = gtf[0] + xsize * gtf[1] + 0 * gtf[2]
-                    ury = gtf[3] + xsize * gtf[4] + 0 * gtf[5]
-                    llx = gtf[0] + 0 * gtf[1] + ysize * gtf[2]
-                    lly = gtf[3] + 0 * gtf[4] + ysize * gtf[5]
-                    lrx = gtf[0] + xsize * gtf[1] + ysize * gtf[2]
-                    lry = gtf[3] + xsize * gtf[4] + ysize * gtf[5]
-                ds = None
+                    self.bands = footprint['bands']
+                xsize = footprint['xsize']
+                ysize = footprint['ysize']
+                self.xsize = xsize
+                self.ysize = ysize
+                proj = footprint['proj']
+                ## read by runtime_model.parse_log to calibrate task bundle runtimes
+                logger.info("Source raster size: %i x %i pixels, %i bands", xsize, ysize, self.bands)
+                ulx, uly, urx, ury, llx, lly, lrx, lry = footprint['corners']
 
                 ####  Create geometry objects
                 ul_geom = ogr.Geometry(ogr.wkbPoint)
@@ -653,6 +644,17 @@ class ImageInfo:
 
         return rc
 
+    def get_raster_footprint(self):
+        """
+        Return the band count, size, projection and corner coordinates of the source raster as a dict,
+        from the metadata cache if possible.  Returns None if the raster cannot be opened.
+        """
+        if self.raster_footprint is None:
+            # The cache is keyed by the original source, which the working directory copy is identical to
+            cache_key = self.srcfp if self.src_image == self.localsrc else self.src_image
+            self.raster_footprint = read_raster_footprint(self.src_image, self.metadata_cache, cache_key)
+        return self.raster_footprint
+
     def set_extent_geom(self, target_extent_geom=None):
         rc = 0
         if target_extent_geom:
@@ -688,6 +690,113 @@ class ImageInfo:
         return rc
 
 
+def read_raster_footprint(src_image, cache=None, cache_key=None):
+    """
+    Return the band count, size, projection and corner coordinates of a raster as a dict, from the metadata
+    cache if possible.  Returns None if the raster cannot be opened.
+    """
+    if cache_key is None:
+        cache_key = src_image
+    if cache:
+        footprint = cache.get(cache_key, metadata_cache.KIND_FOOTPRINT)
+        if footprint:
+            return footprint
+
+    try:
+        ds = gdal.Open(src_image, gdalconst.GA_ReadOnly)
+    except RuntimeError:
+        logger.error("Cannot open dataset: %s", src_image)
+        return None
+
+    ##  Get extent from GCPs
+    num_gcps = ds.GetGCPCount()
+    if num_gcps == 4:
+        gcps = ds.GetGCPs()
+        proj = ds.GetGCPProjection()
+        gcp_dict = {}
+        id_dict = {"UpperLeft": 1,
+                   "1": 1,
+                   "UpperRight": 2,
+                   "2": 2,
+                   "LowerLeft": 4,
+                   "4": 4,
+                   "LowerRight": 3,
+                   "3": 3}
+
+        for gcp in gcps:
+            gcp_dict[id_dict[gcp.Id]] = [float(gcp.GCPPixel), float(gcp.GCPLine), float(gcp.GCPX),
+                                         float(gcp.GCPY), float(gcp.GCPZ)]
+        ulx = gcp_dict[1][2]
+        uly = gcp_dict[1][3]
+        urx = gcp_dict[2][2]
+        ury = gcp_dict[2][3]
+        llx = gcp_dict[4][2]
+        lly = gcp_dict[4][3]
+        lrx = gcp_dict[3][2]
+        lry = gcp_dict[3][3]
+        xsize = gcp_dict[1][0] - gcp_dict[2][0]
+        ysize = gcp_dict[1][1] - gcp_dict[4][1]
+
+    else:
+        xsize = ds.RasterXSize
+        ysize = ds.RasterYSize
+        proj = ds.GetProjectionRef()
+        gtf = ds.GetGeoTransform()
+        ulx = gtf[0] + 0 * gtf[1] + 0 * gtf[2]
+        uly = gtf[3] + 0 * gtf[4] + 0 * gtf[5]
+        urx = gtf[0] + xsize * gtf[1] + 0 * gtf[2]
+        ury = gtf[3] + xsize * gtf[4] + 0 * gtf[5]
+        llx = gtf[0] + 0 * gtf[1] + ysize * gtf[2]
+        lly = gtf[3] + 0 * gtf[4] + ysize * gtf[5]
+        lrx = gtf[0] + xsize * gtf[1] + ysize * gtf[2]
+        lry = gtf[3] + xsize * gtf[4] + ysize * gtf[5]
+
+    footprint = {
+        'bands': ds.RasterCount,
+        'xsize': xsize,
+        'ysize': ysize,
+        'proj': proj,
+        'corners': [ulx, uly, urx, ury, llx, lly, lrx, lry],
+    }
+    ds = None
+
+    if cache:
+        cache.put(cache_key, metadata_cache.KIND_FOOTPRINT, footprint)
+    return footprint
+
+
+def get_output_filename(srcfn, args, stretch, epsg):
+    """Returns the output file name for a source image with the given stretch and EPSG code"""
+    return "{}_{}{}{}{}".format(
+        os.path.splitext(srcfn)[0],
+        utils.get_bit_depth(args.outtype),
+        stretch,
+        epsg,
+        formats[args.format]
+    )
+
+
+def get_planned_dstfp(srcfp, dstdir, args):
+    """Returns the output path of a source image from its filename and the arguments alone, without reading
+    metadata or opening the raster.
+
+    This is possible when the output EPSG code is fixed and the stretch is not 'au'.  Returns None otherwise,
+    in which case the output path has to come from a full ImageInfo.  Raises a RuntimeError if the vendor is
+    not recognized from the filename."""
+    if args.stretch == 'au':
+        return None
+    try:
+        epsg = int(args.epsg)
+    except (TypeError, ValueError):
+        return None
+
+    srcfn = os.path.basename(srcfp)
+    vendor = utils.get_sensor(srcfn)[0]
+    if vendor is None:
+        raise RuntimeError("Vendor not recognized")
+    return os.path.join(dstdir, get_output_filename(srcfn, args, args.stretch, epsg))
+
+
 def get_destination_nodata(output_type: str | OutputType) -> int | float:
     """Determines the destination NoData value for a given output data type.
 
@@ -698,6 +807,16 @@ def get_destination_nodata(output_type: str | OutputType) -> int | float:
     return NO_DATA_DICT[output_type]
 
 
+def get_warp_nodata(args):
+    """
+    Return the nodata value of the warped intermediate.  Warps kept in the --warp-cache use one value for all output
+    types, which calc_stats maps to the nodata value of the output; other warps use the output's value.
+    """
+    if getattr(args, 'warp_cache', None) and not args.skip_warp:
+        return warp_cache.WARP_NODATA
+    return get_destination_nodata(args.outtype)
+
+
 def thread_type():
     def posintorall(arg_input):
         try:
@@ -766,13 +885,44 @@ def build_parent_argument_parser():
     parser.add_argument("--wd",
                         help='local working directory for cluster jobs (default is dst dir)'
                              'If used with --save-temps ALL files will be preserved in working directory')
+    parser.add_argument("--staged-read", action='store_true', default=False,
+                        help="with --wd, copy only the source raster and its metadata sidecars to the working "
+                             "directory, in parallel checksummed chunks, and only the pixel window of the target "
+                             "extent when it covers a small part of the image")
     parser.add_argument("--skip-warp", action='store_true', default=False,
                         help="skip warping step")
+    parser.add_argument("--single-pass", action='store_true', default=False,
+                        help="warp to a virtual dataset and apply the stretch while writing the output, so the "
+                             "full resolution Float32 warp intermediate is never written to disk")
     parser.add_argument("--skip-dem-overlap-check", action='store_true', default=False,
                         help="skip verification of image-DEM overlap")
     parser.add_argument("--no-pyramids", action='store_true', default=False,
                         help='suppress calculation of output image pyramids')
     parser.add_argument("--pyramid-type", choices=['near', 'cubic'], default='near', help='pyramid resampling strategy')
+    parser.add_argument("--gdal-backend", choices=gdal_backend.BACKENDS, default=gdal_backend.ARGDEF_BACKEND,
+                        help="execution backend for GDAL operations: 'inprocess' runs them through the GDAL API in "
+                             "the processing script, sharing one block cache; 'shell' runs the equivalent GDAL "
+                             "command line utilities, useful for debugging (default={})"
+                        .format(gdal_backend.ARGDEF_BACKEND))
+    parser.add_argument("--output-writer", choices=output_writers, default=ARGDEF_OUTPUT_WRITER,
+                        help="how the stretched output is written: 'translate' runs gdal_translate on a stretch VRT; "
+                             "'stream' reads the warped image block by block, applies the stretch with NumPy and "
+                             "writes through a bounded pipeline, with output values that may differ from "
+                             "'translate' by 1 DN (default={})".format(ARGDEF_OUTPUT_WRITER))
+    parser.add_argument("--max-memory", type=int, default=stream_writer.ARGDEF_MAX_MEMORY,
+                        help="memory ceiling in MB for the GDAL block cache and the output writer of each process "
+                             "(default={})".format(stream_writer.ARGDEF_MAX_MEMORY))
+    parser.add_argument("--metadata-cache",
+                        help="SQLite file used to cache parsed image metadata and raster footprints between task "
+                             "queue construction, processing and later runs, keyed by source path, size and "
+                             "modification time (default is no cache)")
+    parser.add_argument("--warp-cache",
+                        help="directory to keep the warped intermediate of each image in, keyed by the source, DEM "
+                             "and output grid, so runs that differ only in stretch, output type or format reuse it "
+                             "instead of warping again (default is no cache)")
+    parser.add_argument("--warp-cache-size", type=float, default=warp_cache.ARGDEF_WARP_CACHE_SIZE,
+                        help="size limit of the --warp-cache in GB; the least recently used warps are removed to "
+                             "stay under it (default={})".format(warp_cache.ARGDEF_WARP_CACHE_SIZE))
     parser.add_argument("--ortho-height", type=int,
                         help='constant elevation to use for orthorectification (value should be in meters above '
                         'the wgs84 ellipsoid)')
@@ -796,6 +946,7 @@ def build_parent_argument_parser():
 def process_image(srcfp, dstfp, args, target_extent_geom=None):
     err = 0
     starttime = datetime.today()
+    timer = perf.StageTimer(task='ortho', image=os.path.basename(srcfp))
 
     ## Handle threads (default to 1 if arg not supplied)
     gdal_thread_count = 1 if not hasattr(args, 'threads') else args.threads
@@ -815,17 +966,31 @@ def process_image(srcfp, dstfp, args, target_extent_geom=None):
 
     ##  Initialize ImageInfo object with filename-based and argument-based attributes
     try:
-        info = ImageInfo(srcfp, os.path.dirname(dstfp), wd, args)
+        with timer.stage('metadata'):
+            info = ImageInfo(srcfp, os.path.dirname(dstfp), wd, args)
     except Exception as e:
         logger.error(e)
         err = 1
     else:
+        timer.fields['sensor'] = info.sat
+        ## Resume after the last stage the journal records as complete, unless the output is already done
+        jrnl = journal.Journal(info.dstfp)
+        if jrnl.is_complete(journal.STAGE_DONE):
+            jrnl.reset()
+        pyramids_done = jrnl.is_complete(journal.STAGE_PYRAMIDS)
+        stats_done = pyramids_done or jrnl.is_complete(journal.STAGE_CALC_STATS)
+        warp_recorded = stats_done or jrnl.is_complete(journal.STAGE_WARP)
+
         # Cleanup temp files from failed or interrupted processing attempt
         ik_stacked_sem = "{}.stacked".format(os.path.join(wd, info.srcfn))
+        temp_files = [info.dstfp, info.rawvrt, info.vrtfile]
         if args.wd or os.path.isfile(ik_stacked_sem):
-            utils.delete_temp_files([info.dstfp, info.rawvrt, info.warpfile, info.vrtfile, info.localsrc])
-        else:
-            utils.delete_temp_files([info.dstfp, info.rawvrt, info.warpfile, info.vrtfile])
+            temp_files.append(info.localsrc)
+        if not warp_recorded:
+            temp_files.append(info.warpfile)
+        if stats_done:
+            temp_files = [f for f in temp_files if f != info.localdst]
+        utils.delete_temp_files(temp_files)
 
         ## Verify that dem and ortho_height are not both specified
         if args.dem is not None and args.ortho_height is not None:
@@ -898,7 +1063,8 @@ def process_image(srcfp, dstfp, args, target_extent_geom=None):
                     logger.error("1 or more IKONOS multispectral member images are missing %s", ' '.join(members))
                     err = 1
                 elif not os.path.isfile(info.localsrc):
-                    rc = stack_ik_bands(info.localsrc, members)
+                    with timer.stage('ik_stack'):
+                        rc = stack_ik_bands(info.localsrc, members, gdal_backend.get_backend_from_args(args))
                     #if not os.path.isfile(os.path.join(wd, os.path.basename(info.metapath))):
                     #    shutil.copy(info.metapath, os.path.join(wd, os.path.basename(info.metapath)))
                     if rc == 1:
@@ -911,18 +1077,25 @@ def process_image(srcfp, dstfp, args, target_extent_geom=None):
         if not err == 1 and args.wd:
             def copy_to_wd(source_fp, wd):
                 logger.info("Copying image to working directory")
+                if getattr(args, 'staged_read', False):
+                    return stage_source(info, source_fp, wd, args, target_extent_geom)
                 copy_list = glob.glob("{}.*".format(os.path.splitext(source_fp)[0]))
                 # copy_list.append(info.metapath)
                 for fpi in copy_list:
                     fpo = os.path.join(wd, os.path.basename(fpi))
                     if not os.path.isfile(fpo):
                         shutil.copy2(fpi, fpo)
+                return 0
 
             if os.path.isfile(info.srcfp):
-                copy_to_wd(info.srcfp, wd)
+                with timer.stage('copy_to_wd'):
+                    rc = copy_to_wd(info.srcfp, wd)
+                if rc == 1:
+                    err = 1
 
             elif os.path.isfile(info.localsrc) and not os.path.isfile(info.srcfp):
-                copy_to_wd(info.localsrc, wd)
+                with timer.stage('copy_to_wd'):
+                    copy_to_wd(info.localsrc, wd)
 
             else:
                 logger.warning("Source image does not exist: %s", info.srcfp)
@@ -930,129 +1103,289 @@ def process_image(srcfp, dstfp, args, target_extent_geom=None):
 
         ## Open raster to get further processing info
         if not err == 1:
-            rc = info.get_image_stats(args)
-            if rc != 1:
-                # Set target_extent variables, including user-supplied extent if applicable
-                rc = info.set_extent_geom(target_extent_geom)
+            with timer.stage('image_stats'):
+                rc = info.get_image_stats(args)
+                if rc != 1:
+                    # Set target_extent variables, including user-supplied extent if applicable
+                    rc = info.set_extent_geom(target_extent_geom)
             if rc == 1:
                 err = 1
                 logger.error("Error in stats calculation")
+            else:
+                timer.fields['bands'] = info.bands
+                timer.fields['megapixels'] = info.xsize * info.ysize / 1e6
 
-    # Check if DEM is set to 'auto'
-    if args.dem == 'auto':
+    # Check if DEM is set to 'auto'.  pgc_ortho normally resolves the DEM of each image while planning the tasks.
+    if args.dem == 'auto' and not err == 1:
         try:
-            # Attempt to read the config file
-            config = configparser.ConfigParser()
-            config_file_path = args.config_file
-            if not os.path.isfile(config_file_path):
-                logger.error("Config file not found: {}".format(config_file_path))
-                logger.error("Please provide a valid config file path for 'auto' DEM setting.")
-                err = 1
-
-        except (configparser.NoSectionError, configparser.Error) as e:
-            logger.error("Error reading config file: %s", e)
-            logger.error("Please ensure the config file exists and is correctly formatted for 'auto' DEM.")
+            gpkg_path = dem_catalog.get_gpkg_path(args.config_file)
+            with timer.stage('auto_dem'):
+                args.dem = check_image_auto_dem(info.geometry_wkt, info.spatial_ref, gpkg_path)
+        except RuntimeError as e:
+            logger.error(e)
             err = 1
-
         else:
-            config.read(config_file_path)
-            gpkg_path = config.get("default", "gpkg_path", fallback=None)
-            if platform.system() == "Windows":
-                gpkg_path = config.get("windows", "gpkg_path", fallback=gpkg_path)
-
-            if not gpkg_path:
-                logger.error("gpkg_path not found in config file. Please check the config file format.")
-                err = 1
-            elif not os.path.isfile(gpkg_path):
-                logger.error("The gpkg file does not exist at the expected location: {}".format(gpkg_path))
-                err = 1
-            # Proceed with 'auto' DEM processing if no errors
-            if not err == 1:
-                try:
-                    args.dem = check_image_auto_dem(info.geometry_wkt, info.spatial_ref, gpkg_path)
-                except RuntimeError as e:
-                    logger.error(e)
-                    err = 1
-                else:
-                    if args.dem is None:
-                        logger.info("No candidate DEM found overlapping image. Proceeding without a DEM")
-                    else:
-                        logger.info(f"Auto DEM selected: {args.dem}")
+            if args.dem is None:
+                logger.info("No candidate DEM found overlapping image. Proceeding without a DEM")
+            else:
+                logger.info(f"Auto DEM selected: {args.dem}")
 
     if not err == 1:
         ## Check if image overlaps reference DEM
         if args.dem and not args.skip_dem_overlap_check:
-            overlap = overlap_check(info.geometry_wkt, info.spatial_ref, args.dem)
+            with timer.stage('dem_overlap'):
+                overlap = overlap_check(info.geometry_wkt, info.spatial_ref, args.dem)
             if overlap is False:
                 err = 1
 
-        if not os.path.isfile(info.dstfp):
+        ## Reuse the warp of an interrupted run or the warp cache if it was made with the same parameters and is
+        ## intact.  A single pass warp is a VRT read by calc_stats, so there is nothing to reuse.
+        warp_done = False
+        default_warpfile = info.warpfile
+        if not err == 1 and not getattr(args, 'single_pass', False):
+            warp_key = get_warp_key(args, info)
+            warp_entry = jrnl.stages.get(journal.STAGE_WARP, {})
+            if warp_recorded and warp_entry.get('key') != warp_key:
+                logger.info("Warp parameters changed since the last run, not resuming")
+                warp_recorded = stats_done = pyramids_done = False
+                utils.delete_temp_files([info.localdst])
+            warp_done = stats_done or (warp_recorded and is_valid_warp(jrnl, warp_key))
+            if warp_done:
+                logger.info("Resuming after the %s stage", journal.STAGE_PYRAMIDS if pyramids_done else
+                            journal.STAGE_CALC_STATS if stats_done else journal.STAGE_WARP)
+                info.warpfile = warp_entry.get('path', info.warpfile)
+            else:
+                utils.delete_temp_files([info.warpfile])
+
+            cache_dir = getattr(args, 'warp_cache', None)
+            if cache_dir and not warp_done:
+                info.warpfile = warp_cache.get_entry_path(cache_dir, info.srcfn, warp_key)
+                if is_valid_warp(journal.Journal(info.warpfile), warp_key):
+                    logger.info("Using cached warp: %s", info.warpfile)
+                    warp_cache.touch(info.warpfile)
+                    warp_done = True
+                else:
+                    utils.delete_temp_files([info.warpfile])
+        warp_retained = info.warpfile != default_warpfile
+
+        if not os.path.isfile(info.dstfp) or stats_done:
             ## Warp Image
-            if not err == 1 and not os.path.isfile(info.warpfile):
-                rc = warp_image(args, info, gdal_thread_count=gdal_thread_count)
+            if not err == 1 and not warp_done and not os.path.isfile(info.warpfile):
+                ## runs of other products of the image may warp it into the cache at the same time, so each
+                ## warps to its own temporary file and moves it into place
+                cache_fp = info.warpfile
+                if warp_retained:
+                    info.warpfile = "{}.{}.part".format(cache_fp, os.getpid())
+                with timer.stage('warp'):
+                    rc = warp_image(args, info, gdal_thread_count=gdal_thread_count)
+                if warp_retained:
+                    if rc != 1 and os.path.isfile(info.warpfile):
+                        try:
+                            os.replace(info.warpfile, cache_fp)
+                        except OSError as e:
+                            logger.error("Cannot move the warp into the cache: %s", e)
+                            utils.delete_temp_files([info.warpfile])
+                            rc = 1
+                    else:
+                        utils.delete_temp_files([info.warpfile])
+                    info.warpfile = cache_fp
                 if rc == 1:
                     err = 1
                     logger.error("Error in image warping")
+                elif os.path.isfile(info.warpfile) and not getattr(args, 'single_pass', False):
+                    record_warp([jrnl, journal.Journal(info.warpfile)] if warp_retained else [jrnl],
+                                info.warpfile, warp_key)
+                    if warp_retained:
+                        max_bytes = getattr(args, 'warp_cache_size', warp_cache.ARGDEF_WARP_CACHE_SIZE) * 1024 ** 3
+                        warp_cache.evict(os.path.dirname(info.warpfile), max_bytes, keep=[info.warpfile])
 
             #### Calculate Output File
-            if not err == 1 and os.path.isfile(info.warpfile):
-                rc = calc_stats(args, info)
+            if not err == 1 and not stats_done and os.path.isfile(info.warpfile):
+                with timer.stage('calc_stats'):
+                    rc = calc_stats(args, info, gdal_thread_count=gdal_thread_count)
                 if rc == 1:
                     err = 1
                     logger.error("Error in image calculation")
+                elif os.path.isfile(info.localdst):
+                    jrnl.record(journal.STAGE_CALC_STATS, info.localdst)
+
+            #### Calculate Pyramids
+            if not err == 1 and not args.no_pyramids and not pyramids_done:
+                with timer.stage('pyramids'):
+                    rc = build_pyramids(args, info)
+                if rc == 1:
+                    err = 1
+                    logger.error("Error in building pyramids")
+                elif os.path.isfile(info.localdst):
+                    jrnl.record(journal.STAGE_PYRAMIDS, info.localdst)
 
         ##  Write Output Metadata
         if not err == 1:
-            rc = write_output_metadata(args, info)
+            with timer.stage('write_metadata'):
+                rc = write_output_metadata(args, info)
             if rc == 1:
                 err = 1
                 logger.error("Error in writing metadata file")
 
         ## Copy image to final location if working dir is used
+        uploading = False
         if args.wd is not None:
-            if not err == 1:
-                logger.info("Copying to destination directory")
-                for fpi in glob.glob("{}.*".format(os.path.splitext(info.localdst)[0])):
-                    fpo = os.path.join(info.dstdir, os.path.basename(fpi))
-                    if not os.path.isfile(fpo):
-                        shutil.copy2(fpi, fpo)
-            if not args.save_temps:
-                utils.delete_temp_files([info.localdst])
+            if not err == 1 and getattr(args, 'async_upload', False):
+                ## the uploader moves the image after its sidecars and deletes the local copies when done
+                logger.info("Queueing upload to destination directory")
+                upload_list = sorted(glob.glob("{}.*".format(os.path.splitext(info.localdst)[0])),
+                                     key=lambda fpi: fpi == info.localdst)
+                with timer.stage('copy_to_dst'):
+                    staging.get_uploader().submit(upload_list, info.dstdir, delete=not args.save_temps,
+                                                  callback=lambda: jrnl.record(journal.STAGE_DONE, info.dstfp,
+                                                                               checksum=True))
+                uploading = info.localdst in upload_list
+            else:
+                if not err == 1:
+                    ## each file is renamed into place when complete, and the image after its sidecars
+                    logger.info("Copying to destination directory")
+                    with timer.stage('copy_to_dst'):
+                        try:
+                            staging.copy_files(sorted(glob.glob("{}.*".format(os.path.splitext(info.localdst)[0])),
+                                                      key=lambda fpi: fpi == info.localdst), info.dstdir)
+                        except (IOError, OSError) as e:
+                            logger.error("Cannot copy to destination directory: %s", e)
+                            err = 1
+                if not args.save_temps:
+                    utils.delete_temp_files([info.localdst])
 
         ## Check If Done, Delete Temp Files
-        done = os.path.isfile(info.dstfp)
+        done = os.path.isfile(info.dstfp) or uploading
+        if done and not err == 1 and not uploading:
+            jrnl.record(journal.STAGE_DONE, info.dstfp, checksum=True)
         if done is False:
             err = 1
             logger.error("Final image not present")
 
+        ## A cached warp is kept, and so is a recorded warp if a later stage failed, for the next run to reuse
+        keep_warp = warp_retained or (err == 1 and jrnl.is_complete(journal.STAGE_WARP))
         if err == 1:
             logger.error("Processing failed: %s", info.srcfn)
-            if not args.save_temps:
-                if args.wd or os.path.isfile(ik_stacked_sem):
-                    utils.delete_temp_files([info.dstfp, info.rawvrt, info.warpfile, info.vrtfile, info.localsrc])
-                else:
-                    utils.delete_temp_files([info.dstfp, info.rawvrt, info.warpfile, info.vrtfile])
-
-        elif not args.save_temps:
+        if not args.save_temps:
+            temp_files = [info.dstfp, info.rawvrt, info.vrtfile] if err == 1 else [info.rawvrt, info.vrtfile]
+            if not keep_warp:
+                temp_files.append(info.warpfile)
             if args.wd or os.path.isfile(ik_stacked_sem):
-                utils.delete_temp_files([info.rawvrt, info.warpfile, info.vrtfile, info.localsrc])
-            else:
-                utils.delete_temp_files([info.rawvrt, info.warpfile, info.vrtfile])
+                temp_files.append(info.localsrc)
+            utils.delete_temp_files(temp_files)
         # Rename temp files if --save-temps
-        elif args.save_temps:
-            os.rename(info.rawvrt, info.rawvrt + ".save")
-            os.rename(info.vrtfile, info.vrtfile + ".save")
-            os.rename(info.warpfile, info.warpfile + ".save")
+        elif not err == 1:
+            for fp in [info.rawvrt, info.vrtfile] + ([] if warp_retained else [info.warpfile]):
+                if os.path.isfile(fp):
+                    os.rename(fp, fp + ".save")
 
     #### Calculate Total Time
     endtime = datetime.today()
     td = (endtime-starttime)
     logger.info("Total Processing Time: %s", td)
+    timer.log_record(rc=err)
     return err
 
 
-def stack_ik_bands(dstfp, members):
+def stage_source(info, source_fp, wd, args, target_extent_geom=None):
+    """
+    Stage a source image into the working directory for --staged-read.  If the target extent maps to a small
+    window of the image, only that window is written, as a tiled GeoTIFF carrying the adjusted RPCs in the file
+    instead of in .RPB or _rpc.txt sidecars, which warp_image accepts (has_rpc_metadata).  Otherwise
+    the raster and its metadata sidecars are copied in verified parallel chunks (see lib/staging.py).
+    """
+    localsrc = os.path.join(wd, os.path.basename(source_fp))
+    if os.path.isfile(localsrc):
+        return 0
+
+    if target_extent_geom is not None and info.spatial_ref is not None:
+        window = get_source_window(source_fp, target_extent_geom, info.spatial_ref.srs)
+        footprint = read_raster_footprint(source_fp, info.metadata_cache, info.srcfp) if window else None
+        if footprint is not None:
+            ## the image stats describe the whole source, not the staged window
+            info.raster_footprint = footprint
+            logger.info("Staging pixel window %s of %s", ' '.join([str(v) for v in window]), source_fp)
+            err, so, se = stage_source_window(source_fp, localsrc, window, gdal_backend.get_backend_from_args(args))
+            if err == 1:
+                logger.error("Cannot stage the pixel window of %s: %s", source_fp, se)
+            return err
+
+    try:
+        staging.copy_files(staging.get_stage_list(source_fp, info.metapath), wd)
+    except (IOError, OSError) as e:
+        logger.error("Cannot stage %s: %s", source_fp, e)
+        return 1
+    return 0
+
+
+def get_source_window(src_image, extent_geom, spatial_ref, pad=STAGE_WINDOW_PAD,
+                      max_fraction=STAGE_WINDOW_MAX_FRACTION):
+    """
+    Return the pixel window (xoff, yoff, xsize, ysize) of a source image with RPCs that the extent geometry, in
+    spatial_ref, maps to at any height in the RPC height range, padded by pad pixels.  Returns None if the
+    image has no RPCs or the window covers more than max_fraction of the image.
+    """
+    try:
+        ds = gdal.Open(src_image, gdalconst.GA_ReadOnly)
+    except RuntimeError as e:
+        logger.error("Cannot open dataset: %s", e)
+        return None
+    rpc = ds.GetMetadata('RPC')
+    if not rpc or 'HEIGHT_OFF' not in rpc or 'HEIGHT_SCALE' not in rpc:
+        return None
+    xsize = ds.RasterXSize
+    ysize = ds.RasterYSize
+
+    geom = extent_geom.Clone()
+    if not spatial_ref.IsSame(srs_wgs84):
+        geom.Transform(osr.CoordinateTransformation(spatial_ref, srs_wgs84))
+    minlon, maxlon, minlat, maxlat = geom.GetEnvelope()
+    geom.Segmentize(max(maxlon - minlon, maxlat - minlat) / 16.0 or 1.0)
+    points = []
+    stack = [geom]
+    while stack:
+        g = stack.pop()
+        if g.GetGeometryCount() > 0:
+            stack.extend([g.GetGeometryRef(i) for i in range(g.GetGeometryCount())])
+        else:
+            points.extend([(p[0], p[1], 0) for p in g.GetPoints() or []])
+
+    height_off = float(rpc['HEIGHT_OFF'].split()[0])
+    height_scale = float(rpc['HEIGHT_SCALE'].split()[0])
+    pixels = []
+    for height in (height_off - height_scale, height_off + height_scale):
+        transformer = gdal.Transformer(ds, None, ['METHOD=RPC', 'RPC_HEIGHT={}'.format(height)])
+        results, success = transformer.TransformPoints(1, points)
+        if not all(success):
+            return None
+        pixels.extend(results)
+    ds = None
+    if len(pixels) == 0:
+        return None
+
+    xoff = max(int(math.floor(min([p[0] for p in pixels]))) - pad, 0)
+    yoff = max(int(math.floor(min([p[1] for p in pixels]))) - pad, 0)
+    xend = min(int(math.ceil(max([p[0] for p in pixels]))) + pad, xsize)
+    yend = min(int(math.ceil(max([p[1] for p in pixels]))) + pad, ysize)
+    if xend <= xoff or yend <= yoff:
+        return None
+    if (xend - xoff) * (yend - yoff) > max_fraction * xsize * ysize:
+        return None
+    return xoff, yoff, xend - xoff, yend - yoff
+
+
+def stage_source_window(src_image, dstfp, window, backend=None):
+    """Write a pixel window of a source image to a tiled GeoTIFF.  gdal_translate shifts the RPCs and GCPs."""
+    if backend is None:
+        backend = gdal_backend.get_backend()
+    options = '-of GTiff -srcwin {} {} {} {} -co TILED=YES -co BIGTIFF=IF_SAFER'.format(*window)
+    return backend.translate(src_image, dstfp, options)
+
+
+def stack_ik_bands(dstfp, members, backend=None):
     rc = 0
+    if backend is None:
+        backend = gdal_backend.get_backend()
     band_dict = {1: gdalconst.GCI_BlueBand,
                  2: gdalconst.GCI_GreenBand,
                  3: gdalconst.GCI_RedBand,
@@ -1105,16 +1438,13 @@ def stack_ik_bands(dstfp, members):
         #### Close the source dataset
         src_ds = None
 
-        cmd = 'gdalbuildvrt -separate "{}" "{}"'.format(vrt, '" "'.join(members))
-        (err, so, se) = taskhandler.exec_cmd(cmd)
+        (err, so, se) = backend.build_vrt(vrt, members, '-separate')
         if err == 1:
             rc = 1
-        cmd = 'gdal_translate -a_srs "{}" -of NITF -co "IC=NC" {} {} "{}" "{}"'.format(s_srs_proj4,
-                                                                                       " ".join(m_list),
-                                                                                       " ".join(tre_list),
-                                                                                       vrt,
-                                                                                       dstfp)
-        (err, so, se) = taskhandler.exec_cmd(cmd)
+        options = '-a_srs "{}" -of NITF -co "IC=NC" {} {}'.format(s_srs_proj4,
+                                                                " ".join(m_list),
+                                                                " ".join(tre_list))
+        (err, so, se) = backend.translate(vrt, dstfp, options)
         if err == 1:
             rc = 1
 
@@ -1236,7 +1566,33 @@ def get_epsg_from_lat_lon(lat, lon, mode='auto', utm_nad83=False):
     return epsg_code
 
 
-def calc_stats(args, info):
+def get_stretch_lut(info, band, imax, omax, CFlist=None):
+    """
+    Return the VRT LUT string ("in:out,in:out,...") that applies the image stretch to a band
+    """
+    if info.stretch == "ns":
+        LUT = "0:0,{}:{}".format(imax, omax)
+    else:
+        calfact, offset = CFlist[band-1]
+        if info.stretch == "rf":
+            LUT = "0:{},{}:{}".format(offset*omax, imax, (imax*calfact+offset)*omax)
+        elif info.stretch == "rd":
+            LUT = "0:{},{}:{}".format(offset, imax, imax*calfact+offset)
+        elif info.stretch == "mr":
+            # modified reflectance is rf with a non-linear curve applied according
+            # to the following histgram points
+            iLUT = [0, 0.125, 0.25, 0.375, 0.625, 1]
+            oLUT = [0, 0.375, 0.625, 0.75, 0.875, 1]
+            lLUT = map(lambda x: "{}:{}".format(
+                (iLUT[x]-offset)/calfact,  # find original DN for each 0-1 iLUT
+                # step by applying reverse reflectance transformation
+                omax*oLUT[x]  # output value for each 0-1 oLUT step multiplied by omax
+            ), range(len(iLUT)))
+            LUT = ",".join(lLUT)
+    return LUT
+
+
+def calc_stats(args, info, gdal_thread_count=1):
 
     logger.info("Calculating image with stats")
     rc = 0
@@ -1282,6 +1638,7 @@ def calc_stats(args, info):
     dst_nodata = get_destination_nodata(args.outtype)
 
     #### Stretch
+    CFlist = None
     if info.stretch != "ns":
         CFlist = get_calibration_factors(info)
         if len(CFlist) == 0:
@@ -1292,62 +1649,64 @@ def calc_stats(args, info):
             logger.error("Metadata image calibration factors have fewer bands than the image")
             return 1
 
+    output_writer = getattr(args, 'output_writer', ARGDEF_OUTPUT_WRITER)
+    luts = []
+
     wds = gdal.Open(info.warpfile, gdalconst.GA_ReadOnly)
     if wds is not None:
 
         xsize = wds.RasterXSize
         ysize = wds.RasterYSize
-
-        vds = VRTdriver.CreateCopy(info.vrtfile, wds, 0)
-        if vds is not None:
-            for band in range(1, vds.RasterCount+1):
-                if info.stretch == "ns":
-                    LUT = "0:0,{}:{}".format(imax, omax)
-                else:
-                    calfact, offset = CFlist[band-1]
-                    if info.stretch == "rf":
-                        LUT = "0:{},{}:{}".format(offset*omax, imax, (imax*calfact+offset)*omax)
-                    elif info.stretch == "rd":
-                        LUT = "0:{},{}:{}".format(offset, imax, imax*calfact+offset)
-                    elif info.stretch == "mr":
-                        # modified reflectance is rf with a non-linear curve applied according
-                        # to the following histgram points
-                        iLUT = [0, 0.125, 0.25, 0.375, 0.625, 1]
-                        oLUT = [0, 0.375, 0.625, 0.75, 0.875, 1]
-                        lLUT = map(lambda x: "{}:{}".format(
-                            (iLUT[x]-offset)/calfact,  # find original DN for each 0-1 iLUT
-                            # step by applying reverse reflectance transformation
-                            omax*oLUT[x]  # output value for each 0-1 oLUT step multiplied by omax
-                        ), range(len(iLUT)))
-                        LUT = ",".join(lLUT)
-                    #logger.debug(LUT)
-
-                if info.stretch != "ns":
-                    logger.debug("Band Calibration Factors: %i %f %f", band, CFlist[band - 1][0], CFlist[band - 1][1])
-                logger.debug("Band stretch parameters: %i %s", band, LUT)
-
-                ComplexSourceXML = ('<ComplexSource>'
-                                    '   <SourceFilename relativeToVRT="0">{0}</SourceFilename>'
-                                    '   <SourceBand>{1}</SourceBand>'
-                                    '   <ScaleOffset>0</ScaleOffset>'
-                                    '   <ScaleRatio>1</ScaleRatio>'
-                                    '   <LUT>{2}</LUT>'
-                                    '   <SrcRect xOff="0" yOff="0" xSize="{3}" ySize="{4}"/>'
-                                    '   <DstRect xOff="0" yOff="0" xSize="{3}" ySize="{4}"/>'
-                                    '   <NODATA>{5}</NODATA>'
-                                    '</ComplexSource>)'.format(info.warpfile, band, LUT, xsize, ysize, dst_nodata))
-
-                vds.GetRasterBand(band).SetMetadataItem("source_0", ComplexSourceXML, "vrt_sources")
-                vds.GetRasterBand(band).SetNoDataValue(dst_nodata)
-                if vds.GetRasterBand(band).GetColorInterpretation() == gdalconst.GCI_AlphaBand:
-                    vds.GetRasterBand(band).SetColorInterpretation(gdalconst.GCI_Undefined)
-        else:
-            logger.error("Cannot create virtual dataset: %s", info.vrtfile)
+        band_count = wds.RasterCount
+
+        for band in range(1, band_count+1):
+            LUT = get_stretch_lut(info, band, imax, omax, CFlist)
+            if info.stretch != "ns":
+                logger.debug("Band Calibration Factors: %i %f %f", band, CFlist[band - 1][0], CFlist[band - 1][1])
+            logger.debug("Band stretch parameters: %i %s", band, LUT)
+            luts.append(LUT)
+
+        if output_writer == 'translate':
+            if os.path.splitext(info.warpfile)[1].lower() == '.vrt':
+                ## A copy of a warped VRT is itself a warped VRT, which cannot hold the LUT sources below,
+                ## so build a plain VRT with matching bands instead
+                vds = VRTdriver.Create(info.vrtfile, xsize, ysize, 0)
+                if vds is not None:
+                    vds.SetGeoTransform(wds.GetGeoTransform())
+                    vds.SetProjection(wds.GetProjection())
+                    for band in range(1, band_count+1):
+                        wband = wds.GetRasterBand(band)
+                        vds.AddBand(wband.DataType)
+                        vds.GetRasterBand(band).SetColorInterpretation(wband.GetColorInterpretation())
+            else:
+                vds = VRTdriver.CreateCopy(info.vrtfile, wds, 0)
+            if vds is not None:
+                for band in range(1, vds.RasterCount+1):
+                    ## warp pixels equal to the warp's nodata become the output nodata
+                    src_nodata = wds.GetRasterBand(band).GetNoDataValue()
+                    ComplexSourceXML = ('<ComplexSource>'
+                                        '   <SourceFilename relativeToVRT="0">{0}</SourceFilename>'
+                                        '   <SourceBand>{1}</SourceBand>'
+                                        '   <ScaleOffset>0</ScaleOffset>'
+                                        '   <ScaleRatio>1</ScaleRatio>'
+                                        '   <LUT>{2}</LUT>'
+                                        '   <SrcRect xOff="0" yOff="0" xSize="{3}" ySize="{4}"/>'
+                                        '   <DstRect xOff="0" yOff="0" xSize="{3}" ySize="{4}"/>'
+                                        '   <NODATA>{5}</NODATA>'
+                                        '</ComplexSource>)'.format(info.warpfile, band, luts[band-1], xsize, ysize,
+                                                                   dst_nodata if src_nodata is None else src_nodata))
+
+                    vds.GetRasterBand(band).SetMetadataItem("source_0", ComplexSourceXML, "vrt_sources")
+                    vds.GetRasterBand(band).SetNoDataValue(dst_nodata)
+                    if vds.GetRasterBand(band).GetColorInterpretation() == gdalconst.GCI_AlphaBand:
+                        vds.GetRasterBand(band).SetColorInterpretation(gdalconst.GCI_Undefined)
+            else:
+                logger.error("Cannot create virtual dataset: %s", info.vrtfile)
+            vds = None
 
     else:
         logger.error("Cannot open dataset: %s", info.warpfile)
 
-    vds = None
     wds = None
 
     if args.format == 'GTiff':
@@ -1374,38 +1733,48 @@ def calc_stats(args, info):
     else:
         co = ''
 
-    pf = platform.platform()
-    if pf.startswith("Linux"):
-        config_options = '--config GDAL_CACHEMAX 2048'
-    else:
-        config_options = ''
-
-    base_cmd = 'gdal_translate -stats'
-
-    cmd = ('{} {} -ot {} -a_srs "{}" {}{}-of {} "{}" "{}"'.format(
-        base_cmd,
-        config_options,
-        args.outtype,
-        info.spatial_ref.proj4,
-        info.rgb_bands,
-        co,
-        args.format,
-        info.vrtfile,
-        info.localdst
-        ))
-
-    (err, so, se) = taskhandler.exec_cmd(cmd)
-    if err == 1:
-        rc = 1
+    max_memory = getattr(args, 'max_memory', stream_writer.ARGDEF_MAX_MEMORY)
+    backend = gdal_backend.get_backend_from_args(args)
+
+    if output_writer == 'stream':
+        if len(luts) > 0:
+            err = stream_writer.write_stretched(
+                info.warpfile,
+                info.localdst,
+                luts,
+                dst_nodata,
+                args.outtype,
+                args.format,
+                co,
+                prj,
+                band_list=stream_writer.parse_band_list(info.rgb_bands, len(luts)),
+                threads=gdal_thread_count,
+                max_memory=max_memory
+            )
+            if err == 1:
+                rc = 1
+        else:
+            rc = 1
 
-    #### Calculate Pyramids
-    if not args.no_pyramids:
-        if args.format in ["GTiff"]:
-            if os.path.isfile(info.localdst):
-                cmd = ('gdaladdo -r {} "{}" 2 4 8 16'.format(args.pyramid_type, info.localdst))
-                (err, so, se) = taskhandler.exec_cmd(cmd)
-                if err == 1:
-                    rc = 1
+    else:
+        pf = platform.platform()
+        if pf.startswith("Linux"):
+            config_options = '--config GDAL_CACHEMAX {}'.format(max_memory)
+        else:
+            config_options = ''
+
+        options = ('-stats {} -ot {} -a_srs "{}" {}{}-of {}'.format(
+            config_options,
+            args.outtype,
+            info.spatial_ref.proj4,
+            info.rgb_bands,
+            co,
+            args.format
+            ))
+
+        (err, so, se) = backend.translate(info.vrtfile, info.localdst, options)
+        if err == 1:
+            rc = 1
 
     #### Write .prj File
     if os.path.isfile(info.localdst):
@@ -1417,6 +1786,18 @@ def calc_stats(args, info):
     return rc
 
 
+def build_pyramids(args, info):
+    """Build the overviews of a GTiff output image"""
+    rc = 0
+    if args.format in ["GTiff"]:
+        if os.path.isfile(info.localdst):
+            backend = gdal_backend.get_backend_from_args(args)
+            (err, so, se) = backend.build_overviews(info.localdst, args.pyramid_type, [2, 4, 8, 16])
+            if err == 1:
+                rc = 1
+    return rc
+
+
 def get_image_geometry_info(src_image, spatial_ref, args, return_type='extent_geom'):
     return_type_choices = ['extent_geom', 'epsg_code']
     if return_type not in return_type_choices:
@@ -1804,11 +2185,13 @@ def prettify(root):
 def warp_image(args, info, gdal_thread_count=1):
 
     rc = 0
+    backend = gdal_backend.get_backend_from_args(args)
 
     pf = platform.platform()
     if pf.startswith("Linux"):
-        config_options = '-wm 2000 --config GDAL_CACHEMAX 2048 --config GDAL_NUM_THREADS {0} -wo NUM_THREADS={0}'.\
-            format(gdal_thread_count)
+        max_memory = getattr(args, 'max_memory', stream_writer.ARGDEF_MAX_MEMORY)
+        config_options = '-wm {1} --config GDAL_CACHEMAX {2} --config GDAL_NUM_THREADS {0} -wo NUM_THREADS={0}'.\
+            format(gdal_thread_count, min(2000, max_memory), max_memory)
     else:
         config_options = '--config GDAL_NUM_THREADS {0} -wo NUM_THREADS={0}'.format(gdal_thread_count)
     if type(gdal_thread_count) == str:
@@ -1818,6 +2201,13 @@ def warp_image(args, info, gdal_thread_count=1):
         if gdal_thread_count > 1:
             config_options += ' -multi'
 
+    ## In single pass mode the warp is written as a warped VRT that is evaluated block by block
+    ## while calc_stats writes the output, instead of a full resolution GTiff intermediate
+    if os.path.splitext(info.warpfile)[1].lower() == '.vrt':
+        warp_format_options = '-of VRT -co "BLOCKXSIZE=512" -co "BLOCKYSIZE=512" '
+    else:
+        warp_format_options = '-of GTiff -co "TILED=YES" -co "BIGTIFF=YES" '
+
     if not os.path.isfile(info.warpfile):
 
         logger.info("Warping Image")
@@ -1842,7 +2232,8 @@ def warp_image(args, info, gdal_thread_count=1):
                     # rc = 1
 
                 # if rpb_p:
-                if True:
+                ## a pixel window staged by --staged-read carries its shifted RPCs in the GeoTIFF, not in a sidecar
+                if not has_rpc_metadata(info.localsrc):
                     if rpb_p is None or not os.path.isfile(rpb_p):
                         err = extract_rpb(info.localsrc, rpb_p)
                         if err == 1:
@@ -1853,8 +2244,7 @@ def warp_image(args, info, gdal_thread_count=1):
                         rc = 1
 
         #### convert to VRT and modify 4th band
-        cmd = 'gdal_translate -of VRT "{0}" "{1}"'.format(info.localsrc, info.rawvrt)
-        (err, so, se) = taskhandler.exec_cmd(cmd)
+        (err, so, se) = backend.translate(info.localsrc, info.rawvrt, '-of VRT')
         if err == 1:
             rc = 1
 
@@ -1868,7 +2258,7 @@ def warp_image(args, info, gdal_thread_count=1):
         src_nodata_list = ["0"] * info.bands
 
         # This sets the NoData value in all bands in the destination image based on output data type
-        dst_nodata = get_destination_nodata(args.outtype)
+        dst_nodata = get_warp_nodata(args)
         dst_nodata_list = [str(dst_nodata)] * info.bands
 
         if not args.skip_warp:
@@ -1890,48 +2280,130 @@ def warp_image(args, info, gdal_thread_count=1):
                     ds = None
 
                 #### GDALWARP Command
-                cmd = 'gdalwarp {} -srcnodata "{}" -dstnodata "{}" -of GTiff -ot Float32 {}{}{}{}-co "TILED=YES" -co "BIGTIFF=YES" ' \
-                      '-t_srs "{}" -r {} -rpc -to "{}" "{}" "{}"'.format(
+                options = '{} -srcnodata "{}" -dstnodata "{}" {}-ot Float32 {}{}{}{}-t_srs "{}" -r {} -rpc ' \
+                          '-to "{}"'.format(
+                            config_options,
+                            " ".join(src_nodata_list),
+                            " ".join(dst_nodata_list),
+                            warp_format_options,
+                            info.centerlong,
+                            info.extent,
+                            info.res,
+                            info.tap,
+                            info.spatial_ref.proj4,
+                            args.resample,
+                            to
+                            )
+
+                (err, so, se) = backend.warp(info.rawvrt, info.warpfile, options)
+                if err == 1:
+                    rc = 1
+
+        else:
+            #### GDALWARP Command
+            options = '{} -srcnodata "{}" -dstnodata "{}" {}-ot UInt16 {}{}-t_srs "{}" -r {}'.format(
                         config_options,
                         " ".join(src_nodata_list),
                         " ".join(dst_nodata_list),
-                        info.centerlong,
-                        info.extent,
+                        warp_format_options,
                         info.res,
                         info.tap,
                         info.spatial_ref.proj4,
-                        args.resample,
-                        to,
-                        info.rawvrt,
-                        info.warpfile
+                        args.resample
                         )
 
-                (err, so, se) = taskhandler.exec_cmd(cmd)
-                if err == 1:
-                    rc = 1
-
-        else:
-            #### GDALWARP Command
-            cmd = 'gdalwarp {} -srcnodata "{}" -dstnodata "{}" -of GTiff -ot UInt16 {}{}-co "TILED=YES" -co "BIGTIFF=YES" -t_srs ' \
-                  '"{}" -r {} "{}" "{}"'.format(
-                    config_options,
-                    " ".join(src_nodata_list),
-                    " ".join(dst_nodata_list),
-                    info.res,
-                    info.tap,
-                    info.spatial_ref.proj4,
-                    args.resample,
-                    info.rawvrt,
-                    info.warpfile
-                    )
-
-            (err, so, se) = taskhandler.exec_cmd(cmd)
+            (err, so, se) = backend.warp(info.rawvrt, info.warpfile, options)
             if err == 1:
                 rc = 1
 
         return rc
 
 
+def get_warp_key(args, info):
+    """
+    Return a digest of everything the warp of an image depends on: the source and DEM files, the warp options and
+    the output grid.  Outputs that differ only in stretch or format share a key, and with --warp-cache so do outputs
+    that differ in output type.
+    """
+    source = info.srcfp if os.path.isfile(info.srcfp) else info.localsrc
+    params = {
+        'source': [os.path.basename(source), metadata_cache.get_file_signature(source)],
+        'dem': [args.dem, metadata_cache.get_file_signature(args.dem)] if args.dem else None,
+        'ortho_height': args.ortho_height,
+        'skip_warp': args.skip_warp,
+        'resample': args.resample,
+        'bands': info.bands,
+        'dst_nodata': get_warp_nodata(args),
+        'grid': [info.centerlong, info.extent, info.res, info.tap, info.spatial_ref.proj4],
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_warp_properties(warpfile):
+    """Return the dimensions, data type and nodata values of a warped image, or None if it cannot be opened"""
+    try:
+        ds = gdal.Open(warpfile, gdalconst.GA_ReadOnly)
+    except RuntimeError as e:
+        logger.error("Cannot open dataset: %s", e)
+        return None
+    if ds is None:
+        return None
+    bands = [ds.GetRasterBand(i) for i in range(1, ds.RasterCount + 1)]
+    properties = {
+        'xsize': ds.RasterXSize,
+        'ysize': ds.RasterYSize,
+        'datatypes': [gdal.GetDataTypeName(band.DataType) for band in bands],
+        'nodata': [band.GetNoDataValue() for band in bands],
+    }
+    ds = None
+    return properties
+
+
+def record_warp(journals, warpfile, warp_key):
+    """Record the warp stage in each journal with the key, properties and checksum of the warped image"""
+    properties = get_warp_properties(warpfile)
+    if properties is None:
+        return
+    properties['key'] = warp_key
+    journals[0].record(journal.STAGE_WARP, warpfile, checksum=True, **properties)
+    properties['crc32'] = journals[0].stages[journal.STAGE_WARP]['crc32']
+    for jrnl in journals[1:]:
+        jrnl.record(journal.STAGE_WARP, warpfile, **properties)
+
+
+def is_valid_warp(jrnl, warp_key):
+    """
+    Return True if the journal records a warp with the given key and the warped image still matches the record:
+    size, dimensions, data types, nodata values and checksum
+    """
+    if not jrnl.is_complete(journal.STAGE_WARP):
+        return False
+    entry = jrnl.stages[journal.STAGE_WARP]
+    if entry.get('key') != warp_key:
+        return False
+    properties = get_warp_properties(entry['path'])
+    if properties is None or any([entry.get(k) != v for k, v in properties.items()]):
+        logger.warning("Warped image does not match its journal: %s", entry['path'])
+        return False
+    if not jrnl.verify_checksum(journal.STAGE_WARP):
+        logger.warning("Checksum mismatch in warped image: %s", entry['path'])
+        return False
+    return True
+
+
+def has_rpc_metadata(src_image):
+    """Return True if GDAL reads RPCs for an image, either from the file itself or from a sidecar"""
+    try:
+        ds = gdal.Open(src_image, gdalconst.GA_ReadOnly)
+    except RuntimeError:
+        return False
+    if ds is None:
+        return False
+    rpc = ds.GetMetadata('RPC')
+    ds = None
+    return bool(rpc)
+
+
 def get_rpc_height(info):
     ds = gdal.Open(info.localsrc, gdalconst.GA_ReadOnly)
     if ds is not None:
@@ -2059,75 +2531,191 @@ def check_image_auto_dem(geometry_wkt, spatial_ref, gpkg_path):
         gpkg_path (str): Path to the GeoPackage file.
 
     Returns:
-        str: The value of the "dempath" field from the final overlapping layer, or None if no overlap is found.
+        str: The value of the "dempath" field of the best ranked DEM containing the image, or None if no
+        DEM contains it.
     """
-    # image properties
-    imageSpatialReference = spatial_ref.srs
-    image_geometry = ogr.CreateGeometryFromWkt(geometry_wkt)
+    return dem_catalog.get_catalog(gpkg_path).find_dem(geometry_wkt, spatial_ref.srs)
+
+def get_source_footprint_geom(srcfp, cache=None):
+    """
+    Return the footprint polygon of a source image from the corners of the raster, and its spatial reference,
+    without reading the vendor metadata.  Returns (None, None) if the raster cannot be opened.
+    """
+    srcdir, srcfn = os.path.split(srcfp)
+    src_image = srcfp
+    if not os.path.isfile(srcfp) and srcfn.startswith("IK01") and "_msi_" in srcfn:
+        src_image = os.path.join(srcdir, srcfn.replace("_msi_", "_blu_"))
+    footprint = read_raster_footprint(src_image, cache)
+    if footprint is None:
+        return None, None
+
+    ulx, uly, urx, ury, llx, lly, lrx, lry = footprint['corners']
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    ring.AddPoint(ulx, uly)
+    ring.AddPoint(urx, ury)
+    ring.AddPoint(lrx, lry)
+    ring.AddPoint(llx, lly)
+    ring.AddPoint(ulx, uly)
+    footprint_geom = ogr.Geometry(ogr.wkbPolygon)
+    footprint_geom.AddGeometry(ring)
+    return footprint_geom, utils.osr_srs_preserve_axis_order(osr.SpatialReference(footprint['proj']))
+
+
+def plan_auto_dems(task_list, args, header_list=None):
+    """
+    Select the DEM of each --dem auto task of pgc_ortho while planning, so the tasks do not each read the config
+    file and search the DEM GeoPackage.
+
+    task_list holds source paths, or rows of CSV argument values with the given header.  Returns the tasks as
+    rows with a 'dem' column, and the header: the DEM selected for the image, 'None' if no DEM contains it, or
+    'auto' if it could not be resolved here, which leaves it to the task.  Rows are sorted by DEM, and tasks
+    whose DEM is a VRT of tiled DEMs get a subset VRT of the tiles they overlap.  The task list is returned
+    unchanged if no task uses --dem auto.
+    """
+    if header_list is None and args.dem == 'auto':
+        rows = [[srcfp, 'auto'] for srcfp in task_list]
+        row_header_list = ['src', 'dem']
+    elif header_list is not None and 'dem' in header_list:
+        rows = [list(task) for task in task_list]
+        row_header_list = list(header_list)
+    elif header_list is not None and args.dem == 'auto':
+        rows = [list(task) + ['auto'] for task in task_list]
+        row_header_list = list(header_list) + ['dem']
+    else:
+        return task_list, header_list
+
+    src_index = row_header_list.index('src')
+    dem_index = row_header_list.index('dem')
+    auto_rows = [row for row in rows if row[dem_index] == 'auto']
+    if len(auto_rows) == 0:
+        return task_list, header_list
 
-    # Open the GeoPackage dataset
     try:
-        dataset = gdal.OpenEx(gpkg_path, gdal.OF_VECTOR)
-    except Exception as e:
-        raise RuntimeError("Error opening the GeoPackage file: %s", e)
-
-    num_layers = dataset.GetLayerCount()
-    overlapping_dems = []
-    dempath = None
-
-    selected_rank = 9999
-    selected_dem = None
-    # Iterate over each layer in the dataset
-    for i in range(num_layers):
-        layer = dataset.GetLayerByIndex(i)
-        if layer is None:
-            # Skip this layer if it's None
+        catalog = dem_catalog.get_catalog(dem_catalog.get_gpkg_path(args.config_file))
+    except RuntimeError as e:
+        logger.error("Cannot select DEMs while planning, each task will try again: %s", e)
+        return task_list, header_list
+
+    cache = metadata_cache.get_cache_from_args(args)
+    footprints = {}
+    for row in auto_rows:
+        footprint_geom, spatial_ref = get_source_footprint_geom(row[src_index], cache)
+        if footprint_geom is None:
             continue
+        try:
+            dem = catalog.find_dem(footprint_geom.ExportToWkt(), spatial_ref)
+        except RuntimeError as e:
+            logger.error("Cannot select DEMs while planning, each task will try again: %s", e)
+            break
+        row[dem_index] = dem if dem is not None else 'None'
+        footprints[row[src_index]] = (footprint_geom, spatial_ref)
+
+    dem_counts = collections.Counter([row[dem_index] for row in auto_rows])
+    logger.info("Selected DEMs of %i images while planning: %i DEMs, %i images without a DEM, %i left to the task",
+                len(auto_rows), len([dem for dem in dem_counts if dem not in ('None', 'auto')]),
+                dem_counts['None'], dem_counts['auto'])
+
+    vrt_dems = [dem for dem in dem_counts if dem.lower().endswith('.vrt')]
+    if vrt_dems:
+        rows = subset_auto_vrt_dems(rows, row_header_list, args, sorted(vrt_dems), footprints)
+    rows.sort(key=lambda row: (row[dem_index], row[src_index]))
+    return rows, row_header_list
+
 
-        layer_spatial_ref = layer.GetSpatialRef()
-        if layer_spatial_ref is None:
-            # Skip this layer if its spatial reference is None
+def get_vrt_dem_tiles(vrt_path):
+    """
+    Return an index of the SourceFilename of each SimpleSource of a VRT DEM by the envelope it covers, the
+    spatial reference of the VRT and its pixel size.  Raises RuntimeError if the VRT cannot be subset.
+    """
+    try:
+        root = ET.parse(vrt_path).getroot()
+    except (IOError, OSError, ET.ParseError) as e:
+        raise RuntimeError("Cannot read VRT: {}".format(e))
+    geotransform = root.find('GeoTransform')
+    srs_element = root.find('SRS')
+    if geotransform is None or srs_element is None:
+        raise RuntimeError("VRT has no geotransform or spatial reference")
+    gtf = [float(v) for v in geotransform.text.split(',')]
+    if gtf[2] != 0 or gtf[4] != 0:
+        raise RuntimeError("VRT geotransform is rotated")
+    spatial_ref = utils.osr_srs_preserve_axis_order(osr.SpatialReference())
+    spatial_ref.SetFromUserInput(srs_element.text)
+
+    tiles = []
+    for simple_source in root.iter('SimpleSource'):
+        source_filename = simple_source.find('SourceFilename')
+        dst_rect = simple_source.find('DstRect')
+        if source_filename is None or dst_rect is None:
+            raise RuntimeError("VRT SimpleSource without SourceFilename or DstRect")
+        if source_filename.get('relativeToVRT') == '1':
+            raise RuntimeError("VRT source paths are relative to the VRT")
+        xoff, yoff, xsize, ysize = [float(dst_rect.get(k)) for k in ('xOff', 'yOff', 'xSize', 'ySize')]
+        xs = (gtf[0] + xoff * gtf[1], gtf[0] + (xoff + xsize) * gtf[1])
+        ys = (gtf[3] + yoff * gtf[5], gtf[3] + (yoff + ysize) * gtf[5])
+        tiles.append(((min(xs), max(xs), min(ys), max(ys)), source_filename.text))
+    return dem_catalog.STRtree(tiles), spatial_ref, (abs(gtf[1]), abs(gtf[5]))
+
+
+def subset_auto_vrt_dems(rows, header_list, args, vrt_dems, footprints):
+    """
+    Replace the VRT DEM of the given task rows with a subset VRT of the tiles each image overlaps, written by
+    utils.subset_vrt_dem into the --scratch directory.  Images that overlap the same tiles share a subset VRT.
+    footprints holds the footprint geometry and spatial reference of each source path.  Tasks keep the full VRT
+    if it cannot be subset.
+    """
+    src_index = header_list.index('src')
+    dem_index = header_list.index('dem')
+    for vrt_count, vrt in enumerate(vrt_dems, 1):
+        try:
+            tiles, vrt_spatial_ref, (xres, yres) = get_vrt_dem_tiles(vrt)
+        except RuntimeError as e:
+            logger.warning("Tasks will use the full VRT DEM %s: %s", vrt, e)
             continue
 
-        # Check if the image geometry is in the same spatial reference as the current layer
-        if not imageSpatialReference.IsSame(layer_spatial_ref):
-            coordinate_transformer = osr.CoordinateTransformation(imageSpatialReference, layer_spatial_ref)
-            image_geometry_transformed = image_geometry.Clone()
-            image_geometry_transformed.Transform(coordinate_transformer)
-        else:
-            image_geometry_transformed = image_geometry
-
-        # Find the overlapping feature in the layer
-        dem = layer.GetNextFeature()
-        while dem:
-            dem_geometry = dem.GetGeometryRef()
-            if dem_geometry is None:
-                logger.debug("Skipping feature %s in layer %d because its geometry is None", (dem, i))
-                dem = layer.GetNextFeature()
+        ## a row per tile the image overlaps, as in a CSV argument list for utils.subset_vrt_dem
+        kept_rows = []
+        vrt_rows = []
+        tile_rows = []
+        for row in rows:
+            if row[dem_index] != vrt or row[src_index] not in footprints:
+                kept_rows.append(row)
                 continue
+            footprint_geom, spatial_ref = footprints[row[src_index]]
             try:
-                if image_geometry_transformed.Within(dem_geometry) and dem['rank'] < selected_rank:
-                    selected_dem = dem
-                    selected_rank = dem['rank']
-            except Exception as e:
-                raise RuntimeError(f"Error processing feature in auto DEM layer {i}: {e}")
-            dem = layer.GetNextFeature()
-
+                footprint_geom = footprint_geom.Clone()
+                footprint_geom.Transform(osr.CoordinateTransformation(spatial_ref, vrt_spatial_ref))
+            except RuntimeError as e:
+                logger.debug("Cannot transform footprint of %s to the VRT DEM: %s", row[src_index], e)
+                kept_rows.append(row)
+                continue
+            minx, maxx, miny, maxy = footprint_geom.GetEnvelope()
+            xmargin = (maxx - minx) * AUTO_DEM_VRT_MARGIN + 2 * xres
+            ymargin = (maxy - miny) * AUTO_DEM_VRT_MARGIN + 2 * yres
+            tile_names = tiles.query_intersecting((minx - xmargin, maxx + xmargin, miny - ymargin, maxy + ymargin))
+            if len(tile_names) == 0:
+                kept_rows.append(row)
+                continue
+            vrt_rows.append(row)
+            tile_rows += [row[:dem_index] + [name] + row[dem_index + 1:] for name in sorted(tile_names)]
 
-    if selected_dem is None:
-        return None
+        if len(tile_rows) == 0:
+            continue
 
-    try:
-        if platform.system() == "Windows": # this is for selecting between specific versions of the PGC reference DEM file
-            dempath = selected_dem.GetField("windowspath")
+        vrt_args = copy.copy(args)
+        vrt_args.dem = vrt
+        vrt_args.scratch = os.path.join(args.scratch, 'Or_dem_vrt{}'.format(vrt_count))
+        try:
+            if not os.path.isdir(vrt_args.scratch):
+                os.makedirs(vrt_args.scratch)
+            subset_rows = utils.subset_vrt_dem(np.array(tile_rows, dtype=object), header_list, vrt_args)
+        except (utils.InvalidArgumentError, IOError, OSError, ET.ParseError) as e:
+            logger.warning("Tasks will use the full VRT DEM %s, subset VRTs cannot be written: %s", vrt, e)
+            rows = kept_rows + vrt_rows
         else:
-            dempath = selected_dem.GetField("dempath")
-    except Exception as e:
-        raise RuntimeError("Error getting 'dempath' field: %s", e)
+            rows = kept_rows + [list(row) for row in subset_rows]
+            logger.info("Wrote subset VRTs of %s for %i images", vrt, len(subset_rows))
+    return rows
 
-    # Close the dataset
-    del dataset
-    return dempath
 
 def extract_rpb(item, rpb_p):
     rc = 0
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Per-stage timing of image processing.
+
+A StageTimer records the wall time, CPU time and bytes read and written of each stage of processing an image
+(metadata parsing, copy to the working directory, warp, ...).  CPU time includes child processes, so GDAL
+utilities run by the shell backend are counted along with the in-process backend's threads.  Bytes are the
+rchar/wchar counters of /proc/self/io, which count all reads and writes of the process and its finished children,
+whether they are served from the page cache, local disk or a network file system.  On platforms without
+/proc/self/io the byte counts are null.
+
+At the end of an image the stages are logged as one JSON object on a line starting with STAGE_TIMES_MARKER,
+which pgc_perf_report.py and other tools can extract from the processing logs.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import time
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+STAGE_TIMES_MARKER = 'Stage times: '
+START_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+PROC_IO = '/proc/self/io'
+
+
+def read_io_counters(path=PROC_IO):
+    """Return (bytes read, bytes written) of this process and its finished children, or None if not available"""
+    try:
+        with open(path) as f:
+            counters = dict([line.split(':', 1) for line in f.read().splitlines() if ':' in line])
+        return int(counters['rchar']), int(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def get_cpu_time():
+    """Return the user + system CPU seconds of this process and its finished children"""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+class StageTimer(object):
+    """
+    Accumulates wall time, CPU time and I/O per named stage, in the order the stages first ran.  fields (task,
+    image, sensor, ...) are added to the logged record and can be updated while the image is processed.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        self.stages = collections.OrderedDict()
+        self.start_wall = time.time()
+        self.start_cpu = get_cpu_time()
+        self.start_io = read_io_counters()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager timing one stage.  A stage that runs more than once is summed."""
+        wall = time.time()
+        cpu = get_cpu_time()
+        io = read_io_counters()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - wall, get_cpu_time() - cpu, io, read_io_counters())
+
+    def add(self, name, wall, cpu, io_start=None, io_end=None):
+        stage = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'read_bytes': None, 'write_bytes': None})
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+        if io_start is not None and io_end is not None:
+            stage['read_bytes'] = (stage['read_bytes'] or 0) + io_end[0] - io_start[0]
+            stage['write_bytes'] = (stage['write_bytes'] or 0) + io_end[1] - io_start[1]
+
+    def get_record(self, **fields):
+        """Return a dict of the fields, the stage measurements and the totals since the timer was created"""
+        io = read_io_counters()
+        total = {
+            'wall': time.time() - self.start_wall,
+            'cpu': get_cpu_time() - self.start_cpu,
+            'read_bytes': io[0] - self.start_io[0] if io and self.start_io else None,
+            'write_bytes': io[1] - self.start_io[1] if io and self.start_io else None,
+        }
+        record = dict(self.fields)
+        record.update(fields)
+        record['start'] = time.strftime(START_FORMAT, time.localtime(self.start_wall))
+        record['stages'] = [dict(values, stage=name) for name, values in self.stages.items()]
+        record['total'] = total
+        return record
+
+    def log_record(self, **fields):
+        """Log the record of this timer as a JSON line"""
+        logger.info("%s%s", STAGE_TIMES_MARKER, json.dumps(self.get_record(**fields), sort_keys=True))
+
+
+def parse_stage_times(line):
+    """Return the record from a log line written by StageTimer.log_record, or None if the line is not one"""
+    position = line.find(STAGE_TIMES_MARKER)
+    if position == -1:
+        return None
+    try:
+        return json.loads(line[position + len(STAGE_TIMES_MARKER):])
+    except ValueError:
+        return None
+
+
+def parse_start(start):
+    """Return the epoch seconds of the start time of a record"""
+    return time.mktime(time.strptime(start, START_FORMAT))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+"""
+Aggregation of the per-image stage timing records (see lib/perf.py) for pgc_perf_report.py.
+
+Records are read from processing logs and Slurm/PBS job output files.  An image's record appears both in its own
+log and in the job output, so records are deduplicated by task, image and start time.  The report gives
+percentiles of wall time per stage, the totals per sensor and band count, the slowest images and the throughput
+of each run.
+"""
+
+import collections
+import fnmatch
+import os
+
+from lib import perf
+
+ARGDEF_LOG_PATTERNS = ['*.log', '*.o[0-9]*', '*.out']
+ARGDEF_SLOWEST = 10
+RUN_KEYS = ['day', 'dir']
+
+PERCENTILES = [50, 90, 99]
+
+
+def iter_log_files(paths, patterns=None):
+    """Yield the files given and the files under the directories given whose names match one of the patterns"""
+    if patterns is None:
+        patterns = ARGDEF_LOG_PATTERNS
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    if any([fnmatch.fnmatch(f, pattern) for pattern in patterns]):
+                        yield os.path.join(root, f)
+        else:
+            yield path
+
+
+def read_records(logfiles):
+    """Return the unique stage timing records in the log files, each with the path of the first log it was in"""
+    records = collections.OrderedDict()
+    for logfile in logfiles:
+        try:
+            with open(logfile, errors='replace') as f:
+                for line in f:
+                    if perf.STAGE_TIMES_MARKER not in line:
+                        continue
+                    record = perf.parse_stage_times(line)
+                    if record is None:
+                        continue
+                    key = (record.get('task'), record.get('image'), record.get('start'))
+                    if key not in records:
+                        record['log'] = logfile
+                        records[key] = record
+        except (IOError, OSError):
+            continue
+    return list(records.values())
+
+
+def percentile(values, q):
+    """Return the q-th percentile of a list of numbers, interpolating between the closest ranks"""
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def get_run_key(record, run_by='day'):
+    """Return the run a record belongs to: the day its image started, or the directory of its log"""
+    if run_by == 'dir':
+        return os.path.dirname(record['log'])
+    return (record.get('start') or '')[:10]
+
+
+class PerfReport(object):
+    """Aggregates of stage timing records"""
+
+    def __init__(self, records, slowest=ARGDEF_SLOWEST, run_by='day'):
+        self.records = records
+        self.slowest = slowest
+        self.run_by = run_by
+
+    def get_stage_rows(self):
+        """
+        Return a row per task and stage: count, wall time percentiles, max and total hours, share of the task's
+        wall time, CPU time per wall second, and GB read and written
+        """
+        stages = collections.OrderedDict()
+        task_wall = collections.defaultdict(float)
+        for record in self.records:
+            task = record.get('task')
+            task_wall[task] += record['total']['wall']
+            for stage in record['stages']:
+                stages.setdefault((task, stage['stage']), []).append(stage)
+
+        rows = []
+        for (task, name), values in sorted(stages.items(), key=lambda item: (item[0][0] or '', item[0][1])):
+            wall = [v['wall'] for v in values]
+            cpu = sum([v['cpu'] for v in values])
+            row = [task, name, len(values)]
+            row += [percentile(wall, q) for q in PERCENTILES]
+            row += [max(wall), sum(wall) / 3600.0]
+            row.append(100.0 * sum(wall) / task_wall[task] if task_wall[task] > 0 else None)
+            row.append(cpu / sum(wall) if sum(wall) > 0 else None)
+            row.append(sum_bytes(values, 'read_bytes'))
+            row.append(sum_bytes(values, 'write_bytes'))
+            rows.append(row)
+        return rows
+
+    def get_group_rows(self, field):
+        """Return a row per task and value of a record field: count, failures, wall percentiles and total hours"""
+        groups = collections.defaultdict(list)
+        for record in self.records:
+            groups[(record.get('task'), record.get(field))].append(record)
+
+        rows = []
+        for (task, value), records in sorted(groups.items(),
+                                             key=lambda item: (str(item[0][0]), item[0][1] is None, item[0][1] or 0)):
+            wall = [r['total']['wall'] for r in records]
+            row = [task, value, len(records), len([r for r in records if r.get('rc')])]
+            row += [percentile(wall, q) for q in PERCENTILES]
+            row.append(sum(wall) / 3600.0)
+            rows.append(row)
+        return rows
+
+    def get_slowest_rows(self):
+        """Return a row per image for the slowest images: wall time and the stage that took longest"""
+        rows = []
+        for record in sorted(self.records, key=lambda r: -r['total']['wall'])[:self.slowest]:
+            stages = sorted(record['stages'], key=lambda s: -s['wall'])
+            slowest_stage = '{} ({:.0f}s)'.format(stages[0]['stage'], stages[0]['wall']) if stages else None
+            rows.append([record.get('task'), record.get('image'), record.get('sensor'), record.get('bands'),
+                         record['total']['wall'], slowest_stage, record.get('log')])
+        return rows
+
+    def get_run_rows(self):
+        """
+        Return a row per run: images, failures, elapsed hours from the first start to the last finish, images
+        per elapsed hour, summed wall and CPU hours, and megapixels per wall second
+        """
+        runs = collections.defaultdict(list)
+        for record in self.records:
+            runs[get_run_key(record, self.run_by)].append(record)
+
+        rows = []
+        for run, records in sorted(runs.items()):
+            wall = sum([r['total']['wall'] for r in records])
+            cpu = sum([r['total']['cpu'] for r in records])
+            elapsed = get_elapsed_seconds(records)
+            megapixels = sum([r.get('megapixels') or 0 for r in records])
+            rows.append([
+                run, len(records), len([r for r in records if r.get('rc')]),
+                elapsed / 3600.0 if elapsed else None,
+                len(records) / (elapsed / 3600.0) if elapsed else None,
+                wall / 3600.0, cpu / 3600.0,
+                megapixels / wall if wall > 0 and megapixels > 0 else None,
+            ])
+        return rows
+
+    def format(self):
+        """Return the report as text"""
+        sections = [
+            ("Wall time per stage (seconds)",
+             ['task', 'stage', 'n'] + ['p{}'.format(q) for q in PERCENTILES] +
+             ['max', 'hours', '% of task', 'cpu/wall', 'GB read', 'GB written'],
+             self.get_stage_rows()),
+            ("Wall time per image by sensor (seconds)",
+             ['task', 'sensor', 'n', 'failed'] + ['p{}'.format(q) for q in PERCENTILES] + ['hours'],
+             self.get_group_rows('sensor')),
+            ("Wall time per image by band count (seconds)",
+             ['task', 'bands', 'n', 'failed'] + ['p{}'.format(q) for q in PERCENTILES] + ['hours'],
+             self.get_group_rows('bands')),
+            ("Slowest images",
+             ['task', 'image', 'sensor', 'bands', 'seconds', 'slowest stage', 'log'],
+             self.get_slowest_rows()),
+            ("Throughput per run (by {})".format(self.run_by),
+             ['run', 'images', 'failed', 'elapsed hours', 'images/hour', 'wall hours', 'cpu hours', 'Mpix/s'],
+             self.get_run_rows()),
+        ]
+        lines = ["{} images".format(len(self.records))]
+        for title, header, rows in sections:
+            lines += ['', title] + format_table(header, rows)
+        return '\n'.join(lines)
+
+
+def sum_bytes(values, key):
+    counts = [v[key] for v in values if v.get(key) is not None]
+    return sum(counts) / 1e9 if counts else None
+
+
+def get_elapsed_seconds(records):
+    """Return the seconds from the first start to the last finish of a set of records, or None if unknown"""
+    spans = []
+    for record in records:
+        try:
+            start = perf.parse_start(record['start'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        spans.append((start, start + record['total']['wall']))
+    if len(spans) == 0:
+        return None
+    return max([end for start, end in spans]) - min([start for start, end in spans])
+
+
+def format_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '{:.2f}'.format(value) if abs(value) < 100 else '{:.0f}'.format(value)
+    return str(value)
+
+
+def format_table(header, rows):
+    """Return the lines of a table with left aligned text columns"""
+    cells = [header] + [[format_value(v) for v in row] for row in rows]
+    widths = [max([len(row[i]) for row in cells]) for i in range(len(header))]
+    return ['  '.join([cell.ljust(width) for cell, width in zip(row, widths)]).rstrip() for row in cells]
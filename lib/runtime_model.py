@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""
+Runtime model for bundling ortho tasks into cluster jobs (--bundle-walltime).
+
+The predicted runtime of a task is intercept + slope * (megapixels x bands), with separate coefficients for warps
+with and without a DEM.  The coefficients are fit by least squares to the per-image processing logs of previous
+runs, which record the source raster size ("Source raster size: X x Y pixels, N bands"), the DEM and the
+"Total Processing Time" also read by get_runtime_stats.sh.  Tasks are then packed longest first into bundles of
+at most the target wallclock, and each job requests the predicted time of its bundle plus a margin.
+"""
+
+import heapq
+import json
+import logging
+import math
+import os
+import re
+
+from lib import discovery, metadata_cache
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+## Rough defaults (seconds, seconds per megapixel-band), used until the model is calibrated from logs
+DEFAULT_COEFFICIENTS = {
+    'dem': (120.0, 1.0),
+    'nodem': (60.0, 0.5),
+}
+
+# bytes per pixel per band assumed when the raster size is estimated from the file size
+ESTIMATE_BYTES_PER_SAMPLE = 2
+
+# requested walltime = predicted time * WALLTIME_MARGIN, at least MIN_WALLTIME seconds
+WALLTIME_MARGIN = 1.5
+MIN_WALLTIME = 600
+
+SIZE_PATTERN = re.compile(r'Source raster size: (\d+) x (\d+) pixels, (\d+) bands')
+DEM_PATTERN = re.compile(r'DEM: \S+')
+TIME_PATTERN = re.compile(r'Total Processing Time: (?:(\d+) days?, )?(\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+
+
+class RuntimeModel(object):
+    """Predicts task runtime in seconds from megapixels x bands and DEM use"""
+
+    def __init__(self, coefficients=None, samples=None):
+        self.coefficients = dict(DEFAULT_COEFFICIENTS)
+        if coefficients:
+            self.coefficients.update(coefficients)
+        self.samples = samples or {}
+
+    def predict(self, mpix_bands, dem):
+        intercept, slope = self.coefficients['dem' if dem else 'nodem']
+        return intercept + slope * mpix_bands
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'coefficients': self.coefficients, 'samples': self.samples}, f, indent=2)
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(dict([(k, tuple(v)) for k, v in data['coefficients'].items()]), data.get('samples'))
+
+    def __str__(self):
+        return ', '.join(['{}: {:.0f}s + {:.3f}s/Mpix-band ({} logs)'.format(
+            group, intercept, slope, self.samples.get(group, 0))
+            for group, (intercept, slope) in sorted(self.coefficients.items())])
+
+
+def parse_log(logfile):
+    """
+    Return (megapixels x bands, DEM used, runtime in seconds) from an ortho processing log, or None if the log
+    does not record a completed image
+    """
+    size = None
+    dem = False
+    seconds = None
+    try:
+        with open(logfile) as f:
+            for line in f:
+                match = SIZE_PATTERN.search(line)
+                if match:
+                    size = int(match.group(1)) * int(match.group(2)) * int(match.group(3)) / 1e6
+                elif DEM_PATTERN.search(line):
+                    dem = True
+                else:
+                    match = TIME_PATTERN.search(line)
+                    if match:
+                        days, hours, minutes, secs = match.groups()
+                        seconds = (int(days or 0) * 86400 + int(hours) * 3600 + int(minutes) * 60 + float(secs))
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        logger.debug("Cannot read log %s: %s", logfile, e)
+        return None
+    if size is None or seconds is None:
+        return None
+    return size, dem, seconds
+
+
+def fit_line(points):
+    """Return the least squares (intercept, slope) of (x, y) points, or None if it is underdetermined"""
+    n = len(points)
+    if n < 2:
+        return None
+    mean_x = sum([x for x, y in points]) / float(n)
+    mean_y = sum([y for x, y in points]) / float(n)
+    sxx = sum([(x - mean_x) ** 2 for x, y in points])
+    if sxx == 0:
+        return None
+    slope = sum([(x - mean_x) * (y - mean_y) for x, y in points]) / sxx
+    slope = max(slope, 0.0)
+    intercept = max(mean_y - slope * mean_x, 0.0)
+    return intercept, slope
+
+
+def calibrate(log_paths):
+    """Return a RuntimeModel fit to the ortho logs in the given files and directories"""
+    points = {'dem': [], 'nodem': []}
+    for log_path in log_paths:
+        if os.path.isdir(log_path):
+            logfiles = discovery.iter_tree(log_path, ['.log'])
+        else:
+            logfiles = [log_path]
+        for logfile in logfiles:
+            result = parse_log(logfile)
+            if result is not None:
+                mpix_bands, dem, seconds = result
+                points['dem' if dem else 'nodem'].append((mpix_bands, seconds))
+
+    coefficients = {}
+    for group, group_points in points.items():
+        fit = fit_line(group_points)
+        if fit is None:
+            logger.info("Not enough %s logs to calibrate the runtime model (%i), using defaults", group,
+                        len(group_points))
+        else:
+            coefficients[group] = fit
+    return RuntimeModel(coefficients, dict([(k, len(v)) for k, v in points.items()]))
+
+
+def get_model(path=None):
+    """
+    Return the RuntimeModel given by --runtime-model: a JSON model file, a log file or a directory of logs to
+    calibrate from, or None for the default coefficients
+    """
+    if path is None:
+        model = RuntimeModel()
+    elif os.path.isfile(path) and path.lower().endswith('.json'):
+        model = RuntimeModel.from_json(path)
+    else:
+        model = calibrate([path])
+    logger.info("Runtime model: %s", model)
+    return model
+
+
+def estimate_mpix_bands(srcfp, cache=None):
+    """
+    Return megapixels x bands of a source image from its cached raster footprint, or estimated from the file
+    size if it is not cached
+    """
+    if cache is not None:
+        footprint = cache.get(srcfp, metadata_cache.KIND_FOOTPRINT)
+        if footprint:
+            return footprint['xsize'] * footprint['ysize'] * footprint['bands'] / 1e6
+    try:
+        return os.path.getsize(srcfp) / float(ESTIMATE_BYTES_PER_SAMPLE) / 1e6
+    except OSError:
+        return 0.0
+
+
+def pack_bundles(items, target_seconds, max_tasks=None):
+    """
+    Pack (item, predicted seconds) pairs into bundles of at most target_seconds and at most max_tasks items.
+    Items are taken longest first and each goes to the least loaded bundle it fits in, so bundle runtimes come
+    out even.  Items predicted to take longer than target_seconds get a bundle of their own.  Returns a list of
+    (items, predicted seconds) bundles.
+    """
+    bundles = []
+    loads = []
+    heap = []  # (predicted seconds, bundle index) of the bundles that can take more items
+    for item, seconds in sorted(items, key=lambda pair: -pair[1]):
+        if heap and heap[0][0] + seconds <= target_seconds:
+            index = heapq.heappop(heap)[1]
+        else:
+            index = len(bundles)
+            bundles.append([])
+            loads.append(0.0)
+        bundles[index].append(item)
+        loads[index] += seconds
+        if max_tasks is None or len(bundles[index]) < max_tasks:
+            heapq.heappush(heap, (loads[index], index))
+    return list(zip(bundles, loads))
+
+
+def get_walltime(seconds, margin=WALLTIME_MARGIN, minimum=MIN_WALLTIME):
+    """Return the walltime in seconds to request for a predicted runtime, rounded up to the minute"""
+    return int(math.ceil(max(seconds * margin, minimum) / 60.0)) * 60
+
+
+def plan_bundles(task_list, args, header_list=None):
+    """
+    Pack the task list of pgc_ortho (source paths, or rows of CSV argument values with the given header) into
+    bundles of at most --bundle-walltime hours and --tasks-per-job tasks.  Returns a list of (tasks, walltime in
+    seconds to request) bundles.
+    """
+    model = get_model(getattr(args, 'runtime_model', None))
+    cache = metadata_cache.get_cache_from_args(args)
+    src_index = header_list.index('src') if header_list else None
+    dem_index = header_list.index('dem') if header_list and 'dem' in header_list else None
+
+    items = []
+    for task in task_list:
+        srcfp = task[src_index] if src_index is not None else task
+        dem = task[dem_index] if dem_index is not None else args.dem
+        seconds = model.predict(estimate_mpix_bands(srcfp, cache), dem not in (None, '', 'None'))
+        items.append((task, seconds))
+
+    bundles = pack_bundles(items, args.bundle_walltime * 3600, args.tasks_per_job)
+    logger.info("Packed %i tasks into %i bundles, predicted total runtime %.1f hours", len(items), len(bundles),
+                sum([seconds for task, seconds in items]) / 3600.0)
+    return [(bundle, get_walltime(seconds)) for bundle, seconds in bundles]
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+"""
+Spectral index engine used by pgc_ndvi.
+
+Indices are given as built-in names (ndvi, ndwi, wv_soil, evi) or as user expressions of the form
+"name=expression", where the expression uses band role names (e.g. nir, red) or band numbers (b1, b2, ...)
+with + - * / ** and parentheses.  Kernels are built per image from the band count, and each block of the
+bands needed by all requested indices is read once and passed to every kernel.
+"""
+
+import ast
+import logging
+import os
+import re
+
+import numpy
+
+from lib import utils
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+# index nodata value
+INDEX_NODATA = -9999
+
+# tolerance for floating point equality
+INDEX_TOL = 0.00001
+
+# scale factor for Int16 output
+INT16_SCALE = 1000.0
+
+BAND_ROLES = {
+    8: {'coastal': 1, 'blue': 2, 'green': 3, 'yellow': 4, 'red': 5, 'rededge': 6, 'nir': 7, 'nir2': 8},
+    4: {'blue': 1, 'green': 2, 'red': 3, 'nir': 4},
+}
+
+## Normalized differences (a - b) / (a + b), given as (a, b) band roles
+NORMALIZED_DIFFERENCE_INDICES = {
+    'ndvi': ('nir', 'red'),       # vegetation
+    'ndwi': ('green', 'nir'),     # water (McFeeters)
+    'wv_soil': ('green', 'yellow'),  # soil (WorldView-2 8-band), not the snow index NDSI
+}
+
+EXPRESSION_INDICES = {
+    'evi': '2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)',
+}
+
+## Built-in indices whose constants assume surface reflectance from 0 to 1, i.e. Float32 reflectance (f32rf)
+## ortho output.  Integer ortho output is scaled by a stretch dependent factor, so these indices reject it.
+REFLECTANCE_INDICES = ['evi']
+
+INDEX_NAME_PATTERN = re.compile(r'^[a-z][a-z0-9_]*$')
+BAND_NUMBER_PATTERN = re.compile(r'^b(\d+)$')
+
+ALLOWED_EXPRESSION_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Name, ast.Load, ast.Constant,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+)
+
+
+class SpectralIndex(object):
+    """An index definition that is not yet bound to an image band layout"""
+
+    def __init__(self, name, normalized_difference=None, expression=None, reflectance=False):
+        self.name = name
+        self.normalized_difference = normalized_difference
+        self.expression = expression
+        self.reflectance = reflectance
+
+    def build_kernel(self, band_count, max_block_pixels, outtype, band_nodata):
+        """
+        Return a kernel for an image with band_count bands.  band_nodata maps band number to nodata value.
+        Raises InvalidArgumentError if the index needs bands the image does not have.
+        """
+        if self.normalized_difference is not None:
+            band_a, band_b = [resolve_band(role, band_count, self.name) for role in self.normalized_difference]
+            return NormalizedDifferenceKernel(max_block_pixels, outtype, band_nodata[band_a], band_nodata[band_b],
+                                              bands=(band_a, band_b))
+        else:
+            return ExpressionKernel(self.expression, band_count, max_block_pixels, outtype, band_nodata,
+                                    name=self.name)
+
+
+class NormalizedDifferenceKernel(object):
+    """
+    Computes (a - b) / (a + b) for a block into buffers that are allocated once and reused for every block.
+    Pixels that are nodata in either band or where (a + b) is within tolerance of zero are set to nodata.
+    For Int16 output, values are scaled by 1000 and truncated in the same pass.
+    """
+
+    def __init__(self, max_block_pixels, outtype, a_nodata, b_nodata, nodata=INDEX_NODATA, tol=INDEX_TOL,
+                 bands=None):
+        self.a_nodata = a_nodata
+        self.b_nodata = b_nodata
+        self.nodata = nodata
+        self.tol = tol
+        self.bands = bands
+        self.scale = outtype == 'Int16'
+        self.numerator = numpy.empty(max_block_pixels, dtype=numpy.float32)
+        self.denominator = numpy.empty(max_block_pixels, dtype=numpy.float32)
+        self.valid = numpy.empty(max_block_pixels, dtype=bool)
+        self.mask = numpy.empty(max_block_pixels, dtype=bool)
+        self.out = numpy.empty(max_block_pixels, dtype=numpy.int16 if self.scale else numpy.float32)
+
+    def compute_block(self, arrays):
+        """Compute the index from a dict of band number to block array"""
+        return self.compute(arrays[self.bands[0]], arrays[self.bands[1]])
+
+    def compute(self, a_array, b_array):
+        """
+        Return the index block for the given blocks.  The result is a view of the kernel's output buffer
+        and is overwritten by the next call.
+        """
+        shape = a_array.shape
+        size = a_array.size
+        numerator = self.numerator[:size].reshape(shape)
+        denominator = self.denominator[:size].reshape(shape)
+        valid = self.valid[:size].reshape(shape)
+        mask = self.mask[:size].reshape(shape)
+        out = self.out[:size].reshape(shape)
+
+        numpy.not_equal(a_array, self.a_nodata, out=valid)
+        numpy.not_equal(b_array, self.b_nodata, out=mask)
+        numpy.logical_and(valid, mask, out=valid)
+
+        numpy.copyto(denominator, b_array, casting='unsafe')
+        numpy.add(denominator, a_array, out=denominator)
+        numpy.abs(denominator, out=numerator)
+        numpy.greater_equal(numerator, self.tol, out=mask)
+        numpy.logical_and(valid, mask, out=valid)
+
+        numpy.copyto(numerator, a_array, casting='unsafe')
+        numpy.subtract(numerator, b_array, out=numerator)
+
+        numpy.divide(numerator, denominator, out=numerator, where=valid)
+        out.fill(self.nodata)
+        if self.scale:
+            numpy.multiply(numerator, INT16_SCALE, out=numerator, where=valid)
+        numpy.copyto(out, numerator, casting='unsafe', where=valid)
+        return out
+
+
+class ExpressionKernel(object):
+    """
+    Evaluates an arithmetic band expression for a block in float32.  Pixels that are nodata in any band used
+    by the expression or where the result is not finite are set to nodata.  For Int16 output, values are
+    scaled by 1000, clipped to the Int16 range and truncated.
+    """
+
+    def __init__(self, expression, band_count, max_block_pixels, outtype, band_nodata, nodata=INDEX_NODATA,
+                 name=None):
+        self.names = get_expression_bands(expression, band_count, name)
+        self.bands = tuple(sorted(set(self.names.values())))
+        self.code = compile(ast.parse(expression, mode='eval'), '<{}>'.format(name or 'expression'), 'eval')
+        self.band_nodata = band_nodata
+        self.nodata = nodata
+        self.scale = outtype == 'Int16'
+        self.valid = numpy.empty(max_block_pixels, dtype=bool)
+        self.mask = numpy.empty(max_block_pixels, dtype=bool)
+        self.out = numpy.empty(max_block_pixels, dtype=numpy.int16 if self.scale else numpy.float32)
+
+    def compute_block(self, arrays):
+        """
+        Compute the index from a dict of band number to block array.  The result is a view of the kernel's
+        output buffer and is overwritten by the next call.
+        """
+        first = arrays[self.bands[0]]
+        shape = first.shape
+        size = first.size
+        valid = self.valid[:size].reshape(shape)
+        mask = self.mask[:size].reshape(shape)
+        out = self.out[:size].reshape(shape)
+
+        valid.fill(True)
+        for band in self.bands:
+            numpy.not_equal(arrays[band], self.band_nodata[band], out=mask)
+            numpy.logical_and(valid, mask, out=valid)
+
+        namespace = {name: arrays[band].astype(numpy.float32, copy=False) for name, band in self.names.items()}
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            result = numpy.asarray(eval(self.code, {'__builtins__': {}}, namespace), dtype=numpy.float32)
+            result = numpy.broadcast_to(result, shape)
+            numpy.isfinite(result, out=mask)
+            numpy.logical_and(valid, mask, out=valid)
+
+            out.fill(self.nodata)
+            if self.scale:
+                result = numpy.clip(result * INT16_SCALE, -32767, 32767)
+            numpy.copyto(out, result, casting='unsafe', where=valid)
+        return out
+
+
+def resolve_band(name, band_count, index_name=None):
+    """Return the band number for a band role name (e.g. 'nir') or band number name (e.g. 'b7')"""
+    match = BAND_NUMBER_PATTERN.match(name)
+    if match:
+        band = int(match.group(1))
+        if 1 <= band <= band_count:
+            return band
+    else:
+        roles = BAND_ROLES.get(band_count, {})
+        if name in roles:
+            return roles[name]
+    raise utils.InvalidArgumentError("Index {} uses band '{}', which is not available in a {} band image".format(
+        index_name, name, band_count))
+
+
+def get_expression_bands(expression, band_count, index_name=None):
+    """Return a dict of the names used in an expression to band numbers"""
+    tree = ast.parse(expression, mode='eval')
+    names = sorted(set([node.id for node in ast.walk(tree) if isinstance(node, ast.Name)]))
+    if len(names) == 0:
+        raise utils.InvalidArgumentError("Index {} expression does not use any bands: {}".format(
+            index_name, expression))
+    return {name: resolve_band(name, band_count, index_name) for name in names}
+
+
+def validate_expression(expression):
+    """Raise InvalidArgumentError unless expression is a plain arithmetic expression of names and numbers"""
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise utils.InvalidArgumentError("Invalid index expression '{}': {}".format(expression, e))
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_EXPRESSION_NODES):
+            raise utils.InvalidArgumentError("Index expression '{}' contains unsupported syntax: {}".format(
+                expression, type(node).__name__))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise utils.InvalidArgumentError("Index expression '{}' contains a non-numeric constant".format(
+                expression))
+
+
+def parse_index(definition):
+    """Return a SpectralIndex for a built-in index name or a 'name=expression' definition"""
+    definition = definition.strip()
+    if '=' in definition:
+        name, expression = [part.strip() for part in definition.split('=', 1)]
+    else:
+        name = definition.lower()
+        expression = None
+
+    if not INDEX_NAME_PATTERN.match(name):
+        raise utils.InvalidArgumentError("Invalid index name '{}': use lowercase letters, numbers and "
+                                         "underscores".format(name))
+
+    if expression is not None:
+        validate_expression(expression)
+        return SpectralIndex(name, expression=expression)
+    elif name in NORMALIZED_DIFFERENCE_INDICES:
+        return SpectralIndex(name, normalized_difference=NORMALIZED_DIFFERENCE_INDICES[name])
+    elif name in EXPRESSION_INDICES:
+        return SpectralIndex(name, expression=EXPRESSION_INDICES[name], reflectance=name in REFLECTANCE_INDICES)
+    else:
+        raise utils.InvalidArgumentError("Unknown index '{}', choose from {} or give 'name=expression'".format(
+            name, sorted(list(NORMALIZED_DIFFERENCE_INDICES) + list(EXPRESSION_INDICES))))
+
+
+def parse_indices(definitions):
+    """Return a list of SpectralIndex from a comma separated string of index definitions"""
+    indices = [parse_index(d) for d in definitions.split(',') if d.strip() != '']
+    if len(indices) == 0:
+        raise utils.InvalidArgumentError("No index given")
+    names = [index.name for index in indices]
+    if len(set(names)) != len(names):
+        raise utils.InvalidArgumentError("Index names must be unique: {}".format(', '.join(names)))
+    return indices
+
+
+def get_output_paths(dstdir, basename, index_names, separate=False):
+    """
+    Return the output paths for an image: <basename>_<index>.tif for each index if separate, otherwise
+    one multi-band <basename>_<index1>_<index2>...tif
+    """
+    if separate:
+        return [os.path.join(dstdir, '{}_{}.tif'.format(basename, name)) for name in index_names]
+    else:
+        return [os.path.join(dstdir, '{}_{}.tif'.format(basename, '_'.join(index_names)))]
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""
+Staged reads of source files into the --wd working directory.
+
+Without --staged-read, pgc_ortho copies every file named like the source image ({base}.*) to the working
+directory with shutil.copy2, including browse images that processing never reads.  In staged mode
+only the raster and its metadata sidecars (get_stage_list) are copied, each in chunks read and written by a
+thread pool, which keeps several requests in flight on network file systems.  The CRC32 of every chunk is
+taken as it is read from the source and checked against the chunk read back from the copy after the copy is
+flushed to storage and dropped from the page cache, so the check reads what was stored.  The copy is written
+to a .part file that is renamed into place once verified, so an interrupted copy is never mistaken for a staged
+file.
+
+With --async-upload, the outputs of an image are copied from the working directory to the destination by a
+background Uploader thread while the next image is processed.  Uploads use the same verified copy, so an output
+only appears under its final name once complete, and the output raster is moved last, after its sidecars, so that
+the existence check for finished images never sees an image with missing sidecars.
+"""
+
+import concurrent.futures
+import logging
+import os
+import queue
+import shutil
+import threading
+import zlib
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+ARGDEF_STAGE_THREADS = 4
+CHUNK_SIZE = 64 * 1024 * 1024
+PART_SUFFIX = '.part'
+ARGDEF_UPLOAD_QUEUE_SIZE = 2  # images waiting for upload before submitting another one blocks
+
+# sidecars of a source image that processing reads: vendor metadata, RPCs, and the archive extract_rpb and
+# get_metadata fall back on when the metadata is not beside the raster
+SIDECAR_EXTS = ['.imd', '.pvl', '.rpb', '.tar', '.txt', '.xml']
+# sidecars named with a suffix instead of an extension, e.g. the RPCs of GE01 and IK01 GeoTIFFs
+SIDECAR_SUFFIXES = ['_rpc.txt']
+
+
+class StagingError(IOError):
+    """Raised when a staged copy does not match its source"""
+
+
+def get_stage_list(srcfp, metapath=None):
+    """
+    Return the files to stage for a source image: the raster, the sidecars named like it with an extension in
+    SIDECAR_EXTS or a suffix in SIDECAR_SUFFIXES, and the metadata file if it is in the same directory
+    """
+    srcdir, srcfn = os.path.split(srcfp)
+    base = os.path.splitext(srcfn)[0]
+    stage_list = [srcfp]
+    try:
+        names = sorted(os.listdir(srcdir or '.'))
+    except OSError:
+        names = []
+    for name in names:
+        root, ext = os.path.splitext(name)
+        if root == base and ext.lower() in SIDECAR_EXTS:
+            stage_list.append(os.path.join(srcdir, name))
+        elif name.lower() in [(base + suffix).lower() for suffix in SIDECAR_SUFFIXES]:
+            stage_list.append(os.path.join(srcdir, name))
+    if metapath and os.path.dirname(os.path.abspath(metapath)) == os.path.abspath(srcdir or '.'):
+        if os.path.isfile(metapath) and os.path.basename(metapath) not in [os.path.basename(f) for f in stage_list]:
+            stage_list.append(metapath)
+    return stage_list
+
+
+def _copy_chunk(src, part, offset, length):
+    """Copy one chunk and return the CRC32 of the bytes read from the source"""
+    with open(src, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) != length:
+        raise StagingError("Short read of {} at offset {}: {} of {} bytes".format(src, offset, len(data), length))
+    with open(part, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+    return zlib.crc32(data)
+
+
+def _read_chunk_crc(path, offset, length):
+    """Return the CRC32 of one chunk of a file"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return zlib.crc32(f.read(length))
+
+
+def _flush_and_drop_cache(path):
+    """
+    Write a file to storage and drop its pages from the page cache, so that it is read back from storage rather
+    than from the pages just written.  Dropping the pages needs os.posix_fadvise (Linux and most Unix systems).
+    """
+    with open(path, 'rb+') as f:
+        f.flush()
+        os.fsync(f.fileno())
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def copy_file(src, dst, threads=ARGDEF_STAGE_THREADS, chunk_size=CHUNK_SIZE):
+    """
+    Copy src to dst in chunks of chunk_size bytes on a pool of threads, and copy the file times and permissions
+    like shutil.copy2.  Once written, the copy is flushed to storage and its cached pages dropped, and the CRC32 of
+    every chunk read back from storage is checked against the CRC32 of the chunk read from the source.  Raises
+    StagingError if the copy does not match.
+    """
+    size = os.path.getsize(src)
+    part = dst + PART_SUFFIX
+    with open(part, 'wb') as f:
+        f.truncate(size)
+
+    offsets = list(range(0, size, chunk_size))
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+            futures = [executor.submit(_copy_chunk, src, part, offset, min(chunk_size, size - offset))
+                       for offset in offsets]
+            src_crcs = [future.result() for future in futures]
+            _flush_and_drop_cache(part)
+            futures = [executor.submit(_read_chunk_crc, part, offset, min(chunk_size, size - offset))
+                       for offset in offsets]
+            for offset, src_crc, future in zip(offsets, src_crcs, futures):
+                if future.result() != src_crc:
+                    raise StagingError("Checksum mismatch copying {} at offset {}".format(src, offset))
+        if os.path.getsize(src) != size:
+            raise StagingError("Source changed while copying: {}".format(src))
+        shutil.copystat(src, part)
+        os.replace(part, dst)
+    except BaseException:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+    logger.debug("Staged %s (%i bytes in %i chunks)", src, size, len(offsets))
+
+
+def copy_files(srcs, dstdir, threads=ARGDEF_STAGE_THREADS, chunk_size=CHUNK_SIZE):
+    """Copy each file to dstdir with copy_file, skipping files already there.  Returns the copied paths."""
+    copied = []
+    for src in srcs:
+        dst = os.path.join(dstdir, os.path.basename(src))
+        if not os.path.isfile(dst):
+            copy_file(src, dst, threads, chunk_size)
+            copied.append(dst)
+    return copied
+
+
+class Uploader(object):
+    """
+    Copies files to their destination with copy_files on a background thread, taking uploads from a bounded queue
+    """
+
+    def __init__(self, queue_size=ARGDEF_UPLOAD_QUEUE_SIZE, threads=ARGDEF_STAGE_THREADS, chunk_size=CHUNK_SIZE):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self.failed = []
+        self.thread = threading.Thread(target=self._run, name='uploader')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, srcs, dstdir, delete=False, callback=None):
+        """
+        Queue files to copy to dstdir in the given order, deleting the sources once all are copied if delete is
+        True and then calling callback, if given, with no arguments.  Blocks while the queue is full.
+        """
+        self.queue.put((list(srcs), dstdir, delete, callback))
+
+    def wait(self):
+        """Block until every submitted upload is finished and return the sources of the uploads that failed"""
+        self.queue.join()
+        return list(self.failed)
+
+    def _run(self):
+        while True:
+            srcs, dstdir, delete, callback = self.queue.get()
+            try:
+                self._upload(srcs, dstdir, delete, callback)
+            finally:
+                self.queue.task_done()
+
+    def _upload(self, srcs, dstdir, delete, callback):
+        try:
+            copy_files(srcs, dstdir, self.threads, self.chunk_size)
+        except Exception as e:
+            logger.error("Cannot upload %s to %s: %s", ', '.join(srcs), dstdir, e)
+            self.failed.extend(srcs)
+            return
+        logger.debug("Uploaded %s to %s", ', '.join(srcs), dstdir)
+        if delete:
+            for src in srcs:
+                try:
+                    os.remove(src)
+                except OSError as e:
+                    logger.warning("Cannot remove %s: %s", src, e)
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Error after uploading %s: %s", ', '.join(srcs), e)
+                self.failed.extend(srcs)
+
+
+_uploader = None
+
+
+def get_uploader():
+    """Return the Uploader of this process, starting it on first use"""
+    global _uploader
+    if _uploader is None:
+        _uploader = Uploader()
+    return _uploader
+
+
+def wait_for_uploads():
+    """Wait for the uploads of this process, if any, and return the sources of the uploads that failed"""
+    if _uploader is None:
+        return []
+    return _uploader.wait()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+Block-streaming writer for the stretched ortho output.
+
+The warped image is read in windows aligned to its natural block size, the per band stretch LUT is applied
+with NumPy in a thread pool, and the stretched windows are written in order to the output dataset while the
+GTiff driver compresses blocks in its own worker threads.  The number of windows in flight is bounded, so the
+pipeline and the GDAL block cache together stay within the memory ceiling set with --max-memory.
+
+Formats whose drivers cannot create datasets directly (COG, JPEG, JP2OpenJPEG) are written to a temporary
+GTiff first and copied to the output format.
+"""
+
+import collections
+import concurrent.futures
+import logging
+import os
+import re
+
+import numpy as np
+from osgeo import gdal, gdalconst
+
+gdal.UseExceptions()
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+ARGDEF_MAX_MEMORY = 2048  # MB
+
+## Share of the memory ceiling given to the GDAL block cache, the rest bounds the windows in flight
+CACHE_MEMORY_FRACTION = 0.5
+
+CREATION_OPTION_PATTERN = re.compile(r'-co\s+"?([^"\s]+)"?')
+BAND_OPTION_PATTERN = re.compile(r'-b\s+(\d+)')
+
+NUMPY_TYPE_DICT = {
+    'Byte': np.uint8,
+    'UInt16': np.uint16,
+    'Int16': np.int16,
+    'Float32': np.float32,
+}
+
+TEMP_GTIFF_OPTIONS = ['TILED=YES', 'BIGTIFF=YES', 'COMPRESS=LZW']
+
+
+def parse_creation_options(co):
+    """
+    Convert a '-co "KEY=VALUE" ' option string into a list of creation options
+    """
+    return CREATION_OPTION_PATTERN.findall(co)
+
+
+def parse_band_list(rgb_bands, band_count):
+    """
+    Convert a '-b N ' band selection string into a list of band numbers, defaulting to all bands
+    """
+    band_list = [int(b) for b in BAND_OPTION_PATTERN.findall(rgb_bands)]
+    if len(band_list) == 0:
+        band_list = list(range(1, band_count + 1))
+    return band_list
+
+
+def parse_lut(lut):
+    """
+    Convert a VRT LUT string ("in:out,in:out,...") into input and output breakpoint arrays
+    """
+    pairs = [p.split(':') for p in lut.split(',')]
+    xp = np.array([float(p[0]) for p in pairs])
+    fp = np.array([float(p[1]) for p in pairs])
+    return xp, fp
+
+
+def stretch_block(block, xp, fp, nodata, dtype, src_nodata=None):
+    """
+    Apply a LUT to a block the way a VRT ComplexSource does: linear interpolation between breakpoints,
+    clamped to the end values, source pixels equal to src_nodata (default nodata) set to nodata.  Integer
+    outputs are rounded half away from zero and clipped to the type range as in GDAL's type conversion.
+    """
+    out = np.interp(block, xp, fp)
+    if np.issubdtype(dtype, np.integer):
+        type_info = np.iinfo(dtype)
+        np.clip(out, type_info.min, type_info.max, out=out)
+        np.add(out, 0.5, out=out)
+        np.floor(out, out=out)
+    out = out.astype(dtype)
+    out[block == (nodata if src_nodata is None else src_nodata)] = nodata
+    return out
+
+
+def _stretch_window(blocks, luts, nodata, dtype, src_nodata):
+    results = []
+    for block, (xp, fp), band_src_nodata in zip(blocks, luts, src_nodata):
+        out = stretch_block(block, xp, fp, nodata, dtype, band_src_nodata)
+        valid = out[out != nodata]
+        if valid.size > 0:
+            stats = (valid.size, valid.min(), valid.max(), valid.sum(dtype=np.float64),
+                     np.square(valid, dtype=np.float64).sum())
+        else:
+            stats = (0, None, None, 0.0, 0.0)
+        results.append((out, stats))
+    return results
+
+
+def _iter_windows(xsize, ysize, win_xsize, win_ysize):
+    for yoff in range(0, ysize, win_ysize):
+        for xoff in range(0, xsize, win_xsize):
+            yield xoff, yoff, min(win_xsize, xsize - xoff), min(win_ysize, ysize - yoff)
+
+
+class _BandStats(object):
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.sumsq = 0.0
+
+    def update(self, stats):
+        count, vmin, vmax, vsum, vsumsq = stats
+        if count == 0:
+            return
+        self.count += count
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+        self.sum += vsum
+        self.sumsq += vsumsq
+
+    def write(self, band):
+        if self.count == 0:
+            return
+        mean = self.sum / self.count
+        std = max(self.sumsq / self.count - mean * mean, 0.0) ** 0.5
+        band.SetStatistics(float(self.min), float(self.max), mean, std)
+
+
+def write_stretched(srcfp, dstfp, luts, nodata, outtype, out_format, co, srs_wkt, band_list=None, threads=1,
+                    max_memory=ARGDEF_MAX_MEMORY):
+    """
+    Stretch srcfp with one LUT string per source band and write it to dstfp.  Source pixels equal to the nodata
+    value of their band, or to nodata if the band has none, are written as nodata.
+
+    Returns 0 on success and 1 on failure.
+    """
+    rc = 0
+    if threads == "ALL_CPUS":
+        workers = os.cpu_count() or 1
+    else:
+        workers = max(int(threads), 1)
+    dtype = NUMPY_TYPE_DICT[outtype]
+
+    driver = gdal.GetDriverByName(out_format)
+    if driver is None:
+        logger.error("GDAL driver not available: %s", out_format)
+        return 1
+    if driver.GetMetadataItem(gdal.DCAP_CREATE) == 'YES':
+        create_driver = driver
+        create_fp = dstfp
+        create_options = parse_creation_options(co)
+    else:
+        create_driver = gdal.GetDriverByName('GTiff')
+        create_fp = os.path.splitext(dstfp)[0] + '_stream.tif'
+        create_options = list(TEMP_GTIFF_OPTIONS)
+    if create_driver.ShortName == 'GTiff':
+        create_options.append('NUM_THREADS={}'.format(threads))
+
+    cache_bytes = int(max_memory * 1024 * 1024 * CACHE_MEMORY_FRACTION)
+    pipeline_bytes = max_memory * 1024 * 1024 - cache_bytes
+    gdal.SetCacheMax(cache_bytes)
+
+    try:
+        src_ds = gdal.Open(srcfp, gdalconst.GA_ReadOnly)
+        xsize = src_ds.RasterXSize
+        ysize = src_ds.RasterYSize
+        if band_list is None:
+            band_list = list(range(1, src_ds.RasterCount + 1))
+        src_bands = [src_ds.GetRasterBand(b) for b in band_list]
+        band_luts = [parse_lut(luts[b - 1]) for b in band_list]
+        src_nodata = [band.GetNoDataValue() for band in src_bands]
+
+        ## Size windows as whole rows of source blocks where they fit, so every block is read once
+        block_xsize, block_ysize = src_bands[0].GetBlockSize()
+        src_itemsize = gdal.GetDataTypeSize(src_bands[0].DataType) // 8
+        pixel_bytes = len(band_list) * (src_itemsize + 8 + np.dtype(dtype).itemsize)
+        target_bytes = max(pipeline_bytes // (2 * workers), 1)
+        block_cols = max(target_bytes // (pixel_bytes * block_xsize * block_ysize), 1)
+        win_xsize = min(xsize, block_cols * block_xsize)
+        win_ysize = min(ysize, block_ysize)
+        max_in_flight = max(pipeline_bytes // (pixel_bytes * win_xsize * win_ysize), 1)
+        logger.debug("Streaming %s in %i x %i windows, %i workers, %i windows in flight",
+                     srcfp, win_xsize, win_ysize, workers, max_in_flight)
+
+        dst_ds = create_driver.Create(create_fp, xsize, ysize, len(band_list), gdal.GetDataTypeByName(outtype),
+                                      options=create_options)
+        dst_ds.SetGeoTransform(src_ds.GetGeoTransform())
+        dst_ds.SetProjection(srs_wkt)
+        dst_bands = [dst_ds.GetRasterBand(i + 1) for i in range(len(band_list))]
+        for src_band, dst_band in zip(src_bands, dst_bands):
+            dst_band.SetNoDataValue(nodata)
+            color_interp = src_band.GetColorInterpretation()
+            if color_interp != gdalconst.GCI_AlphaBand:
+                dst_band.SetColorInterpretation(color_interp)
+        band_stats = [_BandStats() for _ in band_list]
+
+        def write_window(window, future):
+            xoff, yoff, _, _ = window
+            for dst_band, stats, (out, window_stats) in zip(dst_bands, band_stats, future.result()):
+                dst_band.WriteArray(out, xoff, yoff)
+                stats.update(window_stats)
+
+        ## GDAL datasets are not thread safe, so reads and writes stay on this thread and only the
+        ## stretch runs in the pool
+        in_flight = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for window in _iter_windows(xsize, ysize, win_xsize, win_ysize):
+                blocks = [band.ReadAsArray(*window) for band in src_bands]
+                in_flight.append((window, executor.submit(_stretch_window, blocks, band_luts, nodata, dtype,
+                                                              src_nodata)))
+                if len(in_flight) >= max_in_flight:
+                    write_window(*in_flight.popleft())
+            while in_flight:
+                write_window(*in_flight.popleft())
+
+        for dst_band, stats in zip(dst_bands, band_stats):
+            stats.write(dst_band)
+        dst_bands = None
+        dst_ds = None
+        src_bands = None
+        src_ds = None
+
+        if create_fp != dstfp:
+            tmp_ds = gdal.Open(create_fp, gdalconst.GA_ReadOnly)
+            out_ds = driver.CreateCopy(dstfp, tmp_ds, 0, options=parse_creation_options(co))
+            if out_ds is None:
+                rc = 1
+            out_ds = None
+            tmp_ds = None
+
+    except RuntimeError as e:
+        logger.error("Error writing stretched image %s: %s", dstfp, e)
+        rc = 1
+
+    finally:
+        if create_fp != dstfp and os.path.isfile(create_fp):
+            os.remove(create_fp)
+
+    return rc
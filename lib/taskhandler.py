@@ -6,31 +6,51 @@ task handler classes and methods
 
 import codecs
 import logging
+import math
 import multiprocessing as mp
 import os
 import platform
 import signal
 import subprocess
+import time
+import traceback
+from datetime import datetime
 
 #### Create Logger
 logger = logging.getLogger("logger")
 logger.setLevel(logging.DEBUG)
 
+# a task is reported as a straggler if it takes this many times the median task duration
+STRAGGLER_FACTOR = 3
+STRAGGLER_MIN_SECONDS = 60
+
+# maximum number of tasks per job array (the SLURM MaxArraySize default is 1001)
+ARRAY_MAX_SIZE = 1000
+
 
 class Task(object):
 
-    def __init__(self, task_name, task_abrv, task_exe, task_cmd, task_method=None, task_method_arg_list=None):
+    def __init__(self, task_name, task_abrv, task_exe, task_cmd, task_method=None, task_method_arg_list=None,
+                 task_cost=None, task_logfile=None, task_walltime=None):
         self.name = task_name
         self.abrv = task_abrv
         self.exe = task_exe
         self.cmd = task_cmd
         self.method = task_method
         self.method_arg_list = task_method_arg_list
+        self.cost = task_cost
+        self.logfile = task_logfile
+        self.walltime = task_walltime
 
 
 class PBSTaskHandler(object):
+    """
+    Submits one PBS job per task, or with array_dir, writes the task commands to manifest files in array_dir and
+    submits them as job arrays (qsub -J) of at most max_array_size tasks, see write_array_manifests.
+    """
 
-    def __init__(self, qsubscript, qsub_args=""):
+    def __init__(self, qsubscript, qsub_args="", array_dir=None, array_limit=None, array_job_name=None,
+                 max_array_size=ARRAY_MAX_SIZE):
 
         ####  verify PBS is present by calling pbsnodes cmd
         try:
@@ -47,12 +67,39 @@ class PBSTaskHandler(object):
             raise RuntimeError("Qsub script does not exist: {}".format(qsubscript))
 
         self.qsub_args = qsub_args
+        self.array_dir = array_dir
+        self.array_limit = array_limit
+        self.array_job_name = array_job_name
+        self.max_array_size = max_array_size
 
     def run_tasks(self, tasks, dryrun=False):
 
+        if self.array_dir and len(tasks) > 0:
+            array_walltimes = {}
+            single_tasks = []
+            for manifest, count in write_array_manifests(tasks, self.array_dir, self.array_job_name or tasks[0].abrv,
+                                                         max_array_size=self.max_array_size,
+                                                         walltimes=array_walltimes, single_tasks=single_tasks):
+                cmd = r'qsub {}{} -N {} -J 1-{}{} -v manifest="{}" "{}"'.format(
+                    self.qsub_args,
+                    format_pbs_walltime(array_walltimes[manifest]),
+                    self.array_job_name or tasks[0].abrv,
+                    count,
+                    '%{}'.format(self.array_limit) if self.array_limit else '',
+                    manifest,
+                    self.qsubscript
+                )
+                if dryrun:
+                    print(cmd)
+                else:
+                    subprocess.call(cmd, shell=True)
+            ## a one task array is submitted as a normal job
+            tasks = single_tasks
+
         for task in tasks:
-            cmd = r'qsub {} -N {} -v p1="{} {}" "{}"'.format(
+            cmd = r'qsub {}{} -N {} -v p1="{} {}" "{}"'.format(
                 self.qsub_args,
+                format_pbs_walltime(task.walltime),
                 task.abrv,
                 task.exe,
                 escape_problem_jobsubmit_chars(task.cmd),
@@ -65,8 +112,13 @@ class PBSTaskHandler(object):
 
 
 class SLURMTaskHandler(object):
+    """
+    Submits one SLURM job per task, or with array_dir, writes the task commands to manifest files in array_dir and
+    submits them as job arrays (sbatch --array) of at most max_array_size tasks, see write_array_manifests.
+    """
 
-    def __init__(self, qsubscript, qsub_args=""):
+    def __init__(self, qsubscript, qsub_args="", array_dir=None, array_limit=None, array_job_name=None,
+                 max_array_size=ARRAY_MAX_SIZE):
 
         ####  verify SLURM is present by calling sinfo cmd
         try:
@@ -83,12 +135,36 @@ class SLURMTaskHandler(object):
             raise RuntimeError("Qsub script does not exist: {}".format(qsubscript))
 
         self.qsub_args = qsub_args
+        self.array_dir = array_dir
+        self.array_limit = array_limit
+        self.array_job_name = array_job_name
+        self.max_array_size = max_array_size
 
     def run_tasks(self, tasks):
 
+        if self.array_dir and len(tasks) > 0:
+            array_walltimes = {}
+            single_tasks = []
+            for manifest, count in write_array_manifests(tasks, self.array_dir, self.array_job_name or tasks[0].abrv,
+                                                         max_array_size=self.max_array_size,
+                                                         walltimes=array_walltimes, single_tasks=single_tasks):
+                cmd = r'sbatch {}{} -J {} --array=1-{}{} --export=manifest="{}" "{}"'.format(
+                    self.qsub_args,
+                    format_slurm_walltime(array_walltimes[manifest]),
+                    self.array_job_name or tasks[0].abrv,
+                    count,
+                    '%{}'.format(self.array_limit) if self.array_limit else '',
+                    manifest,
+                    self.qsubscript
+                )
+                subprocess.call(cmd, shell=True)
+            ## a one task array is submitted as a normal job
+            tasks = single_tasks
+
         for task in tasks:
-            cmd = r'sbatch {} -J {} --export=p1="{} {}" "{}"'.format(
+            cmd = r'sbatch {}{} -J {} --export=p1="{} {}" "{}"'.format(
                 self.qsub_args,
+                format_slurm_walltime(task.walltime),
                 task.abrv,
                 task.exe,
                 escape_problem_jobsubmit_chars(task.cmd),
@@ -97,10 +173,90 @@ class SLURMTaskHandler(object):
             subprocess.call(cmd, shell=True)
             
 
+def split_array_tasks(tasks, max_array_size=None):
+    """
+    Split the tasks into the fewest lists of at most max_array_size (default ARRAY_MAX_SIZE) tasks, with sizes
+    that differ by at most one, e.g. 1001 tasks into arrays of 501 and 500 tasks rather than 1000 and 1.
+    """
+    if max_array_size is None:
+        max_array_size = ARRAY_MAX_SIZE
+    if len(tasks) == 0:
+        return []
+    chunk_total = int(math.ceil(len(tasks) / float(max_array_size)))
+    chunk_size, remainder = divmod(len(tasks), chunk_total)
+    chunks = []
+    start = 0
+    for chunk_num in range(chunk_total):
+        end = start + chunk_size + (1 if chunk_num < remainder else 0)
+        chunks.append(tasks[start:end])
+        start = end
+    return chunks
+
+
+def write_array_manifests(tasks, array_dir, prefix, max_array_size=None, walltimes=None, single_tasks=None):
+    """
+    Write the commands of the tasks, one per line, to manifest files in array_dir, splitting the tasks evenly into
+    arrays of at most max_array_size (default ARRAY_MAX_SIZE) tasks with split_array_tasks, and return a list of
+    (manifest path, number of tasks).  The submission scripts run the line of the manifest given by the job array
+    index (starting at 1) when the manifest variable is set.  If a walltimes dict is given, it is filled with the
+    longest task walltime of each manifest.  If a single_tasks list is given, arrays of one task are not written
+    and their task is appended to it instead, to be submitted as a normal job.
+    """
+    manifest_prefix = os.path.join(array_dir, '{}_{}_{}'.format(
+        prefix, datetime.now().strftime("%Y%m%d%H%M%S"), os.getpid()))
+    chunks = split_array_tasks(tasks, max_array_size)
+    if single_tasks is not None:
+        single_tasks.extend([chunk[0] for chunk in chunks if len(chunk) == 1])
+        chunks = [chunk for chunk in chunks if len(chunk) > 1]
+    manifest_fmt = '{:0>' + str(len(str(len(chunks)))) + '}'
+    manifests = []
+    for manifest_num, array_tasks in enumerate(chunks):
+        manifest = '{}_array{}.txt'.format(manifest_prefix, manifest_fmt.format(manifest_num + 1))
+        with open(manifest, 'w') as manifest_fp:
+            for task in array_tasks:
+                manifest_fp.write('{} {}\n'.format(task.exe, task.cmd))
+        manifests.append((manifest, len(array_tasks)))
+        if walltimes is not None:
+            task_walltimes = [task.walltime for task in array_tasks if task.walltime is not None]
+            walltimes[manifest] = max(task_walltimes) if task_walltimes else None
+    logger.info("Wrote %i tasks to %i job array manifests in %s", len(tasks), len(manifests), array_dir)
+    return manifests
+
+
+def format_walltime(seconds):
+    """Return a walltime in seconds as H:MM:SS"""
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def format_slurm_walltime(seconds):
+    """Return the sbatch option requesting a walltime in seconds, or an empty string if it is None"""
+    return '' if seconds is None else ' -t {}'.format(format_walltime(seconds))
+
+
+def format_pbs_walltime(seconds):
+    """Return the qsub option requesting a walltime in seconds, or an empty string if it is None"""
+    return '' if seconds is None else ' -l walltime={}'.format(format_walltime(seconds))
+
+
 class ParallelTaskHandler(object):
+    """
+    Runs tasks in a pool of child processes.
 
-    def __init__(self, num_processes=1):
+    Tasks are started in order of decreasing cost (longest processing time first) and each idle worker takes
+    the next task, so the largest scenes do not end up as the tail of the run.  Tasks without a cost keep their
+    order after the costed tasks.  The return code and duration of each task are recorded, failures and
+    stragglers are logged, and run_tasks returns a dict of task name to return code.
+
+    With in_process=True, the worker processes are forked once and call task.method(*task.method_arg_list)
+    directly instead of running the task command in a new python process, logging to task.logfile.  The
+    task's return value is its return code.
+    """
+
+    def __init__(self, num_processes=1, in_process=False):
         self.num_processes = num_processes
+        self.in_process = in_process
+        self.task_results = []
         if mp.cpu_count() < num_processes:
             raise RuntimeError("Specified number of processes ({0}) is higher than the system cpu count ({1})".
                                format(num_processes, mp.cpu_count()))
@@ -110,13 +266,39 @@ class ParallelTaskHandler(object):
 
     def run_tasks(self, tasks):
 
-        task_queue = [[task.name, self._format_task(task)] for task in tasks]
-        pool = mp.Pool(self.num_processes)
+        tasks = order_tasks_by_cost(tasks)
+        if self.in_process:
+            if any([task.method is None for task in tasks]):
+                raise RuntimeError("In-process execution requires a task method for every task")
+            ## fork where available, so the workers inherit the loaded modules and the task list
+            if 'fork' in mp.get_all_start_methods():
+                context = mp.get_context('fork')
+            else:
+                context = mp.get_context()
+            pool = context.Pool(self.num_processes, initializer=init_method_worker, initargs=(tasks,))
+            job_func = exec_method_mp
+            task_queue = list(range(len(tasks)))
+        else:
+            pool = mp.Pool(self.num_processes)
+            job_func = exec_cmd_mp
+            task_queue = [[task.name, self._format_task(task)] for task in tasks]
+
+        self.task_results = []
         try:
-            pool.map(exec_cmd_mp, task_queue, 1)
+            for result in pool.imap_unordered(job_func, task_queue, 1):
+                self.task_results.append(result)
+                job_name, rc, duration = result
+                if rc != 0:
+                    logger.error("Job failed with return code %s after %.1fs: %s", rc, duration, job_name)
+            pool.close()
         except KeyboardInterrupt:
             pool.terminate()
             raise RuntimeError("Processes terminated without file cleanup")
+        finally:
+            pool.join()
+
+        report_task_results(self.task_results)
+        return dict([(job_name, rc) for job_name, rc, duration in self.task_results])
 
     def _format_task(self, task):
         _cmd = r'{} {}'.format(
@@ -124,12 +306,54 @@ class ParallelTaskHandler(object):
             task.cmd,
         )
         return _cmd
-                
+
+
+def get_task_cost(*paths):
+    """
+    Return the estimated cost of a task that reads the given source files: their total size in bytes.
+    Size scales with pixel count times band count for the uncompressed and NITF imagery this runs on.
+    """
+    cost = 0
+    for path in paths:
+        if path is not None:
+            try:
+                cost += os.path.getsize(path)
+            except OSError:
+                pass
+    return cost
+
+
+def order_tasks_by_cost(tasks):
+    """Return the tasks sorted by decreasing cost, with tasks without a cost last in their original order"""
+    return sorted(tasks, key=lambda task: -task.cost if getattr(task, 'cost', None) is not None else 0)
+
+
+def report_task_results(task_results, straggler_factor=STRAGGLER_FACTOR):
+    """
+    Log a summary of (job name, return code, duration) task results: failed tasks and stragglers, the tasks
+    that took more than straggler_factor times the median duration
+    """
+    if len(task_results) == 0:
+        return
+    durations = sorted([duration for job_name, rc, duration in task_results])
+    median = durations[len(durations) // 2]
+    failed = [job_name for job_name, rc, duration in task_results if rc != 0]
+    logger.info("Completed %i tasks, %i failed, median duration %.1fs, longest %.1fs",
+                len(task_results), len(failed), median, durations[-1])
+    for job_name in failed:
+        logger.warning("Failed task: %s", job_name)
+    if len(task_results) > 2:
+        for job_name, rc, duration in task_results:
+            if duration > median * straggler_factor and duration - median > STRAGGLER_MIN_SECONDS:
+                logger.info("Straggler task: %s took %.1fs (%.1fx median)", job_name, duration,
+                            duration / median if median > 0 else float('inf'))
+
 
 def exec_cmd_mp(job):
     job_name, cmd = job
     logger.info('Running job: %s', job_name)
     logger.debug('Cmd: %s', cmd)
+    t0 = time.time()
     if platform.system() == "Windows":
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
     else:
@@ -141,10 +365,59 @@ def exec_cmd_mp(job):
             p.terminate()
         else:
             os.killpg(p.pid, signal.SIGTERM)
+        rc = -signal.SIGTERM
 
     else:
         logger.debug(so)
         logger.debug(se)
+        rc = p.returncode
+
+    return job_name, rc, time.time() - t0
+
+
+_worker_tasks = []
+
+
+def init_method_worker(tasks):
+    global _worker_tasks
+    _worker_tasks = tasks
+
+
+def exec_method_mp(task_index):
+    """
+    Run task.method(*task.method_arg_list) for a task given by its index in the worker's task list, logging
+    to the task's log file only, and return (job name, return code, duration)
+    """
+    task = _worker_tasks[task_index]
+    t0 = time.time()
+
+    ## like a task command's output, the task's log messages go to its log file and not to the terminal
+    parent_handlers = logger.handlers[:]
+    for handler in parent_handlers:
+        logger.removeHandler(handler)
+    lfh = None
+    if task.logfile:
+        lfh = logging.FileHandler(task.logfile)
+        lfh.setLevel(logging.DEBUG)
+        formatter = logging.Formatter('%(asctime)s %(levelname)s- %(message)s', '%m-%d-%Y %H:%M:%S')
+        lfh.setFormatter(formatter)
+        logger.addHandler(lfh)
+
+    try:
+        rc = task.method(*task.method_arg_list)
+        if rc is None:
+            rc = 0
+    except Exception:
+        logger.error(traceback.format_exc())
+        rc = 1
+    finally:
+        if lfh is not None:
+            logger.removeHandler(lfh)
+            lfh.close()
+        for handler in parent_handlers:
+            logger.addHandler(handler)
+
+    return task.name, rc, time.time() - t0
 
 
 def exec_cmd(cmd):
@@ -4,7 +4,6 @@ import copy
 import enum
 import glob
 import logging
-import math
 import os
 import re
 import sys
@@ -16,6 +15,8 @@ from xml.etree import ElementTree as ET
 import numpy as np
 from osgeo import gdal, ogr, osr
 
+from lib import discovery
+
 try:
     import collections.abc as collectionsAbc
 except ImportError:
@@ -203,66 +204,20 @@ def get_sensor(srcfn):
 
 def find_images(inpath, is_filelist, target_exts):
 
-    image_list = []
-    if is_filelist:
-        if type(inpath) is str:
-            with open(inpath, 'r') as textfile_fp:
-                inpath = textfile_fp.read().splitlines()
-        for image in inpath:
-            if os.path.isfile(image) and os.path.splitext(image)[1].lower() in target_exts:
-                image_list.append(image)
-            else:
-                logger.debug("File in textfile does not exist or has an invalid extension: %s", image)
-
-    else:
-        for root, dirs, files in os.walk(inpath):
-            for f in files:
-                if os.path.splitext(f)[1].lower() in target_exts:
-                    image_path = os.path.join(root, f)
-                    image_path = image_path.replace('\\', '/')
-                    image_list.append(image_path)
-
-    return image_list
+    return list(discovery.iter_images(inpath, is_filelist, target_exts))
 
 
 def find_images_with_exclude_list(inpath, is_filelist, target_exts, exclude_list):
 
+    matcher = discovery.get_exclude_matcher(exclude_list)
     image_list = []
+    for image in discovery.iter_images(inpath, is_filelist is True, target_exts, log_level=logging.INFO):
+        if matcher.match(image) is not None:
+            logger.debug("Scene ID matches pattern in exclude_list: %s", image)
+        else:
+            image_list.append(image)
 
-    if is_filelist is True:
-        if type(inpath) is str:
-            with open(inpath, 'r') as textfile_fp:
-                inpath = textfile_fp.read().splitlines()
-        for line in inpath:
-            image = line.rstrip('\n').rstrip('\r')
-            if os.path.isfile(image) and os.path.splitext(image)[1].lower() in target_exts:
-                image_list.append(image)
-            else:
-                logger.info("File in textfile does not exist or has an invalid extension: %s", image)
-
-    else:
-        for root, dirs, files in os.walk(inpath):
-            for f in files:
-                if os.path.splitext(f)[1].lower() in target_exts:
-                    image_path = os.path.join(root, f)
-                    image_path = image_path.replace('\\', '/')
-                    image_list.append(image_path)
-
-    #print(len(exclude_list))
-    if len(exclude_list) > 0:
-
-        image_list2 = []
-        for image in image_list:
-            exclude = [pattern for pattern in exclude_list if image in pattern]
-            if exclude:
-                logger.debug("Scene ID matches pattern in exclude_list: %s", image)
-            else:
-                image_list2.append(image)
-
-        return image_list2
-
-    else:
-        return image_list
+    return image_list
 
 
 def delete_temp_files(names):
@@ -648,9 +603,19 @@ def getWrappedGeometry(src_geom):
 def write_task_bundles(task_list, tasks_per_bundle, dstdir, bundle_prefix,
                        header_list=None, task_delim=',', bundle_ext='txt'):
 
-    jobnum_total = int(math.ceil(len(task_list) / float(tasks_per_bundle)))
+    bundles = [task_list[tasknum:tasknum+tasks_per_bundle] for tasknum in range(0, len(task_list), tasks_per_bundle)]
+    return write_task_bundle_list(bundles, dstdir, bundle_prefix,
+                                  header_list=header_list, task_delim=task_delim, bundle_ext=bundle_ext)
+
+
+def write_task_bundle_list(bundles, dstdir, bundle_prefix,
+                           header_list=None, task_delim=',', bundle_ext='txt'):
+    """
+    Write each list of tasks in bundles to a task bundle file in dstdir and return the list of file paths
+    """
+    jobnum_total = len(bundles)
     jobnum_fmt = '{:0>'+str(len(str(jobnum_total)))+'}'
-    join_task_items = type(task_list[0]) in (tuple, list, np.ndarray)
+    join_task_items = type(bundles[0][0]) in (tuple, list, np.ndarray)
 
     bundle_prefix = os.path.join(
         dstdir,
@@ -663,9 +628,8 @@ def write_task_bundles(task_list, tasks_per_bundle, dstdir, bundle_prefix,
     header_line = task_delim.join(header_list) if header_list is not None else None
 
     print("Writing task bundle text files in directory: {}".format(dstdir))
-    for jobnum, tasknum in enumerate(range(0, len(task_list), tasks_per_bundle)):
+    for jobnum, task_bundle in enumerate(bundles):
         bundle_file = '{}_{}.{}'.format(bundle_prefix, jobnum_fmt.format(jobnum+1), bundle_ext)
-        task_bundle = task_list[tasknum:tasknum+tasks_per_bundle]
         with open(bundle_file, 'w') as bundle_file_fp:
             if header_line is not None:
                 bundle_file_fp.write(header_line+'\n')
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Directory of warped intermediates shared by the products of an image that differ only in stretch, output type or
+format.
+
+The warp of an image depends on the source, DEM and warp parameters but not on how the output is stretched or
+written, so with --warp-cache process_image warps each image once into the cache and runs calc_stats against the
+cached warp for every product, e.g. u08rf, u16ns and f32rd outputs of the same scene.  Entries are named by a digest
+of the warp parameters (ortho_functions.get_warp_key) and each has a journal recording its checksum, which is
+verified before reuse.  Cached warps use the nodata value WARP_NODATA whatever the output type, and calc_stats maps
+it to the nodata value of the output.
+
+The cache is kept under a size budget (--warp-cache-size) by deleting the least recently used entries after each
+new warp.  An entry is used when it is written or reused, which is recorded by touching its journal.  Warps that
+other runs are still writing are never deleted.
+"""
+
+import logging
+import os
+import time
+
+from lib import journal
+
+#### Create Logger
+logger = logging.getLogger("logger")
+logger.setLevel(logging.DEBUG)
+
+ARGDEF_WARP_CACHE_SIZE = 500  # GB
+WARP_NODATA = -9999.0
+WARP_SUFFIX = '_warp.tif'
+KEY_LENGTH = 16
+PART_SUFFIX = '.part'
+STALE_PART_AGE = 2 * 24 * 3600  # seconds
+
+
+def get_entry_path(cache_dir, srcfn, warp_key):
+    """Return the path of the cached warp of a source image with the given warp key"""
+    return os.path.join(os.path.abspath(cache_dir),
+                        "{}_{}{}".format(os.path.splitext(srcfn)[0], warp_key[:KEY_LENGTH], WARP_SUFFIX))
+
+
+def get_last_used(path):
+    """Return the time an entry was last written or reused"""
+    for fp in (journal.get_journal_path(path), path):
+        try:
+            return os.path.getmtime(fp)
+        except OSError:
+            pass
+    return 0
+
+
+def touch(path):
+    """Mark an entry as used now"""
+    try:
+        os.utime(journal.get_journal_path(path), None)
+    except OSError as e:
+        logger.debug("Cannot update the use time of %s: %s", path, e)
+
+
+def evict(cache_dir, max_bytes, keep=()):
+    """
+    Delete the least recently used entries of the cache until it holds at most max_bytes, never deleting the
+    entries in keep.  Warps being written by other runs (.part files) count towards the size but are never
+    deleted, except those not modified for STALE_PART_AGE, which were left over by interrupted runs.
+    Returns the paths of the deleted entries and stale .part files.
+    """
+    entries = []
+    total = 0
+    evicted = []
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if WARP_SUFFIX not in name or name.endswith(journal.JOURNAL_SUFFIX):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if name.endswith(PART_SUFFIX):
+            if now - st.st_mtime > STALE_PART_AGE:
+                logger.info("Removing stale partial warp from the cache: %s", path)
+                try:
+                    os.remove(path)
+                    evicted.append(path)
+                    continue
+                except OSError:
+                    pass
+            total += st.st_size
+            continue
+        total += st.st_size
+        entries.append((get_last_used(path), path, st.st_size))
+
+    keep = set([os.path.abspath(fp) for fp in keep])
+    for last_used, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        logger.info("Removing least recently used warp from the cache: %s", path)
+        for fp in (path, path + '.aux.xml', journal.get_journal_path(path)):
+            try:
+                os.remove(fp)
+            except OSError:
+                pass
+        total -= size
+        evicted.append(path)
+    return evicted
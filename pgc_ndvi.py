@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
 import argparse
+import collections
+import concurrent.futures
 import logging
 import math
 import os
@@ -8,10 +10,9 @@ import shutil
 import sys
 import datetime
 
-import numpy
 from osgeo import gdal
 
-from lib import ortho_functions, taskhandler, utils
+from lib import autotune, ortho_functions, perf, spectral_index, staging, taskhandler, utils
 from lib import VERSION
 
 #### Create Loggers
@@ -20,7 +21,14 @@ logger.setLevel(logging.DEBUG)
 
 outtypes = ['Float32', 'Int16']
 
+# minimum height in rows of the strips handed to the block processing threads
+STRIP_MIN_ROWS = 64
+
+ARGDEF_SCRATCH = os.path.join(os.path.expanduser('~'), 'scratch', 'task_bundles')
+
+
 def main():
+    ret_code = 0
 
     #### Set Up Arguments
     parser = argparse.ArgumentParser(
@@ -33,10 +41,24 @@ def main():
 
     parser.add_argument("-t", "--outtype", choices=outtypes, default='Float32',
                         help="output data type (for Int16, output values are scaled from -1000 to 1000)")
+    parser.add_argument("--index", default='ndvi',
+                        help="comma separated list of indices to calculate from one read of the image: "
+                             "built-in {} or name=expression using band names ({}) or numbers (b1, b2, ...), "
+                             "e.g. --index ndvi,ndwi,ratio=nir/red.  evi needs Float32 reflectance (f32rf) input "
+                             "(default=ndvi)"
+                        .format(', '.join(sorted(list(spectral_index.NORMALIZED_DIFFERENCE_INDICES) +
+                                                 list(spectral_index.EXPRESSION_INDICES))),
+                                ', '.join(spectral_index.BAND_ROLES[8])))
+    parser.add_argument("--separate", action='store_true', default=False,
+                        help="write each index to its own single band file (<image>_<index>.tif) instead of one "
+                             "multi-band file (<image>_<index1>_<index2>...tif)")
     parser.add_argument("-s", "--save-temps", action="store_true", default=False,
                         help="save temp files")
     parser.add_argument("--wd",
                         help="local working directory for cluster jobs (default is dst dir)")
+    parser.add_argument("--staged-read", action='store_true', default=False,
+                        help="with --wd, copy the source image to the working directory in parallel checksummed "
+                             "chunks")
     parser.add_argument("--pbs", action='store_true', default=False,
                         help="submit tasks to PBS")
     parser.add_argument("--slurm", action='store_true', default=False,
@@ -47,8 +69,26 @@ def main():
                              "To use the current working directory, use 'working_dir'")
     parser.add_argument("--slurm-job-name", default=None,
                         help="assign a name to the slurm job for easier job tracking")
+    parser.add_argument("--array-job", action='store_true', default=False,
+                        help="submit the tasks as job arrays (sbatch --array or qsub -J) reading the task commands "
+                             "from a manifest file, instead of one job per task (requires --pbs or --slurm option)")
+    parser.add_argument("--array-limit", type=int,
+                        help="maximum number of array tasks running at the same time (with --array-job)")
+    parser.add_argument('--scratch', default=ARGDEF_SCRATCH,
+                        help="Scratch space to build job array manifest text files. "
+                             "(default={})".format(ARGDEF_SCRATCH))
     parser.add_argument("--parallel-processes", type=int, default=1,
                         help="number of parallel processes to spawn (default 1)")
+    parser.add_argument("--in-process", action='store_true', default=False,
+                        help="with --parallel-processes, fork the worker processes once and run each image in them "
+                             "directly instead of starting a new python process per image")
+    parser.add_argument("--auto-parallel", action='store_true', default=False,
+                        help="choose the number of parallel processes and threads per process by running a sample of "
+                             "the images with several combinations and using the one with the highest throughput "
+                             "(overrides --parallel-processes and --threads)")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="number of threads used to calculate row strips of each image (default 1). If used with "
+                             "--parallel-processes, the (threads * number of processes) should be <= system count")
     parser.add_argument("--qsubscript",
                         help="submission script to use in PBS/SLURM submission (PBS default is qsub_ndvi.sh, SLURM "
                              "default is slurm_ndvi.py, in script root folder)")
@@ -71,6 +111,7 @@ def main():
     scriptpath = os.path.abspath(sys.argv[0])
     src = os.path.abspath(args.src)
     dstdir = os.path.abspath(args.dst)
+    args.scratch = os.path.abspath(args.scratch)
 
     #### Validate Required Arguments
     if os.path.isdir(src):
@@ -87,6 +128,12 @@ def main():
     if not os.path.isdir(dstdir):
         parser.error("Error arg2 is not a valid file path: {}".format(dstdir))
 
+    try:
+        indices = spectral_index.parse_indices(args.index)
+    except utils.InvalidArgumentError as e:
+        parser.error(e)
+    index_names = [index.name for index in indices]
+
     ## Verify qsubscript
     if args.pbs or args.slurm:
         if args.qsubscript is None:
@@ -119,6 +166,25 @@ def main():
         parser.error("Options --pbs and --slurm are mutually exclusive")
     if (args.pbs or args.slurm) and args.parallel_processes > 1:
         parser.error("HPC Options (--pbs or --slurm) and --parallel-processes > 1 are mutually exclusive")
+    if (args.pbs or args.slurm) and args.auto_parallel:
+        parser.error("HPC Options (--pbs or --slurm) and --auto-parallel are mutually exclusive")
+    if (args.pbs or args.slurm) and args.threads > 1:
+        parser.error("HPC Options (--pbs or --slurm) and --threads > 1 are mutually exclusive")
+    if args.threads < 1:
+        parser.error("--threads count must be positive, nonzero integer")
+    if args.parallel_processes > 1 and not args.auto_parallel:
+        total_proc_count = args.threads * args.parallel_processes
+        if total_proc_count > ortho_functions.ARGDEF_CPUS_AVAIL:
+            parser.error("the (threads * number of processes requested) ({0}) exceeds number of available threads "
+                         "({1}); reduce --threads and/or --parallel-processes count"
+                         .format(total_proc_count, ortho_functions.ARGDEF_CPUS_AVAIL))
+    if args.array_job and not (args.pbs or args.slurm):
+        parser.error("--array-job option requires the (--pbs or --slurm) option")
+    if args.array_limit is not None and args.array_limit < 1:
+        parser.error("--array-limit must be a positive integer")
+    if args.array_job and not os.path.isdir(args.scratch):
+        print("Creating --scratch directory: {}".format(args.scratch))
+        os.makedirs(args.scratch)
 
     #### Set concole logging handler
     lso = logging.StreamHandler()
@@ -151,7 +217,8 @@ def main():
         logger.info("Slurm output and error log saved here: {}".format(slurm_log_dir))
 
     #### Get args ready to pass to task handler
-    arg_keys_to_remove = ('l', 'qsubscript', 'pbs', 'slurm', 'parallel_processes', 'dryrun')
+    arg_keys_to_remove = ('l', 'qsubscript', 'pbs', 'slurm', 'parallel_processes', 'in_process', 'auto_parallel',
+                          'array_job', 'array_limit', 'scratch', 'dryrun')
     arg_str = taskhandler.convert_optional_args_to_string(args, pos_arg_keys, arg_keys_to_remove)
     
     ## Identify source images
@@ -169,9 +236,10 @@ def main():
     for srcfp in image_list:
         srcdir, srcfn = os.path.split(srcfp)
         bn, ext = os.path.splitext(srcfn)
-        dstfp = os.path.join(dstdir, bn + '_ndvi.tif')
-        
-        if not os.path.isfile(dstfp):
+        dstfps = spectral_index.get_output_paths(dstdir, bn, index_names, args.separate)
+        dstfp = os.path.join(dstdir, '{}_{}.tif'.format(bn, '_'.join(index_names)))
+
+        if not all([os.path.isfile(fp) for fp in dstfps]):
             i += 1
 
             # add a custom name to the job
@@ -185,8 +253,10 @@ def main():
                 job_name,
                 'python',
                 '{} {} {} {}'.format(scriptpath, arg_str, srcfp, dstdir),
-                calc_ndvi,
-                [srcfp, dstfp, args]
+                calc_indices,
+                [srcfp, dstfp, args],
+                task_cost=taskhandler.get_task_cost(srcfp),
+                task_logfile=os.path.splitext(dstfp)[0] + ".log"
             )
             task_queue.append(task)
        
@@ -198,7 +268,12 @@ def main():
         if args.pbs:
             l = "-l {}".format(args.l) if args.l else ""
             try:
-                task_handler = taskhandler.PBSTaskHandler(qsubpath, l)
+                task_handler = taskhandler.PBSTaskHandler(
+                    qsubpath, l,
+                    array_dir=args.scratch if args.array_job else None,
+                    array_limit=args.array_limit,
+                    array_job_name=args.slurm_job_name or 'NDVI'
+                )
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
@@ -213,7 +288,12 @@ def main():
                 qsub_args += '-e {}/%x.o%j '.format(slurm_log_dir)
 
             try:
-                task_handler = taskhandler.SLURMTaskHandler(qsubpath, qsub_args)
+                task_handler = taskhandler.SLURMTaskHandler(
+                    qsubpath, qsub_args,
+                    array_dir=args.scratch if args.array_job else None,
+                    array_limit=args.array_limit,
+                    array_job_name=args.slurm_job_name or 'NDVI'
+                )
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
@@ -221,16 +301,24 @@ def main():
                 if not args.dryrun:
                     task_handler.run_tasks(task_queue)
             
+        elif args.auto_parallel:
+            if not args.dryrun:
+                results = autotune.run_auto_parallel(task_queue, args.in_process)
+                if any([v != 0 for v in results.values()]):
+                    ret_code = 1
+
         elif args.parallel_processes > 1:
             try:
-                task_handler = taskhandler.ParallelTaskHandler(args.parallel_processes)
+                task_handler = taskhandler.ParallelTaskHandler(args.parallel_processes, args.in_process)
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
             else:
                 logger.info("Number of child processes to spawn: %i", task_handler.num_processes)
                 if not args.dryrun:
-                    task_handler.run_tasks(task_queue)
+                    results = task_handler.run_tasks(task_queue)
+                    if any([v != 0 for v in results.values()]):
+                        ret_code = 1
     
         else:        
             results = {}
@@ -256,27 +344,44 @@ def main():
             for k, v in results.items():
                 if v != 0:
                     logger.warning("Failed Image: %s", k)
+                    ret_code = 1
         
         logger.info("Done")
         
     else:
         logger.info("No images found to process")
+
+    sys.exit(ret_code)
         
     
-def calc_ndvi(srcfp, dstfp, args):
-
-    # ndvi nodata value
-    ndvi_nodata = -9999
-
-    # tolerance for floating point equality
-    tol = 0.00001
+def calc_indices(srcfp, dstfp, args):
+    """
+    Calculate the indices given by args.index for srcfp.  dstfp is the multi-band output path
+    (<image>_<index1>_<index2>...tif); with args.separate each index is written to <image>_<index>.tif
+    in the same directory instead.
+    """
+    srcfn = os.path.basename(srcfp)
+    timer = perf.StageTimer(task='ndvi', image=srcfn, sensor=utils.get_sensor(srcfn)[1])
+    rc = 1
+    try:
+        rc = _calc_indices(srcfp, dstfp, args, timer)
+    finally:
+        timer.log_record(rc=rc)
+    return rc
+
+
+def _calc_indices(srcfp, dstfp, args, timer):
+
+    indices = spectral_index.parse_indices(getattr(args, 'index', 'ndvi'))
+    index_names = [index.name for index in indices]
+    index_nodata = spectral_index.INDEX_NODATA
 
     # get basenames for src and dst files, get xml metadata filenames
     srcdir, srcfn = os.path.split(srcfp)
     dstdir, dstfn = os.path.split(dstfp)
     bn, ext = os.path.splitext(srcfn)
     src_xml = os.path.join(srcdir, bn + '.xml')
-    dst_xml = os.path.join(dstdir, bn + '_ndvi.xml')
+    dstfps = spectral_index.get_output_paths(dstdir, bn, index_names, getattr(args, 'separate', False))
 
     #### Get working dir
     if args.wd is not None:
@@ -291,218 +396,180 @@ def calc_ndvi(srcfp, dstfp, args):
     logger.info("Working Dir: %s", wd)
 
     print("Image: {}".format(srcfn))
-   
+
+    if all([os.path.isfile(fp) for fp in dstfps]):
+        logger.info("pgc_ndvi.py: files %s already exist", ', '.join(dstfps))
+
+        ## copy xml to dst if missing
+        for fp in dstfps:
+            dst_xml = os.path.splitext(fp)[0] + '.xml'
+            if not os.path.isfile(dst_xml):
+                shutil.copy2(src_xml, dst_xml)
+        return 0
+
     ## copy source image to working directory
     srcfp_local = os.path.join(wd, srcfn)
     if not os.path.isfile(srcfp_local):
-        shutil.copy2(srcfp, srcfp_local)
+        with timer.stage('copy_to_wd'):
+            if getattr(args, 'staged_read', False):
+                staging.copy_file(srcfp, srcfp_local)
+            else:
+                shutil.copy2(srcfp, srcfp_local)
 
-    ## open image and get band numbers
+    ## open image
     ds = gdal.Open(srcfp_local)
-    if ds:
-        bands = ds.RasterCount
-        if bands == 8:
-            red_band_num = 5
-            nir_band_num = 7
-        elif bands == 4:
-            red_band_num = 3
-            nir_band_num = 4
-        else:
-            logger.error("Cannot calculate NDVI from a %i band image: %s", bands, srcfp_local)
-            clean_up([srcfp_local])
-            return 1
-    else:
+    if not ds:
         logger.error("Cannot open target image: %s", srcfp_local)
         clean_up([srcfp_local])
         return 1
+    bands = ds.RasterCount
+    timer.fields['bands'] = bands
 
     ## check for input data type - must be float or int
     datatype = ds.GetRasterBand(1).DataType
     if datatype not in [1, 2, 3, 4, 5, 6, 7]:
         logger.error("Invalid input data type %s", datatype)
         clean_up([srcfp_local])
-        return 1 
+        return 1
+
+    ## indices with reflectance constants (e.g. evi) need 0 to 1 reflectance, which only float input has
+    reflectance_indices = [index.name for index in indices if index.reflectance]
+    if reflectance_indices and datatype not in [6, 7]:
+        logger.error("Index %s needs Float32 reflectance input (pgc_ortho -t Float32 -c rf), not data type %s: %s",
+                     ', '.join(reflectance_indices), gdal.GetDataTypeName(datatype), srcfp)
+        clean_up([srcfp_local])
+        return 1
 
     ## get the raster dimensions
     nx = ds.RasterXSize
     ny = ds.RasterYSize
-
-    ## open output file for write and copy proj/geotransform info
-    if not os.path.isfile(dstfp):
-        dstfp_local = os.path.join(wd, os.path.basename(dstfp))
-        gtiff_options = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=YES']
-        driver = gdal.GetDriverByName('GTiff')
-        out_ds = driver.Create(dstfp_local, nx, ny, 1, gdal.GetDataTypeByName(args.outtype), gtiff_options)
-        if out_ds:
-            out_ds.SetGeoTransform(ds.GetGeoTransform())
-            out_ds.SetProjection(ds.GetProjection())
-            ndvi_band = out_ds.GetRasterBand(1)
-            ndvi_band.SetNoDataValue(float(ndvi_nodata))
-        else:
-            logger.error("Couldn't open for write: %s", dstfp_local)
+    timer.fields['megapixels'] = nx * ny / 1e6
+
+    ## get nodata values and natural block size of every band, if NoData is None default it to zero.
+    band_nodata = {}
+    block_sizes = []
+    for band_num in range(1, bands + 1):
+        band = ds.GetRasterBand(band_num)
+        nodata = band.GetNoDataValue()
+        band_nodata[band_num] = 0.0 if nodata is None else nodata
+        block_sizes.append(band.GetBlockSize())
+
+    ## process full width strips of whole block rows, using the smallest block height if they differ
+    yblocksize = min([b[1] for b in block_sizes])
+    strip_ysize = yblocksize * max(1, STRIP_MIN_ROWS // yblocksize)
+    nstrips = int(math.ceil(ny / strip_ysize))
+
+    ## build one kernel per index for this band layout.  Each strip in flight uses its own set of kernels,
+    ## so a set is only reused after its strip has been written.
+    threads = max(getattr(args, 'threads', 1), 1)
+    try:
+        kernel_sets = [[index.build_kernel(bands, nx * strip_ysize, args.outtype, band_nodata)
+                        for index in indices] for _ in range(threads + 1)]
+    except utils.InvalidArgumentError as e:
+        logger.error("Cannot calculate %s from %s: %s", ', '.join(index_names), srcfp_local, e)
+        clean_up([srcfp_local])
+        return 1
+    kernels = kernel_sets[0]
+
+    ## read each band needed by any index only once per strip
+    read_band_nums = sorted(set([b for kernel in kernels for b in kernel.bands]))
+    read_bands = {b: ds.GetRasterBand(b) for b in read_band_nums}
+    logger.info("Calculating %s from bands %s", ', '.join(index_names), read_band_nums)
+
+    ## open output files for write and copy proj/geotransform info
+    dstfps_local = [os.path.join(wd, os.path.basename(fp)) for fp in dstfps]
+    gtiff_options = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=YES']
+    driver = gdal.GetDriverByName('GTiff')
+    out_datasets = []
+    out_bands = []
+    for fp in dstfps_local:
+        out_band_count = 1 if len(dstfps_local) > 1 else len(kernels)
+        out_ds = driver.Create(fp, nx, ny, out_band_count, gdal.GetDataTypeByName(args.outtype), gtiff_options)
+        if not out_ds:
+            logger.error("Couldn't open for write: %s", fp)
             clean_up([srcfp_local])
             return 1
+        out_ds.SetGeoTransform(ds.GetGeoTransform())
+        out_ds.SetProjection(ds.GetProjection())
+        for band_num in range(1, out_band_count + 1):
+            out_band = out_ds.GetRasterBand(band_num)
+            out_band.SetNoDataValue(float(index_nodata))
+            out_bands.append(out_band)
+        out_datasets.append(out_ds)
+    for out_band, name in zip(out_bands, index_names):
+        out_band.SetDescription(name)
+
+    ## strips are read in order and written in order on this thread, since GDAL datasets are not thread
+    ## safe; only the index calculation runs in the thread pool
+    free_kernel_sets = collections.deque(kernel_sets)
+    in_flight = collections.deque()
+
+    def write_strip(yoff, strip_kernels, future):
+        for result, out_band in zip(future.result(), out_bands):
+            out_band.WriteArray(result, 0, yoff)
+        free_kernel_sets.append(strip_kernels)
+
+    logger.info("Processing %i strips of %i rows with %i threads", nstrips, strip_ysize, threads)
+    with timer.stage('index'), concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        for strip in range(nstrips):
+            yoff = strip * strip_ysize
+            strip_ny = min(strip_ysize, ny - yoff)
+
+            if len(free_kernel_sets) == 0:
+                write_strip(*in_flight.popleft())
+            strip_kernels = free_kernel_sets.popleft()
+
+            ## read a strip from each needed band
+            arrays = {b: band.ReadAsArray(0, yoff, nx, strip_ny) for b, band in read_bands.items()}
+            in_flight.append((yoff, strip_kernels, executor.submit(calc_strip, strip_kernels, arrays)))
+            arrays = None
+
+        while len(in_flight) > 0:
+            write_strip(*in_flight.popleft())
+
+    out_bands = None
+    out_datasets = None
+    read_bands = None
+    ds = None
+
+    missing = [fp for fp in dstfps_local if not os.path.isfile(fp)]
+    if len(missing) > 0:
+        logger.error("pgc_ndvi.py: %s was not created", ', '.join(missing))
+        return 1
 
-        ## for red and nir bands, get band data, nodata values, and natural block size
-        ## if NoData is None default it to zero.
-        red_band = ds.GetRasterBand(red_band_num)
-        if red_band is None:
-            logger.error("Can't load band %i from %s", red_band_num, srcfp_local)
-            clean_up([srcfp_local])
-            return 1
-        red_nodata = red_band.GetNoDataValue()
-        if red_nodata is None:
-            logger.info("Defaulting red band nodata to zero")
-            red_nodata = 0.0
-        (red_xblocksize, red_yblocksize) = red_band.GetBlockSize()
-    
-        nir_band = ds.GetRasterBand(nir_band_num)
-        if nir_band is None:
-            logger.error("Can't load band %i from %s", nir_band_num, srcfp_local)
-            clean_up([srcfp_local])
-            return 1
-        nir_nodata = nir_band.GetNoDataValue()
-        if nir_nodata is None:
-            logger.info("Defaulting nir band nodata to zero")
-            nir_nodata = 0.0
-        (nir_xblocksize, nir_yblocksize) = nir_band.GetBlockSize()
-
-        ## if different block sizes choose the smaller of the two
-        xblocksize = min([red_xblocksize, nir_xblocksize])
-        yblocksize = min([red_yblocksize, nir_yblocksize])
-
-        ## calculate the number of x and y blocks to read/write
-        nxblocks = int(math.floor(nx + xblocksize - 1) / xblocksize)
-        nyblocks = int(math.floor(ny + yblocksize - 1) / yblocksize)
-
-        ## blocks loop
-        yblockrange = range(nyblocks)
-        xblockrange = range(nxblocks)
-        for yblock in yblockrange:
-            ## y offset for ReadAsArray
-            yoff = yblock * yblocksize
-
-            ## get block actual y size in case of partial block at edge
-            if yblock < nyblocks - 1:
-                block_ny = yblocksize
-            else:
-                block_ny = ny - (yblock * yblocksize)
-
-            for xblock in xblockrange:
-                ## x offset for ReadAsArray
-                xoff = xblock * xblocksize
-
-                ## get block actual x size in case of partial block at edge
-                if xblock < (nxblocks - 1):
-                    block_nx = xblocksize
-                else:
-                    block_nx = nx - (xblock * xblocksize)
-
-                ## read a block from each band
-                red_array = red_band.ReadAsArray(xoff, yoff, block_nx, block_ny)
-                nir_array = nir_band.ReadAsArray(xoff, yoff, block_nx, block_ny)
-
-                ## generate mask for red nodata, nir nodata, and 
-                ## (red+nir) less than tol away from zero
-                red_mask = (red_array == red_nodata)
-                if red_array[red_mask].size > 0:
-                    nir_mask = (nir_array == nir_nodata)
-                    if nir_array[nir_mask].size > 0:
-                        divzero_mask = abs(nir_array + red_array) < tol
-                        if red_array[divzero_mask].size > 0:
-                            ndvi_mask = red_mask | nir_mask | divzero_mask
-                        else:
-                            ndvi_mask = red_mask | nir_mask
-                    else:
-                        divzero_mask = abs(nir_array + red_array) < tol
-                        if red_array[divzero_mask].size > 0:
-                            ndvi_mask = red_mask | divzero_mask
-                        else:
-                            ndvi_mask = red_mask
-                else:
-                    nir_mask = (nir_array == nir_nodata)
-                    if nir_array[nir_mask].size > 0:
-                        divzero_mask = abs(nir_array + red_array) < tol
-                        if red_array[divzero_mask].size > 0:
-                            ndvi_mask = nir_mask | divzero_mask
-                        else:
-                            ndvi_mask = nir_mask
-                    else:
-                        divzero_mask = abs(nir_array + red_array) < tol
-                        if red_array[divzero_mask].size > 0:
-                            ndvi_mask = divzero_mask
-                        else:
-                            ndvi_mask = numpy.full_like(red_array, fill_value=0, dtype=bool)
-
-                ## declare ndvi array, init to nodata value
-                ndvi_array = numpy.full_like(red_array, fill_value=ndvi_nodata, dtype=numpy.float32)
-                ## cast bands to float for calc
-                red_asfloat = numpy.array(red_array, dtype=numpy.float32)
-                red_array = None
-                nir_asfloat = numpy.array(nir_array, dtype=numpy.float32)
-                nir_array = None
-
-                ## calculate ndvi
-                if ndvi_array[~ndvi_mask].size > 0:
-                    ndvi_array[~ndvi_mask] = numpy.divide(numpy.subtract(nir_asfloat[~ndvi_mask],
-                                                                         red_asfloat[~ndvi_mask]),
-                                                          numpy.add(nir_asfloat[~ndvi_mask],
-                                                                    red_asfloat[~ndvi_mask]))
-                red_asfloat = None
-                nir_asfloat = None
-
-                ## scale and cast to int if outtype integer
-                if args.outtype == 'Int16':
-                    ndvi_scaled = numpy.full_like(ndvi_array, fill_value=ndvi_nodata, dtype=numpy.int16)
-                    if ndvi_scaled[~ndvi_mask].size > 0:
-                        ndvi_scaled[~ndvi_mask] = numpy.array(ndvi_array[~ndvi_mask]*1000.0, dtype=numpy.int16)
-                    ndvi_array = ndvi_scaled
-                    ndvi_scaled = None
-
-                ndvi_mask = None
-               
-                ## write valid portion of ndvi array to output file
-                ndvi_band.WriteArray(ndvi_array, xoff, yoff)
-                ndvi_array = None
-
-        out_ds = None
-        ds = None
-        
-        if os.path.isfile(dstfp_local):
-            ## add pyramids
-            cmd = 'gdaladdo "{}" 2 4 8 16'.format(dstfp_local)
+    for dstfp_local, fp in zip(dstfps_local, dstfps):
+        ## add pyramids
+        cmd = 'gdaladdo "{}" 2 4 8 16'.format(dstfp_local)
+        with timer.stage('pyramids'):
             taskhandler.exec_cmd(cmd)
 
-            ## copy to dst
-            if wd != dstdir:
-                shutil.copy2(dstfp_local, dstfp)
+        ## copy to dst
+        if wd != dstdir:
+            with timer.stage('copy_to_dst'):
+                shutil.copy2(dstfp_local, fp)
 
-            ## copy xml to dst
-            if os.path.isfile(src_xml):
-                shutil.copy2(src_xml, dst_xml)
-            else:
-                logger.warning("xml %s not found", src_xml)
-        
-            ## Delete Temp Files
-            temp_files = [srcfp_local]
-            wd_files = [dstfp_local]
-            if not args.save_temps:
-                clean_up(temp_files)
-            if wd != dstdir:
-                clean_up(wd_files)
+        ## copy xml to dst
+        if os.path.isfile(src_xml):
+            shutil.copy2(src_xml, os.path.splitext(fp)[0] + '.xml')
         else:
-            logger.error("pgc_ndvi.py: %s was not created", dstfp_local)
-            return 1 
-            
-    else:
-        logger.info("pgc_ndvi.py: file %s already exists", dstfp)
-        
-        ## copy xml to dst if missing
-        if not os.path.isfile(dst_xml):
-            shutil.copy2(src_xml, dst_xml)
-            
+            logger.warning("xml %s not found", src_xml)
+
+    ## Delete Temp Files
+    temp_files = [srcfp_local]
+    wd_files = dstfps_local
+    if not args.save_temps:
+        clean_up(temp_files)
+    if wd != dstdir:
+        clean_up(wd_files)
+
     return 0
 
+
+def calc_strip(kernels, arrays):
+    """Calculate each index for a strip, masking nodata.  Results are views of the kernels' buffers."""
+    return [kernel.compute_block(arrays) for kernel in kernels]
+
+
 def clean_up(filelist):
     for f in filelist:
         try:
@@ -10,7 +10,7 @@ import datetime
 
 import numpy as np
 
-from lib import ortho_functions, taskhandler, utils
+from lib import autotune, journal, ortho_functions, runtime_model, staging, taskhandler, utils
 from lib.taskhandler import argval2str
 
 #### Create Loggers
@@ -40,13 +40,36 @@ def main():
                              "To use the current working directory, use 'working_dir'")
     parser.add_argument("--slurm-job-name", default=None,
                         help="assign a name to the slurm job for easier job tracking")
+    parser.add_argument("--array-job", action='store_true', default=False,
+                        help="submit the tasks as job arrays (sbatch --array or qsub -J) reading the task commands "
+                             "from a manifest file, instead of one job per task (requires --pbs or --slurm option)")
+    parser.add_argument("--array-limit", type=int,
+                        help="maximum number of array tasks running at the same time (with --array-job)")
     parser.add_argument("--tasks-per-job", type=int,
                         help="Number of tasks to bundle into a single job. (requires --pbs or --slurm option) (Warning:"
                              " a higher number of tasks per job may require modification of default wallclock limit.)")
+    parser.add_argument("--bundle-walltime", type=float,
+                        help="bundle tasks by predicted runtime into jobs of at most this many hours, and request "
+                             "each job's predicted time as its walltime (requires --pbs or --slurm option, "
+                             "--tasks-per-job limits the number of tasks per job)")
+    parser.add_argument("--runtime-model",
+                        help="runtime model for --bundle-walltime: a JSON model file, or a directory of processing "
+                             "logs from previous runs to calibrate from (default: built-in estimates)")
     parser.add_argument('--scratch', default=ARGDEF_SCRATCH,
-                        help="Scratch space to build task bundle text files. (default={})".format(ARGDEF_SCRATCH))
+                        help="Scratch space to build task bundle and job array manifest text files. "
+                             "(default={})".format(ARGDEF_SCRATCH))
     parser.add_argument("--parallel-processes", type=int, default=1,
                         help="number of parallel processes to spawn (default 1)")
+    parser.add_argument("--in-process", action='store_true', default=False,
+                        help="with --parallel-processes, fork the worker processes once and run each image in them "
+                             "directly instead of starting a new python process per image")
+    parser.add_argument("--async-upload", action='store_true', default=False,
+                        help="with --wd, copy each finished image to the destination directory in the background "
+                             "while the next image is processed (not supported with --in-process)")
+    parser.add_argument("--auto-parallel", action='store_true', default=False,
+                        help="choose the number of parallel processes and threads per process by running a sample of "
+                             "the images with several combinations and using the one with the highest throughput "
+                             "(overrides --parallel-processes and --threads)")
     parser.add_argument("--qsubscript",
                         help="submission script to use in PBS/SLURM submission (PBS default is qsub_ortho.sh, SLURM "
                              "default is slurm_ortho.py, in script root folder)")
@@ -72,6 +95,14 @@ def main():
     dstdir = os.path.abspath(args.dst)
     args.scratch = os.path.abspath(args.scratch)
     args.dst = dstdir
+    if args.metadata_cache is not None:
+        args.metadata_cache = os.path.abspath(args.metadata_cache)
+    if args.warp_cache is not None:
+        if args.warp_cache_size <= 0:
+            parser.error("--warp-cache-size must be a positive number of GB")
+        args.warp_cache = os.path.abspath(args.warp_cache)
+        if not os.path.isdir(args.warp_cache):
+            os.makedirs(args.warp_cache)
 
     #### Validate Required Arguments
     if os.path.isdir(src):
@@ -129,20 +160,34 @@ def main():
         parser.error("Options --pbs and --slurm are mutually exclusive")
     if (args.pbs or args.slurm) and args.parallel_processes > 1:
         parser.error("HPC Options (--pbs or --slurm) and --parallel-processes > 1 are mutually exclusive")
+    if (args.pbs or args.slurm) and args.auto_parallel:
+        parser.error("HPC Options (--pbs or --slurm) and --auto-parallel are mutually exclusive")
+    if args.async_upload and not args.wd:
+        parser.error("--async-upload option requires the --wd option")
+    if args.async_upload and args.in_process:
+        parser.error("Options --async-upload and --in-process are mutually exclusive")
+    if args.array_job and not (args.pbs or args.slurm):
+        parser.error("--array-job option requires the (--pbs or --slurm) option")
+    if args.array_limit is not None and args.array_limit < 1:
+        parser.error("--array-limit must be a positive integer")
     if (args.pbs or args.slurm) and requested_threads > 1:
         parser.error("HPC Options (--pbs or --slurm) and --threads > 1 are mutually exclusive")
     if requested_threads < 1:
         parser.error("--threads count must be positive, nonzero integer or ALL_CPUS")
-    if args.parallel_processes > 1:
+    if args.parallel_processes > 1 and not args.auto_parallel:
         total_proc_count = requested_threads * args.parallel_processes
         if total_proc_count > ortho_functions.ARGDEF_CPUS_AVAIL:
             parser.error("the (threads * number of processes requested) ({0}) exceeds number of available threads "
                          "({1}); reduce --threads and/or --parallel-processes count"
                          .format(total_proc_count, ortho_functions.ARGDEF_CPUS_AVAIL))
 
-    if args.tasks_per_job:
-        if not (args.pbs or args.slurm):
+    if args.tasks_per_job or args.array_job or args.bundle_walltime:
+        if args.tasks_per_job and not (args.pbs or args.slurm):
             parser.error("--tasks-per-job option requires the (--pbs or --slurm) option")
+        if args.bundle_walltime is not None and not (args.pbs or args.slurm):
+            parser.error("--bundle-walltime option requires the (--pbs or --slurm) option")
+        if args.bundle_walltime is not None and args.bundle_walltime <= 0:
+            parser.error("--bundle-walltime must be a positive number of hours")
         if not os.path.isdir(args.scratch):
             print("Creating --scratch directory: {}".format(args.scratch))
             os.makedirs(args.scratch)
@@ -221,7 +266,9 @@ def main():
         args.threads = 'ALL_CPUS'
 
     #### Get args ready to pass to task handler
-    arg_keys_to_remove = ('l', 'queue', 'qsubscript', 'dryrun', 'pbs', 'slurm', 'parallel_processes', 'tasks_per_job')
+    arg_keys_to_remove = ('l', 'queue', 'qsubscript', 'dryrun', 'pbs', 'slurm', 'parallel_processes', 'in_process',
+                          'auto_parallel', 'tasks_per_job', 'array_job', 'array_limit',
+                          'bundle_walltime', 'runtime_model')
 
     ## Identify source images
     csv_arg_data = None
@@ -330,8 +377,10 @@ def main():
         image_list = csv_arg_data
 
     ## Build task queue
+    ## The output path only depends on the filename and arguments unless the EPSG code or stretch are chosen
+    ## per image, so the full ImageInfo (metadata and raster footprint) is deferred to the task if possible
     images_to_process = []
-    image_info_dict = {}
+    image_dstfp_dict = {}
     for task_args in utils.yield_task_args(image_list, args,
                                            argname_1D='src',
                                            argname_2D_list=csv_header_argname_list):
@@ -339,23 +388,26 @@ def main():
         dstdir = task_args.dst
         lso.setLevel(logging.WARNING)  # temporarily reduce logging level to limit excess terminal text
         try:
-            info = ortho_functions.ImageInfo(srcfp, dstdir, args.wd, args)
+            dstfp = ortho_functions.get_planned_dstfp(srcfp, dstdir, args)
+            if dstfp is None:
+                dstfp = ortho_functions.ImageInfo(srcfp, dstdir, args.wd, args).dstfp
         except Exception as e:
             logger.error(e)
         else:
             lso.setLevel(lso_log_level)
-            dstfp = info.dstfp
-            vrtfile1 = os.path.splitext(dstfp)[0] + "_raw.vrt"
-            vrtfile2 = os.path.splitext(dstfp)[0] + "_vrt.vrt"
-
-            # Check to see if raw.vrt or vrt.vrt are present
-            vrt_exists = os.path.isfile(vrtfile1) or os.path.isfile(vrtfile2)
-            tif_done = os.path.isfile(dstfp)
-            # If no tif file present, need to make one
-            # If tif file is present but one of the vrt files is present, need to rebuild
-            if (not tif_done) or vrt_exists:
+            jrnl = journal.Journal(dstfp)
+            if jrnl.exists():
+                # The output is done only if its journal records it as done and it is unchanged since
+                tif_done = jrnl.is_complete(journal.STAGE_DONE)
+            else:
+                # Outputs written before journals were kept: if raw.vrt or vrt.vrt are present, need to rebuild
+                vrtfile1 = os.path.splitext(dstfp)[0] + "_raw.vrt"
+                vrtfile2 = os.path.splitext(dstfp)[0] + "_vrt.vrt"
+                vrt_exists = os.path.isfile(vrtfile1) or os.path.isfile(vrtfile2)
+                tif_done = os.path.isfile(dstfp) and not vrt_exists
+            if not tif_done:
                 images_to_process.append(srcfp)
-                image_info_dict[srcfp] = info
+                image_dstfp_dict[srcfp] = dstfp
 
     logger.info("Number of incomplete tasks: %i", len(images_to_process))
     if len(images_to_process) == 0:
@@ -373,11 +425,25 @@ def main():
         # Use the CSV argument array in place of the standard image list
         images_to_process = csv_arg_data
 
-    ## Bundle tasks into sets by the number of tasks-per-job
-    if args.tasks_per_job and args.tasks_per_job > 1:
+    ## Select the DEM of each image for --dem auto, passed to the tasks as a 'dem' column of task arguments
+    images_to_process, csv_header_argname_list = ortho_functions.plan_auto_dems(
+        images_to_process, args, csv_header_argname_list
+    )
+
+    ## Bundle tasks into sets by predicted runtime or by the number of tasks-per-job
+    bundle_walltimes = {}
+    bundle_ext = 'csv' if csv_header_argname_list is not None else 'txt'
+    if args.bundle_walltime:
+        bundles = runtime_model.plan_bundles(images_to_process, args, csv_header_argname_list)
+        task_srcfp_list = utils.write_task_bundle_list(
+            [bundle for bundle, walltime in bundles], args.scratch, 'Or_src',
+            header_list=csv_header_argname_list, bundle_ext=bundle_ext
+        )
+        bundle_walltimes = dict(zip(task_srcfp_list, [walltime for bundle, walltime in bundles]))
+    elif args.tasks_per_job and args.tasks_per_job > 1:
         task_srcfp_list = utils.write_task_bundles(
             images_to_process, args.tasks_per_job, args.scratch, 'Or_src',
-            header_list=csv_header_argname_list, bundle_ext=('csv' if srctype == 'csvfile' else 'txt')
+            header_list=csv_header_argname_list, bundle_ext=bundle_ext
         )
     else:
         task_srcfp_list = images_to_process
@@ -393,12 +459,13 @@ def main():
         dstdir = task_args.dst
         srcdir, srcfn = os.path.split(srcfp)
 
-        ## If task_srcfp_list = images_to_process, then the image_info_dict is also populated
+        ## If task_srcfp_list = images_to_process, then the image_dstfp_dict is also populated
         if task_srcfp_list is images_to_process:
-            info = image_info_dict[srcfp]
-            dstfp = info.dstfp
+            dstfp = image_dstfp_dict[srcfp]
+            task_cost = taskhandler.get_task_cost(srcfp)
         else:  # this case occurs when there is a textfile or csv to resubmit so dstfp is not needed
             dstfp = None
+            task_cost = None
 
         # add a custom name to the job
         if not args.slurm_job_name:
@@ -417,7 +484,10 @@ def main():
                 argval2str(dstdir)
             ),
             ortho_functions.process_image,
-            [srcfp, dstfp, task_args]
+            [srcfp, dstfp, task_args],
+            task_cost=task_cost,
+            task_logfile=os.path.splitext(dstfp)[0] + ".log" if dstfp else None,
+            task_walltime=bundle_walltimes.get(srcfp)
         )
         task_queue.append(task)
 
@@ -431,7 +501,12 @@ def main():
             if args.queue:
                 qsub_args += " -q {}".format(args.queue)
             try:
-                task_handler = taskhandler.PBSTaskHandler(qsubpath, qsub_args)
+                task_handler = taskhandler.PBSTaskHandler(
+                    qsubpath, qsub_args,
+                    array_dir=args.scratch if args.array_job else None,
+                    array_limit=args.array_limit,
+                    array_job_name=args.slurm_job_name or 'Or'
+                )
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
@@ -446,12 +521,18 @@ def main():
                 qsub_args += '-e {}/%x.o%j '.format(slurm_log_dir)
             # adjust wallclock if submitting multiple tasks ro be run in serial for a single slurm job
             # default wallclock for ortho jobs is 1:00:00, refer to slurm_ortho.sh to verify
-            if args.tasks_per_job:
+            # with --bundle-walltime, each job requests the predicted time of its bundle instead
+            if args.tasks_per_job and not args.bundle_walltime:
                 qsub_args += '-t {}:00:00 '.format(args.tasks_per_job)
             if args.queue:
                 qsub_args += "-p {} ".format(args.queue)
             try:
-                task_handler = taskhandler.SLURMTaskHandler(qsubpath, qsub_args)
+                task_handler = taskhandler.SLURMTaskHandler(
+                    qsubpath, qsub_args,
+                    array_dir=args.scratch if args.array_job else None,
+                    array_limit=args.array_limit,
+                    array_job_name=args.slurm_job_name or 'Or'
+                )
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
@@ -459,16 +540,24 @@ def main():
                 if not args.dryrun:
                     task_handler.run_tasks(task_queue)
 
+        elif args.auto_parallel:
+            if not args.dryrun:
+                results = autotune.run_auto_parallel(task_queue, args.in_process)
+                if any([v != 0 for v in results.values()]):
+                    ret_code = 1
+
         elif args.parallel_processes > 1:
             try:
-                task_handler = taskhandler.ParallelTaskHandler(args.parallel_processes)
+                task_handler = taskhandler.ParallelTaskHandler(args.parallel_processes, args.in_process)
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
             else:
                 logger.info("Number of child processes to spawn: %i", task_handler.num_processes)
                 if not args.dryrun:
-                    task_handler.run_tasks(task_queue)
+                    results = task_handler.run_tasks(task_queue)
+                    if any([v != 0 for v in results.values()]):
+                        ret_code = 1
 
         else:
 
@@ -491,6 +580,11 @@ def main():
                 #### remove existing file handler
                 logger.removeHandler(lfh)
 
+            #### Wait for background uploads to the destination directory
+            for fp in staging.wait_for_uploads():
+                logger.warning("Failed upload: %s", fp)
+                ret_code = 1
+
             #### Print Images with Errors
             for k, v in results.items():
                 if v != 0:
@@ -17,7 +17,7 @@ import datetime
 
 from osgeo import gdal, gdalconst, ogr, osr
 
-from lib import ortho_functions, taskhandler, utils
+from lib import autotune, ortho_functions, perf, staging, taskhandler, utils
 from lib.taskhandler import argval2str
 
 #### Create Loggers
@@ -166,6 +166,7 @@ class ImagePair(object):
 
 
 def main():
+    ret_code = 0
 
     #### Set Up Arguments
     parent_parser, pos_arg_keys = ortho_functions.build_parent_argument_parser()
@@ -190,13 +191,26 @@ def main():
                              "To use the current working directory, use 'working_dir'")
     parser.add_argument("--slurm-job-name", default=None,
                         help="assign a name to the slurm job for easier job tracking")
+    parser.add_argument("--array-job", action='store_true', default=False,
+                        help="submit the tasks as job arrays (sbatch --array or qsub -J) reading the task commands "
+                             "from a manifest file, instead of one job per task (requires --pbs or --slurm option)")
+    parser.add_argument("--array-limit", type=int,
+                        help="maximum number of array tasks running at the same time (with --array-job)")
     parser.add_argument("--tasks-per-job", type=int,
                         help="Number of tasks to bundle into a single job. (requires --pbs or --slurm option) (Warning:"
                              " a higher number of tasks per job may require modification of default wallclock limit.)")
     parser.add_argument('--scratch', default=ARGDEF_SCRATCH,
-                        help="Scratch space to build task bundle text files. (default={})".format(ARGDEF_SCRATCH))
+                        help="Scratch space to build task bundle and job array manifest text files. "
+                             "(default={})".format(ARGDEF_SCRATCH))
     parser.add_argument("--parallel-processes", type=int, default=1,
                         help="number of parallel processes to spawn (default 1)")
+    parser.add_argument("--in-process", action='store_true', default=False,
+                        help="with --parallel-processes, fork the worker processes once and run each image in them "
+                             "directly instead of starting a new python process per image")
+    parser.add_argument("--auto-parallel", action='store_true', default=False,
+                        help="choose the number of parallel processes and threads per process by running a sample of "
+                             "the images with several combinations and using the one with the highest throughput "
+                             "(overrides --parallel-processes and --threads)")
     parser.add_argument("--qsubscript",
                         help="submission script to use in PBS/SLURM submission (PBS default is qsub_pansharpen.sh, "
                              "SLURM default is slurm_pansharpen.py, in script root folder)")
@@ -219,6 +233,14 @@ def main():
     src = os.path.abspath(args.src)
     dstdir = os.path.abspath(args.dst)
     scratch = os.path.abspath(args.scratch)
+    if args.metadata_cache is not None:
+        args.metadata_cache = os.path.abspath(args.metadata_cache)
+    if args.warp_cache is not None:
+        if args.warp_cache_size <= 0:
+            parser.error("--warp-cache-size must be a positive number of GB")
+        args.warp_cache = os.path.abspath(args.warp_cache)
+        if not os.path.isdir(args.warp_cache):
+            os.makedirs(args.warp_cache)
     bittype = utils.get_bit_depth(args.outtype)
 
     #### Validate Required Arguments
@@ -274,19 +296,25 @@ def main():
         parser.error("Options --pbs and --slurm are mutually exclusive")
     if (args.pbs or args.slurm) and args.parallel_processes > 1:
         parser.error("HPC Options (--pbs or --slurm) and --parallel-processes > 1 are mutually exclusive")
+    if (args.pbs or args.slurm) and args.auto_parallel:
+        parser.error("HPC Options (--pbs or --slurm) and --auto-parallel are mutually exclusive")
+    if args.array_job and not (args.pbs or args.slurm):
+        parser.error("--array-job option requires the (--pbs or --slurm) option")
+    if args.array_limit is not None and args.array_limit < 1:
+        parser.error("--array-limit must be a positive integer")
     if (args.pbs or args.slurm) and requested_threads > 1:
         parser.error("HPC Options (--pbs or --slurm) and --threads > 1 are mutually exclusive")
     if requested_threads < 1:
         parser.error("--threads count must be positive, nonzero integer or ALL_CPUS")
-    if args.parallel_processes > 1:
+    if args.parallel_processes > 1 and not args.auto_parallel:
         total_proc_count = requested_threads * args.parallel_processes
         if total_proc_count > ortho_functions.ARGDEF_CPUS_AVAIL:
             parser.error("the (threads * number of processes requested) ({0}) exceeds number of available threads "
                          "({1}); reduce --threads and/or --parallel-processes count"
                          .format(total_proc_count, ortho_functions.ARGDEF_CPUS_AVAIL))
 
-    if args.tasks_per_job:
-        if not (args.pbs or args.slurm):
+    if args.tasks_per_job or args.array_job:
+        if args.tasks_per_job and not (args.pbs or args.slurm):
             parser.error("--tasks-per-job option requires the (--pbs or --slurm) option")
         if not os.path.isdir(args.scratch):
             print("Creating --scratch directory: {}".format(args.scratch))
@@ -368,7 +396,8 @@ def main():
         logger.info("Slurm output and error log saved here: {}".format(slurm_log_dir))
 
     #### Get args ready to pass to task handler
-    arg_keys_to_remove = ('l', 'queue', 'qsubscript', 'dryrun', 'pbs', 'slurm', 'parallel_processes', 'tasks_per_job')
+    arg_keys_to_remove = ('l', 'queue', 'qsubscript', 'dryrun', 'pbs', 'slurm', 'parallel_processes', 'in_process',
+                          'auto_parallel', 'tasks_per_job', 'array_job', 'array_limit')
     arg_str_base = taskhandler.convert_optional_args_to_string(args, pos_arg_keys, arg_keys_to_remove)
     
     ## Identify source images
@@ -518,7 +547,10 @@ def main():
                 argval2str(dstdir)
             ),
             exec_pansharpen,
-            [image_pair, pansh_dstfp, args, orig_res]
+            [image_pair, pansh_dstfp, args, orig_res],
+            task_cost=(taskhandler.get_task_cost(image_pair.mul_srcfp, image_pair.pan_srcfp)
+                       if image_pair is not None else None),
+            task_logfile=os.path.splitext(pansh_dstfp)[0] + ".log" if pansh_dstfp else None
         )
         task_queue.append(task)
 
@@ -532,7 +564,12 @@ def main():
             if args.queue:
                 qsub_args += " -q {}".format(args.queue)
             try:
-                task_handler = taskhandler.PBSTaskHandler(qsubpath, qsub_args)
+                task_handler = taskhandler.PBSTaskHandler(
+                    qsubpath, qsub_args,
+                    array_dir=scratch if args.array_job else None,
+                    array_limit=args.array_limit,
+                    array_job_name=args.slurm_job_name or 'Psh'
+                )
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
@@ -552,7 +589,12 @@ def main():
             if args.queue:
                 qsub_args += "-p {} ".format(args.queue)
             try:
-                task_handler = taskhandler.SLURMTaskHandler(qsubpath, qsub_args)
+                task_handler = taskhandler.SLURMTaskHandler(
+                    qsubpath, qsub_args,
+                    array_dir=scratch if args.array_job else None,
+                    array_limit=args.array_limit,
+                    array_job_name=args.slurm_job_name or 'Psh'
+                )
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
@@ -560,16 +602,24 @@ def main():
                 if not args.dryrun:
                     task_handler.run_tasks(task_queue)
             
+        elif args.auto_parallel:
+            if not args.dryrun:
+                results = autotune.run_auto_parallel(task_queue, args.in_process)
+                if any([v != 0 for v in results.values()]):
+                    ret_code = 1
+
         elif args.parallel_processes > 1:
             try:
-                task_handler = taskhandler.ParallelTaskHandler(args.parallel_processes)
+                task_handler = taskhandler.ParallelTaskHandler(args.parallel_processes, args.in_process)
             except RuntimeError as e:
                 logger.error(utils.capture_error_trace())
                 logger.error(e)
             else:
                 logger.info("Number of child processes to spawn: %i", task_handler.num_processes)
                 if not args.dryrun:
-                    task_handler.run_tasks(task_queue)
+                    results = task_handler.run_tasks(task_queue)
+                    if any([v != 0 for v in results.values()]):
+                        ret_code = 1
     
         else:
             results = {}
@@ -599,14 +649,35 @@ def main():
             for k, v in results.items():
                 if v != 0:
                     logger.warning("Failed Image: %s", k)
+                    ret_code = 1
         
         logger.info("Done")
         
     else:
         logger.info("No images found to process")
 
+    sys.exit(ret_code)
+
+
+def copy_to_wd(srcfp, dstfp, args):
+    """Copy an orthorectified image to the working directory, in verified chunks with --staged-read"""
+    if getattr(args, 'staged_read', False):
+        staging.copy_file(srcfp, dstfp)
+    else:
+        shutil.copy2(srcfp, dstfp)
+
 
 def exec_pansharpen(image_pair, pansh_dstfp, args, orig_res):
+    timer = perf.StageTimer(task='pansharpen', image=image_pair.mul_srcfn, sensor=image_pair.sensor)
+    rc = 1
+    try:
+        rc = _exec_pansharpen(image_pair, pansh_dstfp, args, orig_res, timer)
+    finally:
+        timer.log_record(rc=rc)
+    return rc
+
+
+def _exec_pansharpen(image_pair, pansh_dstfp, args, orig_res, timer):
     dstdir = os.path.dirname(pansh_dstfp)
 
     #### Get working dir
@@ -660,10 +731,12 @@ def exec_pansharpen(image_pair, pansh_dstfp, args, orig_res):
     ####  Ortho pan
     logger.info("Orthorectifying panchromatic image")
     if not os.path.isfile(pan_dstfp) and not os.path.isfile(pan_local_dstfp):
-        ortho_functions.process_image(image_pair.pan_srcfp, pan_dstfp, args, image_pair.intersection_geom)
+        with timer.stage('ortho_pan'):
+            ortho_functions.process_image(image_pair.pan_srcfp, pan_dstfp, args, image_pair.intersection_geom)
 
     if not os.path.isfile(pan_local_dstfp) and os.path.isfile(pan_dstfp):
-        shutil.copy2(pan_dstfp, pan_local_dstfp)
+        with timer.stage('copy_to_wd'):
+            copy_to_wd(pan_dstfp, pan_local_dstfp, args)
 
     logger.info("Orthorectifying multispectral image")
     ####  Ortho multi
@@ -673,14 +746,16 @@ def exec_pansharpen(image_pair, pansh_dstfp, args, orig_res):
         ##    Use the orig_res variable so that multiple passes over the args.resolution does not blow up recursively
         if args.resolution and orig_res is not None:
             args.resolution = [res * 4.0 for res in orig_res]
-        ortho_functions.process_image(image_pair.mul_srcfp, mul_dstfp, args, image_pair.intersection_geom)
+        with timer.stage('ortho_mul'):
+            ortho_functions.process_image(image_pair.mul_srcfp, mul_dstfp, args, image_pair.intersection_geom)
         # Reset resolution to CLI input
         args.resolution = orig_res
         logger.info("Resetting args.resolution: {}".format(args.resolution))
         logger.info("orig_res: {}".format(orig_res))
 
     if not os.path.isfile(mul_local_dstfp) and os.path.isfile(mul_dstfp):
-        shutil.copy2(mul_dstfp, mul_local_dstfp)
+        with timer.stage('copy_to_wd'):
+            copy_to_wd(mul_dstfp, mul_local_dstfp, args)
 
     ####  Pansharpen
     ## get system info for program extension
@@ -722,10 +797,12 @@ def exec_pansharpen(image_pair, pansh_dstfp, args, orig_res):
     weight_args = ''
     if not args.skip_custom_weights:
         # add specific pansharpening weights for WV02 and WV03 images - get band count of input mul from image info
-        iinfo = ortho_functions.ImageInfo(mul_dstfp, dstdir, wd, args)
-        _err = iinfo.get_image_stats(args)
+        with timer.stage('weights'):
+            iinfo = ortho_functions.ImageInfo(mul_dstfp, dstdir, wd, args)
+            _err = iinfo.get_image_stats(args)
         if _err != 0:
             raise RuntimeError(f"Error in stats calculation")
+        timer.fields['bands'] = iinfo.bands
 
         if "WV02" in iinfo.sat or "WV03" in iinfo.sat:
             red_wt = ortho_functions.WV03_BAND_WEIGHT_DICT['RED']
@@ -758,7 +835,8 @@ def exec_pansharpen(image_pair, pansh_dstfp, args, orig_res):
                        pan_local_dstfp, mul_local_dstfp, pansh_local_dstfp)
             logger.info(cmd)
             try:
-                taskhandler.exec_cmd(cmd)
+                with timer.stage('pansharpen'):
+                    taskhandler.exec_cmd(cmd)
             except Exception as e:
                 logger.warning("There was an error running gdal_pansharpen.py: {}".format(e))
                 logger.warning("Please run this script in the recommended mamba/conda environment with GDAL => 3.7.2")
@@ -770,17 +848,19 @@ def exec_pansharpen(image_pair, pansh_dstfp, args, orig_res):
     #### Make pyramids
     if (not args.no_pyramids) and os.path.isfile(pansh_local_dstfp):
         cmd = 'gdaladdo -r {} "{}" 2 4 8 16'.format(args.pyramid_type, pansh_local_dstfp)
-        taskhandler.exec_cmd(cmd)
+        with timer.stage('pyramids'):
+            taskhandler.exec_cmd(cmd)
        
     ## Copy warped multispectral xml to pansharpened output
     shutil.copy2(mul_xmlfp, pansh_xmlfp)
 
     #### Copy pansharpened output
     if wd != dstdir:
-        for local_path, dst_path in [(pansh_local_dstfp, pansh_dstfp), (pan_local_dstfp, pan_dstfp),
-                                     (mul_local_dstfp, mul_dstfp)]:
-            if os.path.isfile(local_path) and not os.path.isfile(dst_path):
-                shutil.copy2(local_path, dst_path)
+        with timer.stage('copy_to_dst'):
+            for local_path, dst_path in [(pansh_local_dstfp, pansh_dstfp), (pan_local_dstfp, pan_dstfp),
+                                         (mul_local_dstfp, mul_dstfp)]:
+                if os.path.isfile(local_path) and not os.path.isfile(dst_path):
+                    shutil.copy2(local_path, dst_path)
 
     #### Delete Temp Files
     wd_files = [
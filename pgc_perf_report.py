@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""
+Report where processing time goes, from the stage timing records that pgc_ortho, pgc_pansharpen and pgc_ndvi
+write to their logs.
+"""
+
+import argparse
+import os
+import sys
+
+from lib import perf_report
+from lib import VERSION
+
+
+def main():
+
+    #### Set Up Arguments
+    parser = argparse.ArgumentParser(
+        description="Summarize per-stage processing times from the logs of pgc_ortho, pgc_pansharpen and pgc_ndvi"
+    )
+
+    parser.add_argument("logs", nargs='+',
+                        help="log files, or directories searched recursively for log files")
+    parser.add_argument("-p", "--log-pattern", action='append',
+                        help="file name pattern of log files in the directories, can be given more than once "
+                             "(default={})".format(' '.join(perf_report.ARGDEF_LOG_PATTERNS)))
+    parser.add_argument("--task", choices=['ortho', 'pansharpen', 'ndvi'],
+                        help="only report this kind of task (default: all)")
+    parser.add_argument("--slowest", type=int, default=perf_report.ARGDEF_SLOWEST,
+                        help="number of slowest images to list (default={})".format(perf_report.ARGDEF_SLOWEST))
+    parser.add_argument("--run-by", choices=perf_report.RUN_KEYS, default='day',
+                        help="group images into runs by the day they started or by the directory of their "
+                             "log (default=day)")
+    parser.add_argument('--version', action='version', version="imagery_utils v{}".format(VERSION))
+
+    #### Parse Arguments
+    args = parser.parse_args()
+
+    for path in args.logs:
+        if not os.path.exists(path):
+            parser.error("Log path does not exist: {}".format(path))
+
+    records = perf_report.read_records(perf_report.iter_log_files(args.logs, args.log_pattern))
+    if args.task:
+        records = [r for r in records if r.get('task') == args.task]
+    if len(records) == 0:
+        print("No stage timing records found")
+        sys.exit(1)
+
+    print(perf_report.PerfReport(records, args.slowest, args.run_by).format())
+
+
+if __name__ == '__main__':
+    main()
@@ -38,5 +38,10 @@ cd $PBS_O_WORKDIR
 
 source ~/.bashrc; conda activate pgc
 
+# job arrays: run the line of the task manifest given by the array index
+if [ -n "$manifest" ]; then
+    p1=$(sed -n "${PBS_ARRAY_INDEX}p" "$manifest")
+fi
+
 echo $p1
 time eval $p1
@@ -52,5 +52,10 @@ cd $SLURM_SUBMIT_DIR
 # init gdal tools
 source ~/.bashrc; conda activate pgc
 
+# job arrays: run the line of the task manifest given by the array index
+if [ -n "$manifest" ]; then
+    p1=$(sed -n "${SLURM_ARRAY_TASK_ID}p" "$manifest")
+fi
+
 echo $p1
 time eval $p1
@@ -0,0 +1,83 @@
+import unittest, os, sys, argparse
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import autotune, taskhandler
+
+
+class TestAutotune(unittest.TestCase):
+
+    def setUp(self):
+        self.statfile = os.path.join(__test_dir__, 'tmp_proc_stat')
+
+    def test_candidate_configs(self):
+        configs = autotune.get_candidate_configs(16)
+        self.assertEqual([(c.processes, c.threads) for c in configs], [(16, 1), (8, 2), (4, 4), (2, 8)])
+        configs = autotune.get_candidate_configs(6, task_count=4)
+        self.assertEqual([(c.processes, c.threads) for c in configs], [(3, 2), (1, 6)])
+        configs = autotune.get_candidate_configs(1)
+        self.assertEqual([(c.processes, c.threads) for c in configs], [(1, 1)])
+
+    def test_cpu_usage(self):
+        with open(self.statfile, 'w') as f:
+            f.write('cpu  100 0 100 700 100 0 0 0 0 0\ncpu0 50 0 50 350 50 0 0 0 0 0\n')
+        start = autotune.read_cpu_times(self.statfile)
+        self.assertEqual(start, (1000, 700, 100))
+        utilization, iowait = autotune.get_cpu_usage(start, (2000, 1200, 400))
+        self.assertAlmostEqual(utilization, 0.2)
+        self.assertAlmostEqual(iowait, 0.3)
+        self.assertIsNone(autotune.read_cpu_times(os.path.join(__test_dir__, 'missing_stat')))
+        self.assertEqual(autotune.get_cpu_usage(None, start), (None, None))
+
+    def test_set_task_threads(self):
+        args = argparse.Namespace(threads=1)
+        task = taskhandler.Task('img', 't1', 'python', 'pgc_ortho.py --threads "ALL_CPUS" --epsg 3031 src dst',
+                                return_threads, [args])
+        autotune.set_task_threads(task, 4)
+        self.assertEqual(task.cmd, 'pgc_ortho.py --threads 4 --epsg 3031 src dst')
+        self.assertEqual(args.threads, 4)
+
+    def test_select_samples(self):
+        tasks = [taskhandler.Task('t{}'.format(i), 't', 'python', '', task_cost=i) for i in range(20)]
+        configs = autotune.get_candidate_configs(4)
+        samples, remaining = autotune.select_samples(tasks, configs)
+        self.assertEqual([len(s) for s in samples], [4, 2, 1])
+        ## samples are spread over the range of costs
+        self.assertEqual([t.cost for t in samples[0]], [19, 11, 5, 2])
+        self.assertEqual([t.cost for t in samples[1]], [17, 8])
+        self.assertEqual([t.cost for t in samples[2]], [14])
+        self.assertEqual(len(remaining), 13)
+        self.assertEqual(sorted([t.name for t in remaining + sum(samples, [])]), sorted([t.name for t in tasks]))
+
+    def test_run_auto_parallel(self):
+        cpus = min(2, taskhandler.mp.cpu_count())
+        args = argparse.Namespace(threads=1)
+        tasks = [taskhandler.Task('t{}'.format(i), 't', 'python', '', return_threads, [args]) for i in range(8)]
+        results = autotune.run_auto_parallel(tasks, in_process=True, cpus=cpus)
+        self.assertEqual(sorted(results), sorted([t.name for t in tasks]))
+        self.assertTrue(all([1 <= rc <= cpus for rc in results.values()]))
+
+    def tearDown(self):
+        if os.path.isfile(self.statfile):
+            os.remove(self.statfile)
+
+
+def return_threads(args):
+    ## the thread count the task was run with, as its return code
+    return args.threads
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestAutotune,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -0,0 +1,105 @@
+import unittest, os, sys, shutil, random, time
+from osgeo import ogr, osr
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import dem_catalog, utils
+
+
+def write_gpkg(path, layers):
+    """Write a GeoPackage with a layer per (epsg, [(wkt, rank, dempath), ...])"""
+    driver = ogr.GetDriverByName('GPKG')
+    if os.path.isfile(path):
+        driver.DeleteDataSource(path)
+    ds = driver.CreateDataSource(path)
+    for i, (epsg, features) in enumerate(layers):
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        layer = ds.CreateLayer('dems_{}'.format(i), srs, ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn('rank', ogr.OFTInteger))
+        for field in ('dempath', 'windowspath'):
+            layer.CreateField(ogr.FieldDefn(field, ogr.OFTString))
+        for wkt, rank, dempath in features:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+            feature['rank'] = rank
+            feature['dempath'] = dempath
+            feature['windowspath'] = dempath
+            layer.CreateFeature(feature)
+    del ds
+
+
+def box(minx, miny, maxx, maxy):
+    return 'POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(minx, miny, maxx, maxy)
+
+
+class TestSTRtree(unittest.TestCase):
+
+    def test_query_matches_scan(self):
+        random.seed(0)
+        for n in (0, 1, 15, 500):
+            items = []
+            for i in range(n):
+                x, y = random.uniform(-180, 170), random.uniform(-90, 80)
+                items.append(((x, x + random.uniform(0, 30), y, y + random.uniform(0, 30)), i))
+            tree = dem_catalog.STRtree(items)
+            for q in range(100):
+                x, y = random.uniform(-180, 170), random.uniform(-90, 80)
+                envelope = (x, x + 2, y, y + 2)
+                expected = [v for e, v in items if dem_catalog.envelope_contains(e, envelope)]
+                self.assertEqual(sorted(tree.query_containing(envelope)), expected)
+
+
+class TestDemCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_dem_catalog')
+        if not os.path.isdir(self.dstdir):
+            os.makedirs(self.dstdir)
+        self.gpkg = os.path.join(self.dstdir, 'dems.gpkg')
+        self.srs = utils.SpatialRef(4326)
+        write_gpkg(self.gpkg, [
+            (4326, [(box(0, 0, 10, 10), 2, 'wide_a.tif'),
+                    (box(0, 0, 10, 10), 2, 'wide_b.tif'),
+                    (box(2, 2, 4, 4), 3, 'small.tif')]),
+            (3857, [(box(0, 0, 600000, 600000), 1, 'mercator.tif')]),
+        ])
+
+    def test_find_dem(self):
+        catalog = dem_catalog.DemCatalog(self.gpkg)
+        ## best rank across layers, after transforming the image into the layer's spatial reference
+        self.assertEqual(catalog.find_dem(box(1, 1, 2, 2), self.srs.srs), 'mercator.tif')
+        ## equal ranks go to the first feature
+        self.assertEqual(catalog.find_dem(box(6, 6, 7, 7), self.srs.srs), 'wide_a.tif')
+        ## overlapping but not contained
+        self.assertIsNone(catalog.find_dem(box(9, 9, 11, 11), self.srs.srs))
+
+    def test_catalog_reuse(self):
+        catalog = dem_catalog.get_catalog(self.gpkg)
+        self.assertIs(dem_catalog.get_catalog(self.gpkg), catalog)
+
+        ## a changed GeoPackage is reloaded
+        time.sleep(1)
+        write_gpkg(self.gpkg, [(4326, [(box(0, 0, 10, 10), 1, 'new.tif')])])
+        catalog = dem_catalog.get_catalog(self.gpkg)
+        self.assertEqual(catalog.find_dem(box(1, 1, 2, 2), self.srs.srs), 'new.tif')
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestSTRtree,
+        TestDemCatalog,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -0,0 +1,112 @@
+import unittest, os, sys, shutil
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import discovery
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = os.path.join(__test_dir__, 'tmp_discovery')
+        self.paths = []
+        for d in ('', 'a', os.path.join('a', 'b'), 'c'):
+            os.makedirs(os.path.join(self.srcdir, d), exist_ok=True)
+            for name in ('image.tif', 'IMAGE2.NTF', 'image.xml'):
+                fp = os.path.join(self.srcdir, d, name)
+                with open(fp, 'w') as f:
+                    f.write('x')
+                self.paths.append(fp.replace('\\', '/'))
+        ## directory symlinks are not followed
+        os.symlink(os.path.join(self.srcdir, 'a'), os.path.join(self.srcdir, 'link'))
+
+    def test_iter_tree(self):
+        expected = sorted([p for p in self.paths if not p.endswith('.xml')])
+        for threads in (1, 4):
+            found = sorted(discovery.iter_images(self.srcdir, False, ['.tif', '.ntf'], threads=threads))
+            self.assertEqual(found, expected)
+
+    def test_iter_filelist(self):
+        filelist = self.paths + [os.path.join(self.srcdir, 'missing.tif'), self.srcdir]
+        expected = [p for p in self.paths if p.endswith('.tif')]
+        for batch_size in (1, 2, 100):
+            found = list(discovery.iter_filelist(filelist, ['.tif'], threads=2, batch_size=batch_size))
+            ## list order is kept
+            self.assertEqual(found, expected)
+
+        textfile = os.path.join(self.srcdir, 'list.txt')
+        with open(textfile, 'w') as f:
+            f.write('\n'.join(filelist))
+        self.assertEqual(list(discovery.iter_images(textfile, True, ['.tif'])), expected)
+
+    def tearDown(self):
+        shutil.rmtree(self.srcdir)
+
+
+class TestExcludeMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = os.path.join(__test_dir__, 'tmp_discovery')
+        self.max_window_lengths = discovery.MAX_WINDOW_LENGTHS
+
+    def test_match(self):
+        scene_id = 'WV02_20110901210501_103001000D52C800_11SEP01210501-M1BS-052560788010_01_P007'
+        matcher = discovery.ExcludeMatcher([scene_id + '\n', 'QB02_2008', '', '/data/exact.tif', 'he', 'she'])
+        self.assertEqual(len(matcher), 5)
+        self.assertIn(scene_id, matcher)
+        self.assertNotIn(scene_id + '_u16rf3413', matcher)
+
+        self.assertEqual(matcher.match('/data/{}_u16rf3413.tif'.format(scene_id)), scene_id)
+        self.assertEqual(matcher.match('/data/QB02_20080101_x.tif'), 'QB02_2008')
+        self.assertEqual(matcher.match('/data/exact.tif'), '/data/exact.tif')
+        self.assertIn(matcher.match('/data/ushe'), ('he', 'she'))
+        self.assertIsNone(matcher.match('/data/QB02_2009_x.tif'))
+        self.assertIsNone(discovery.ExcludeMatcher().match('/data/exact.tif'))
+
+    def test_matches_brute_force(self):
+        patterns = ['abc', 'bcd', 'cab', 'aa', 'dcba', 'bab', 'b' * 10, 'cb' * 6, 'a' * 12, 'x' * 20, 'acbcd' * 3,
+                    'dddd', 'ccccccc']
+        ## both the fixed length lookups and the automaton
+        for max_lengths in (discovery.MAX_WINDOW_LENGTHS, 0):
+            discovery.MAX_WINDOW_LENGTHS = max_lengths
+            matcher = discovery.ExcludeMatcher(patterns)
+            for text in ('xxabxx', 'aabx', 'xcabd', 'bbcdd', 'ddcbb', 'dcbab', 'abab', 'cdcd', 'xyz', 'b' * 11,
+                         'acbcbcbcbcbcbx', 'acbcdacbcdacbcd', 'ccccccd', 'x' * 19):
+                expected = [p for p in patterns if p in text]
+                found = matcher.match(text)
+                if expected:
+                    self.assertIn(found, expected)
+                else:
+                    self.assertIsNone(found)
+
+    def test_get_exclude_matcher(self):
+        os.makedirs(self.srcdir, exist_ok=True)
+        exclfile = os.path.join(self.srcdir, 'excl_list.txt')
+        with open(exclfile, 'w') as f:
+            f.write('image2\nimage3\n')
+        matcher = discovery.get_exclude_matcher(exclfile)
+        self.assertEqual(sorted(matcher), ['image2', 'image3'])
+        self.assertIs(discovery.get_exclude_matcher(matcher), matcher)
+        self.assertEqual(sorted(discovery.get_exclude_matcher(['a', 'b'])), ['a', 'b'])
+
+    def tearDown(self):
+        discovery.MAX_WINDOW_LENGTHS = self.max_window_lengths
+        if os.path.isdir(self.srcdir):
+            shutil.rmtree(self.srcdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestDiscovery,
+        TestExcludeMatcher,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
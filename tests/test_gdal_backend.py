@@ -0,0 +1,95 @@
+import unittest, os, sys, shutil
+from osgeo import gdal
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+testdata_dir = os.path.join(__test_dir__, 'testdata')
+
+from lib import gdal_backend
+
+
+class TestSplitConfigOptions(unittest.TestCase):
+
+    def test_split_config_options(self):
+        options = '-wm 2000 --config GDAL_CACHEMAX 2048 --config GDAL_NUM_THREADS 4 -wo NUM_THREADS=4 -multi'
+        config_options, remaining = gdal_backend.split_config_options(options)
+        self.assertEqual(config_options, {'GDAL_CACHEMAX': '2048', 'GDAL_NUM_THREADS': '4'})
+        self.assertEqual(remaining, '-wm 2000 -wo NUM_THREADS=4 -multi')
+
+    def test_no_config_options(self):
+        config_options, remaining = gdal_backend.split_config_options('-of VRT')
+        self.assertEqual(config_options, {})
+        self.assertEqual(remaining, '-of VRT')
+
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_output')
+        if not os.path.isdir(self.dstdir):
+            os.makedirs(self.dstdir)
+        self.srcfp = os.path.join(self.dstdir, 'backend_src.tif')
+        ds = gdal.GetDriverByName('GTiff').Create(self.srcfp, 256, 256, 2, gdal.GDT_UInt16)
+        ds.SetGeoTransform([0, 1, 0, 256, 0, -1])
+        for band in (1, 2):
+            ds.GetRasterBand(band).Fill(band * 100)
+        ds = None
+
+    def test_backends_match(self):
+        for name in gdal_backend.BACKENDS:
+            backend = gdal_backend.get_backend(name)
+            self.assertIs(backend, gdal_backend.get_backend(name))
+
+            dstfp = os.path.join(self.dstdir, 'backend_{}.tif'.format(name))
+            err, so, se = backend.translate(self.srcfp, dstfp, '--config GDAL_CACHEMAX 64 -ot Byte -co "TILED=YES"')
+            self.assertEqual(err, 0)
+            err, so, se = backend.build_overviews(dstfp, 'near', [2, 4])
+            self.assertEqual(err, 0)
+
+            ds = gdal.Open(dstfp)
+            self.assertEqual(ds.RasterCount, 2)
+            self.assertEqual(ds.GetRasterBand(1).DataType, gdal.GDT_Byte)
+            self.assertEqual(ds.GetRasterBand(2).Checksum(), gdal.Open(self.srcfp).GetRasterBand(2).Checksum())
+            self.assertEqual(ds.GetRasterBand(1).GetOverviewCount(), 2)
+            ds = None
+
+    def test_inprocess_error(self):
+        backend = gdal_backend.get_backend('inprocess')
+        err, so, se = backend.translate(os.path.join(self.dstdir, 'missing.tif'),
+                                        os.path.join(self.dstdir, 'missing_out.tif'))
+        self.assertEqual(err, 1)
+
+    def test_inprocess_config_options_restored(self):
+        backend = gdal_backend.get_backend('inprocess')
+        gdal.SetConfigOption('GDAL_NUM_THREADS', '2')
+        try:
+            err, so, se = backend.translate(self.srcfp, os.path.join(self.dstdir, 'backend_config.tif'),
+                                            '--config GDAL_NUM_THREADS 4 --config GDAL_TIFF_INTERNAL_MASK YES')
+            self.assertEqual(err, 0)
+            self.assertEqual(gdal.GetConfigOption('GDAL_NUM_THREADS'), '2')
+            self.assertIsNone(gdal.GetConfigOption('GDAL_TIFF_INTERNAL_MASK'))
+        finally:
+            gdal.SetConfigOption('GDAL_NUM_THREADS', None)
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            gdal_backend.get_backend('bogus')
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestSplitConfigOptions,
+        TestBackends,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
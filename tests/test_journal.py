@@ -0,0 +1,75 @@
+import unittest, os, sys, shutil, zlib
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_journal')
+        os.makedirs(self.dstdir)
+        self.dstfp = os.path.join(self.dstdir, 'image_u08rf3031.tif')
+        self.warpfile = os.path.join(self.dstdir, 'image_u08rf3031_warp.tif')
+        for path in (self.dstfp, self.warpfile):
+            with open(path, 'wb') as f:
+                f.write(os.urandom(5000))
+
+    def test_record(self):
+        jrnl = journal.Journal(self.dstfp)
+        self.assertFalse(jrnl.exists())
+        self.assertFalse(jrnl.is_complete(journal.STAGE_WARP))
+        jrnl.record(journal.STAGE_WARP, self.warpfile, xsize=100)
+        jrnl.record(journal.STAGE_DONE, self.dstfp, checksum=True)
+        self.assertEqual(os.listdir(self.dstdir).count('image_u08rf3031_journal.json'), 1)
+        self.assertFalse([f for f in os.listdir(self.dstdir) if f.endswith('.part')])
+
+        ## a new instance reads the recorded stages
+        jrnl = journal.Journal(self.dstfp)
+        self.assertTrue(jrnl.exists())
+        self.assertTrue(jrnl.is_complete(journal.STAGE_WARP))
+        self.assertTrue(jrnl.is_complete(journal.STAGE_DONE))
+        with open(self.dstfp, 'rb') as f:
+            self.assertEqual(jrnl.stages[journal.STAGE_DONE]['crc32'], zlib.crc32(f.read()))
+        self.assertEqual(journal.file_crc32(self.dstfp, chunk_size=7), jrnl.stages[journal.STAGE_DONE]['crc32'])
+        self.assertEqual(jrnl.stages[journal.STAGE_WARP]['xsize'], 100)
+        self.assertTrue(jrnl.verify_checksum(journal.STAGE_DONE))
+        self.assertFalse(jrnl.verify_checksum(journal.STAGE_WARP))
+
+        ## a changed or missing file is not complete
+        with open(self.dstfp, 'ab') as f:
+            f.write(b'x')
+        os.remove(self.warpfile)
+        self.assertFalse(jrnl.is_complete(journal.STAGE_DONE))
+        self.assertFalse(jrnl.is_complete(journal.STAGE_WARP))
+
+        jrnl.reset()
+        self.assertFalse(jrnl.exists())
+        self.assertEqual(journal.Journal(self.dstfp).stages, {})
+
+    def test_unreadable_journal(self):
+        with open(journal.get_journal_path(self.dstfp), 'w') as f:
+            f.write('{"stages": ')
+        jrnl = journal.Journal(self.dstfp)
+        self.assertTrue(jrnl.exists())
+        self.assertFalse(jrnl.is_complete(journal.STAGE_DONE))
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestJournal,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
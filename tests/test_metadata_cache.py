@@ -0,0 +1,92 @@
+import unittest, os, sys, shutil
+import multiprocessing as mp
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import metadata_cache
+
+
+class ProcessArgs(object):
+    def __init__(self, metadata_cache=None):
+        self.metadata_cache = metadata_cache
+
+
+def get_cache_in_worker(dbpath, srcfp, parent_cache_id):
+    cache = metadata_cache.get_cache(dbpath)
+    cache.put(srcfp, metadata_cache.KIND_FOOTPRINT, {'bands': 4})
+    return id(cache) != parent_cache_id
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_output')
+        if not os.path.isdir(self.dstdir):
+            os.makedirs(self.dstdir)
+        self.srcfp = os.path.join(self.dstdir, 'image.tif')
+        with open(self.srcfp, 'w') as f:
+            f.write('image')
+        self.dbpath = os.path.join(self.dstdir, 'cache.sqlite')
+
+    def test_put_get(self):
+        cache = metadata_cache.MetadataCache(self.dbpath)
+        self.assertIsNone(cache.get(self.srcfp, metadata_cache.KIND_METADATA))
+        cache.put(self.srcfp, metadata_cache.KIND_METADATA, {'metapath': 'image.xml', 'xml': '<a/>'})
+        cache.put(self.srcfp, metadata_cache.KIND_FOOTPRINT, {'bands': 4})
+
+        ## a new connection sees the stored entries
+        cache = metadata_cache.MetadataCache(self.dbpath)
+        self.assertEqual(cache.get(self.srcfp, metadata_cache.KIND_METADATA), {'metapath': 'image.xml', 'xml': '<a/>'})
+        self.assertEqual(cache.get(self.srcfp, metadata_cache.KIND_FOOTPRINT), {'bands': 4})
+
+    def test_changed_source_is_a_miss(self):
+        cache = metadata_cache.MetadataCache(self.dbpath)
+        cache.put(self.srcfp, metadata_cache.KIND_FOOTPRINT, {'bands': 4})
+        with open(self.srcfp, 'w') as f:
+            f.write('reprocessed image')
+        self.assertIsNone(cache.get(self.srcfp, metadata_cache.KIND_FOOTPRINT))
+        os.remove(self.srcfp)
+        self.assertIsNone(cache.get(self.srcfp, metadata_cache.KIND_FOOTPRINT))
+
+    def test_unusable_database(self):
+        cache = metadata_cache.MetadataCache(os.path.join(self.dstdir, 'missing_dir', 'cache.sqlite'))
+        self.assertFalse(cache.enabled)
+        cache.put(self.srcfp, metadata_cache.KIND_FOOTPRINT, {'bands': 4})
+        self.assertIsNone(cache.get(self.srcfp, metadata_cache.KIND_FOOTPRINT))
+
+    def test_get_cache_from_args(self):
+        self.assertIsNone(metadata_cache.get_cache_from_args(ProcessArgs()))
+        self.assertIsNone(metadata_cache.get_cache_from_args(object()))
+        cache = metadata_cache.get_cache_from_args(ProcessArgs(self.dbpath))
+        self.assertIs(cache, metadata_cache.get_cache(self.dbpath))
+
+    @unittest.skipUnless('fork' in mp.get_all_start_methods(), "requires the fork start method")
+    def test_forked_worker_opens_own_cache(self):
+        cache = metadata_cache.get_cache(self.dbpath)
+        pool = mp.get_context('fork').Pool(1)
+        try:
+            self.assertTrue(pool.apply(get_cache_in_worker, (self.dbpath, self.srcfp, id(cache))))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(cache.get(self.srcfp, metadata_cache.KIND_FOOTPRINT), {'bands': 4})
+
+    def tearDown(self):
+        metadata_cache._cache_instances.clear()
+        shutil.rmtree(self.dstdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestMetadataCache,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
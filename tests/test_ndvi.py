@@ -1,11 +1,16 @@
 import shutil
-import unittest, os, subprocess
+import unittest, os, subprocess, sys
+import numpy
 from osgeo import gdal
 
 __test_dir__ = os.path.dirname(os.path.abspath(__file__))
 __app_dir__ = os.path.dirname(__test_dir__)
+sys.path.append(__app_dir__)
 testdata_dir = os.path.join(__test_dir__, 'testdata')
 
+import pgc_ndvi
+from lib import spectral_index
+
 
 class TestNdviFunc(unittest.TestCase):
     
@@ -68,6 +73,32 @@ class TestNdviFunc(unittest.TestCase):
                 self.assertEqual(dt, 3)
                 ds = None
                 
+    # @unittest.skip("skipping")
+    def test_ndvi_threads(self):
+
+        srcdir = os.path.join(os.path.join(testdata_dir, 'ndvi', 'ortho'))
+        serial_dir = os.path.join(self.dstdir, 'serial')
+        threaded_dir = os.path.join(self.dstdir, 'threaded')
+        for dstdir, threads in ((serial_dir, 1), (threaded_dir, 3)):
+            os.makedirs(dstdir)
+            cmd = 'python {} {} {} --skip-cmd-txt -t Int16 --threads {}'.format(
+                self.scriptpath,
+                srcdir,
+                dstdir,
+                threads
+            )
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+            se, so = p.communicate()
+
+        for f in os.listdir(srcdir):
+            if f.endswith('.tif'):
+                serial_ds = gdal.Open(os.path.join(serial_dir, f[:-4] + '_ndvi.tif'))
+                threaded_ds = gdal.Open(os.path.join(threaded_dir, f[:-4] + '_ndvi.tif'))
+                numpy.testing.assert_array_equal(serial_ds.GetRasterBand(1).ReadAsArray(),
+                                                 threaded_ds.GetRasterBand(1).ReadAsArray())
+                serial_ds = None
+                threaded_ds = None
+
     # @unittest.skip("skipping")
     def test_ndvi_from_pansharp(self):
         
@@ -93,14 +124,69 @@ class TestNdviFunc(unittest.TestCase):
                 dt = ds.GetRasterBand(1).DataType
                 self.assertEqual(dt, 3)
     
+    def test_evi_rejects_integer_input(self):
+        srcdir = os.path.join(self.dstdir, 'src')
+        os.makedirs(srcdir)
+        for outtype, rc in (('u16rf', 1), ('f32rf', 0)):
+            srcfp = os.path.join(srcdir, 'WV02_20120101000000_1030010000000000_12JAN01000000-M1BS-500000000010_01_P001_{}.tif'.format(outtype))
+            gdal_type = gdal.GDT_UInt16 if outtype == 'u16rf' else gdal.GDT_Float32
+            ds = gdal.GetDriverByName('GTiff').Create(srcfp, 64, 64, 4, gdal_type)
+            ds.SetGeoTransform([0, 1, 0, 64, 0, -1])
+            for band, value in ((1, 0.05), (2, 0.08), (3, 0.1), (4, 0.4)):
+                ds.GetRasterBand(band).Fill(value * 2000 if outtype == 'u16rf' else value)
+            ds = None
+            dstfp = os.path.join(self.dstdir, os.path.basename(srcfp)[:-4] + '_evi.tif')
+            self.assertEqual(pgc_ndvi.calc_indices(srcfp, dstfp, NdviArgs(index='evi')), rc)
+            self.assertEqual(os.path.isfile(dstfp), rc == 0)
+
     def tearDown(self):
        shutil.rmtree(self.dstdir)
 
 
+class NdviArgs(object):
+    def __init__(self, index='ndvi', outtype='Float32'):
+        self.index = index
+        self.outtype = outtype
+        self.separate = False
+        self.wd = None
+        self.threads = 1
+        self.staged_read = False
+        self.save_temps = False
+
+
+class TestNdviKernel(unittest.TestCase):
+
+    def setUp(self):
+        self.red = numpy.array([[0, 100, 300], [200, 0, 50]], dtype=numpy.uint16)
+        self.nir = numpy.array([[100, 300, 100], [0, 0, 65535]], dtype=numpy.uint16)
+
+    def test_float32(self):
+        kernel = spectral_index.NormalizedDifferenceKernel(16, 'Float32', 65535, 0)
+        ndvi = kernel.compute(self.nir, self.red)
+        self.assertEqual(ndvi.dtype, numpy.float32)
+        expected = numpy.array([[-9999, 0.5, -0.5], [-1.0, -9999, -9999]], dtype=numpy.float32)
+        numpy.testing.assert_allclose(ndvi, expected)
+
+    def test_int16_truncates(self):
+        kernel = spectral_index.NormalizedDifferenceKernel(16, 'Int16', 65535, 0)
+        ndvi = kernel.compute(numpy.array([[4]], dtype=numpy.uint16), numpy.array([[3]], dtype=numpy.uint16))
+        self.assertEqual(ndvi.dtype, numpy.int16)
+        ## 1/7 * 1000 = 142.86 truncates to 142
+        self.assertEqual(ndvi.tolist(), [[142]])
+
+    def test_buffer_reuse_partial_block(self):
+        kernel = spectral_index.NormalizedDifferenceKernel(6, 'Float32', 65535, 0)
+        kernel.compute(self.nir, self.red)
+        ndvi = kernel.compute(self.nir[:1, 1:], self.red[:1, 1:])
+        self.assertEqual(ndvi.shape, (1, 2))
+        numpy.testing.assert_allclose(ndvi, [[0.5, -0.5]])
+
+
 if __name__ == '__main__':
         
     test_cases = [
-        TestNdviFunc
+        TestNdviFunc,
+        TestNdviKernel,
     ]
     
     suites = []
@@ -219,6 +219,38 @@ class TestOrthoFunc(unittest.TestCase):
                 with gdal.Open(output_files[0], gdalconst.GA_ReadOnly) as ds:
                     self.assertIn('LAYOUT=COG', ds.GetMetadata_List('IMAGE_STRUCTURE'))
 
+    def test_single_pass(self):
+        ## the stretch applied to a warped VRT matches the stretch of the warped GeoTIFF of the two pass workflow
+        fn = 'QB02_20120827132242_10100100101AD000_12AUG27132242-M1BS-500122876080_01_P006.ntf'
+        base_args = '-r 10 --skip-cmd-txt --epsg 3413 --stretch rf --resample near --outtype Byte --gtiff-compression lzw'
+        outputs = []
+        for name, test_args in (('two_pass', base_args), ('single_pass', base_args + ' --single-pass')):
+            _dstdir = os.path.join(self.dstdir, name)
+            os.mkdir(_dstdir)
+            cmd = f'python "{self.scriptpath}" {test_args} {self.srcdir}/{fn} {_dstdir}'
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+            se, so = p.communicate()
+            print(so)
+            print(se)
+            output_files = glob.glob(os.path.join(_dstdir, f'{os.path.splitext(fn)[0]}*.tif'))
+            self.assertEqual(len(output_files), 1)
+            ## the warp intermediate is removed in both workflows
+            self.assertEqual(glob.glob(os.path.join(_dstdir, '*_warp.*')), [])
+            outputs.append(output_files[0])
+
+        with gdal.Open(outputs[0], gdalconst.GA_ReadOnly) as two_pass, \
+                gdal.Open(outputs[1], gdalconst.GA_ReadOnly) as single_pass:
+            self.assertEqual(single_pass.RasterCount, two_pass.RasterCount)
+            self.assertEqual(single_pass.GetGeoTransform(), two_pass.GetGeoTransform())
+            for band in range(1, two_pass.RasterCount + 1):
+                expected = two_pass.GetRasterBand(band).ReadAsArray().astype(int)
+                out = single_pass.GetRasterBand(band).ReadAsArray().astype(int)
+                self.assertEqual(out.shape, expected.shape)
+                ## warp chunking can differ between the VRT and gdalwarp, so allow a few differing pixels
+                self.assertLess((out != expected).mean(), 0.01)
+                self.assertEqual(single_pass.GetRasterBand(band).GetNoDataValue(),
+                                 two_pass.GetRasterBand(band).GetNoDataValue())
+
     def tearDown(self):
         shutil.rmtree(self.dstdir)
 
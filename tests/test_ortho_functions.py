@@ -1,13 +1,13 @@
 import platform
-import unittest, os, sys
-from osgeo import gdal, ogr
+import unittest, os, sys, shutil
+from osgeo import gdal, ogr, osr
 from collections import namedtuple
 
 __test_dir__ = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(__test_dir__))
 testdata_dir = os.path.join(__test_dir__, 'testdata')
 
-from lib import ortho_functions, utils
+from lib import journal, ortho_functions, utils
 from lib import VERSION
 
 Band_data_range = namedtuple('Band_data_range', ['factor_min', 'factor_max', 'offset_min', 'offset_max'])
@@ -365,6 +365,31 @@ class TestAutoStretchAndEpsg(unittest.TestCase):
             self.assertEqual(info.epsg, out_epsg)
 
 
+class TestPlannedDstfp(unittest.TestCase):
+
+    def test_planned_dstfp_matches_image_info(self):
+        fn = 'WV03_20140919212947_104001000227BF00_14SEP19212947-M1BS-500191821040_01_P002.ntf'
+        srcfp = os.path.join(testdata_dir, 'ortho', fn)
+        dstdir = os.path.join(__test_dir__, 'tmp_output')
+        for epsg, stretch in (('3413', 'rf'), (32630, 'ns')):
+            test_args = ProcessArgs(epsg, stretch)
+            info = ortho_functions.ImageInfo(srcfp, dstdir, dstdir, test_args)
+            self.assertEqual(ortho_functions.get_planned_dstfp(srcfp, dstdir, test_args), info.dstfp)
+
+    def test_planned_dstfp_needs_image_info(self):
+        fn = 'WV03_20140919212947_104001000227BF00_14SEP19212947-M1BS-500191821040_01_P002.ntf'
+        srcfp = os.path.join(testdata_dir, 'ortho', fn)
+        dstdir = os.path.join(__test_dir__, 'tmp_output')
+        for epsg, stretch in (('auto', 'rf'), ('utm', 'rf'), ('3413', 'au')):
+            test_args = ProcessArgs(epsg, stretch)
+            self.assertIsNone(ortho_functions.get_planned_dstfp(srcfp, dstdir, test_args))
+
+    def test_planned_dstfp_unknown_vendor(self):
+        test_args = ProcessArgs('3413', 'rf')
+        with self.assertRaises(RuntimeError):
+            ortho_functions.get_planned_dstfp('/data/not_an_image.tif', '/out', test_args)
+
+
 class TestCalcEarthSunDist(unittest.TestCase):
     def setUp(self):
         self.year = 2010
@@ -420,6 +445,183 @@ class TestRPCHeight(unittest.TestCase):
             self.assertEqual(h, test_h)
 
 
+class TestPlanAutoDems(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_plan_auto_dems')
+        os.makedirs(self.dstdir)
+
+        ## a VRT DEM of four one-degree tiles, and a GeoPackage listing it
+        tiles = []
+        for x in range(2):
+            for y in range(2):
+                tiles.append(self.write_raster('tile_{}{}.tif'.format(x, y), x, y + 1, 10, 0.1))
+        ## outside the tile directory, so the VRT holds absolute tile paths
+        os.makedirs(os.path.join(self.dstdir, 'vrt'))
+        self.vrt = os.path.join(self.dstdir, 'vrt', 'tiles.vrt')
+        gdal.BuildVRT(self.vrt, sorted(tiles))
+        self.gpkg = os.path.join(self.dstdir, 'dems.gpkg')
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        ds = ogr.GetDriverByName('GPKG').CreateDataSource(self.gpkg)
+        layer = ds.CreateLayer('dems', srs, ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn('rank', ogr.OFTInteger))
+        for field in ('dempath', 'windowspath'):
+            layer.CreateField(ogr.FieldDefn(field, ogr.OFTString))
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkt('POLYGON ((0 0, 2 0, 2 2, 0 2, 0 0))'))
+        feature['rank'] = 1
+        feature['dempath'] = self.vrt
+        feature['windowspath'] = self.vrt
+        layer.CreateFeature(feature)
+        ds = None
+
+        self.config = os.path.join(self.dstdir, 'config.ini')
+        with open(self.config, 'w') as f:
+            f.write("[default]\ngpkg_path = {}".format(self.gpkg))
+
+    def write_raster(self, name, ulx, uly, size, res):
+        path = os.path.join(self.dstdir, name)
+        ds = gdal.GetDriverByName('GTiff').Create(path, size, size, 1, gdal.GDT_Float32)
+        ds.SetGeoTransform([ulx, res, 0, uly, 0, -res])
+        ds.SetProjection(utils.SpatialRef(4326).srs.ExportToWkt())
+        ds = None
+        return path
+
+    def test_plan_auto_dems(self):
+        image_in_tile = self.write_raster('image_a.tif', 0.1, 0.4, 30, 0.01)
+        image_at_sea = self.write_raster('image_b.tif', 10.1, 10.4, 30, 0.01)
+        test_args = ProcessArgs()
+        test_args.dem = 'auto'
+        test_args.config_file = self.config
+        test_args.scratch = self.dstdir
+
+        rows, header = ortho_functions.plan_auto_dems([image_at_sea, image_in_tile], test_args)
+        self.assertEqual(header, ['src', 'dem'])
+        self.assertEqual([row[0] for row in rows], [image_in_tile, image_at_sea])
+        self.assertEqual(rows[1][1], 'None')
+
+        ## the image gets a subset VRT of the one tile it overlaps
+        subset_vrt = rows[0][1]
+        self.assertTrue(subset_vrt.startswith(os.path.join(self.dstdir, 'Or_dem_vrt1')))
+        ds = gdal.Open(subset_vrt)
+        self.assertEqual([os.path.basename(f) for f in ds.GetFileList()[1:]], ['tile_00.tif'])
+        ds = None
+
+        ## tasks with a DEM are left alone
+        test_args.dem = None
+        task_list = [image_in_tile]
+        self.assertEqual(ortho_functions.plan_auto_dems(task_list, test_args), (task_list, None))
+
+    def test_process_image_fails_before_auto_dem(self):
+        ## an image without metadata fails in ImageInfo, and the auto DEM lookup is skipped
+        test_args = ProcessArgs()
+        test_args.dem = 'auto'
+        test_args.config_file = self.config
+        srcfp = self.write_raster('WV02_20120101000000_1030010000000000_12JAN01000000-M1BS-500000000010_01_P001.tif',
+                                  0.1, 0.4, 30, 0.01)
+        dstfp = os.path.join(self.dstdir, 'out', 'image_u08rf4326.tif')
+        self.assertEqual(ortho_functions.process_image(srcfp, dstfp, test_args), 1)
+        self.assertEqual(test_args.dem, 'auto')
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
+class TestWarpRecord(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_warp_record')
+        os.makedirs(self.dstdir)
+        self.srcfp = os.path.join(self.dstdir, 'image.tif')
+        self.warpfile = os.path.join(self.dstdir, 'image_u08rf4326_warp.tif')
+        for path in (self.srcfp, self.warpfile):
+            ds = gdal.GetDriverByName('GTiff').Create(path, 100, 100, 1, gdal.GDT_Float32)
+            ds.SetGeoTransform([0, 0.01, 0, 1, 0, -0.01])
+            ds.GetRasterBand(1).SetNoDataValue(0)
+            ds.GetRasterBand(1).Fill(1)
+            ds = None
+
+    def test_warp_key(self):
+        info = namedtuple('Info', 'srcfp localsrc bands centerlong extent res tap spatial_ref')(
+            self.srcfp, self.srcfp, 1, '', '-te 0 0 1 1 ', '-tr 0.01 0.01 ', '', utils.SpatialRef(4326))
+        test_args = ProcessArgs()
+        key = ortho_functions.get_warp_key(test_args, info)
+        ## the stretch does not change the warp, the output type changes its nodata value
+        self.assertEqual(ortho_functions.get_warp_key(ProcessArgs(stretch='ns'), info), key)
+        test_args.outtype = 'UInt16'
+        self.assertNotEqual(ortho_functions.get_warp_key(test_args, info), key)
+        test_args = ProcessArgs()
+        test_args.ortho_height = 100
+        self.assertNotEqual(ortho_functions.get_warp_key(test_args, info), key)
+
+        ## warps in the cache have one nodata value for all output types
+        test_args = ProcessArgs()
+        test_args.warp_cache = self.dstdir
+        cache_key = ortho_functions.get_warp_key(test_args, info)
+        test_args.outtype = 'UInt16'
+        self.assertEqual(ortho_functions.get_warp_key(test_args, info), cache_key)
+
+    def test_is_valid_warp(self):
+        jrnl = journal.Journal(os.path.join(self.dstdir, 'image_u08rf4326.tif'))
+        ortho_functions.record_warp([jrnl], self.warpfile, 'key')
+        self.assertTrue(ortho_functions.is_valid_warp(jrnl, 'key'))
+        self.assertFalse(ortho_functions.is_valid_warp(jrnl, 'other key'))
+
+        ## a changed pixel is caught by the checksum even if the size and time are unchanged
+        st = os.stat(self.warpfile)
+        with open(self.warpfile, 'r+b') as f:
+            f.seek(st.st_size // 2)
+            byte = f.read(1)
+            f.seek(st.st_size // 2)
+            f.write(bytes([byte[0] ^ 0xff]))
+        os.utime(self.warpfile, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertTrue(jrnl.is_complete(journal.STAGE_WARP))
+        self.assertFalse(ortho_functions.is_valid_warp(jrnl, 'key'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
+class TestStageSourceWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_stage_window')
+        self.wd = os.path.join(self.dstdir, 'wd')
+        os.makedirs(self.wd)
+        self.srcfp = os.path.join(self.dstdir, 'WV02_20120719233558_103001001B998D00_12JUL19233558-M1BS-052754253040_01_P001.tif')
+        ds = gdal.GetDriverByName('GTiff').Create(self.srcfp, 1000, 1000, 1, gdal.GDT_UInt16)
+        ds.GetRasterBand(1).Fill(100)
+        zeros = ['0'] * 20
+        ds.SetMetadata({
+            'LINE_OFF': '500', 'SAMP_OFF': '500', 'LAT_OFF': '45', 'LONG_OFF': '-100', 'HEIGHT_OFF': '100',
+            'LINE_SCALE': '500', 'SAMP_SCALE': '500', 'LAT_SCALE': '0.05', 'LONG_SCALE': '0.05', 'HEIGHT_SCALE': '500',
+            'LINE_NUM_COEFF': ' '.join(['0', '0', '-1'] + zeros[3:]),
+            'LINE_DEN_COEFF': ' '.join(['1'] + zeros[1:]),
+            'SAMP_NUM_COEFF': ' '.join(['0', '1'] + zeros[2:]),
+            'SAMP_DEN_COEFF': ' '.join(['1'] + zeros[1:]),
+        }, 'RPC')
+        ds = None
+
+    def test_window_carries_rpcs(self):
+        ## warp_image accepts the staged window without the .RPB sidecar a DG GeoTIFF otherwise needs
+        localsrc = os.path.join(self.wd, os.path.basename(self.srcfp))
+        err, so, se = ortho_functions.stage_source_window(self.srcfp, localsrc, (100, 200, 300, 400))
+        self.assertEqual(err, 0)
+        self.assertFalse(os.path.isfile(os.path.splitext(localsrc)[0] + '.RPB'))
+        self.assertTrue(ortho_functions.has_rpc_metadata(localsrc))
+        rpc = gdal.Open(localsrc).GetMetadata('RPC')
+        self.assertAlmostEqual(float(rpc['LINE_OFF']), 300)
+        self.assertAlmostEqual(float(rpc['SAMP_OFF']), 400)
+
+        ds = gdal.GetDriverByName('GTiff').Create(os.path.join(self.wd, 'no_rpc.tif'), 10, 10, 1)
+        ds = None
+        self.assertFalse(ortho_functions.has_rpc_metadata(os.path.join(self.wd, 'no_rpc.tif')))
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
 class ProcessArgs(object):
     def __init__(self, epsg='4326', stretch='rf'):
         self.epsg = epsg
@@ -451,6 +653,10 @@ if __name__ == '__main__':
         TestAutoStretchAndEpsg,
         TestRPCHeight,
         TestCalcEarthSunDist,
+        TestPlannedDstfp,
+        TestPlanAutoDems,
+        TestWarpRecord,
+        TestStageSourceWindow,
     ]
     
     suites = []
@@ -0,0 +1,94 @@
+import unittest, os, sys, shutil, logging
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import perf
+
+
+class TestStageTimer(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_perf')
+        os.makedirs(self.dstdir)
+
+    def test_stages(self):
+        timer = perf.StageTimer()
+        path = os.path.join(self.dstdir, 'data.bin')
+        with timer.stage('write'):
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100000)
+        with timer.stage('read'):
+            with open(path, 'rb') as f:
+                f.read()
+        with timer.stage('write'):
+            with open(path, 'ab') as f:
+                f.write(b'x' * 100000)
+
+        record = timer.get_record(image='image.ntf', rc=0)
+        self.assertEqual(record['image'], 'image.ntf')
+        self.assertEqual([s['stage'] for s in record['stages']], ['write', 'read'])
+        for stage in record['stages'] + [record['total']]:
+            self.assertGreaterEqual(stage['wall'], 0)
+            self.assertGreaterEqual(stage['cpu'], 0)
+
+        if perf.read_io_counters() is not None:
+            write, read = record['stages']
+            self.assertGreaterEqual(write['write_bytes'], 200000)
+            self.assertGreaterEqual(read['read_bytes'], 100000)
+            self.assertGreaterEqual(record['total']['write_bytes'], 200000)
+
+    def test_failed_stage_is_recorded(self):
+        timer = perf.StageTimer()
+        with self.assertRaises(ValueError):
+            with timer.stage('metadata'):
+                raise ValueError('bad metadata')
+        self.assertIn('metadata', timer.stages)
+
+    def test_log_record(self):
+        logpath = os.path.join(self.dstdir, 'image.log')
+        handler = logging.FileHandler(logpath)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s- %(message)s', '%m-%d-%Y %H:%M:%S'))
+        logger = logging.getLogger("logger")
+        logger.addHandler(handler)
+        try:
+            timer = perf.StageTimer()
+            with timer.stage('warp'):
+                pass
+            timer.log_record(image='image.ntf', rc=1)
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+        with open(logpath) as f:
+            records = [perf.parse_stage_times(line) for line in f]
+        records = [r for r in records if r is not None]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['rc'], 1)
+        self.assertEqual(records[0]['stages'][0]['stage'], 'warp')
+        self.assertIsNone(perf.parse_stage_times('Total Processing Time: 0:01:00'))
+
+    def test_read_io_counters(self):
+        path = os.path.join(self.dstdir, 'io')
+        with open(path, 'w') as f:
+            f.write('rchar: 100\nwchar: 50\nsyscr: 3\n')
+        self.assertEqual(perf.read_io_counters(path), (100, 50))
+        self.assertIsNone(perf.read_io_counters(os.path.join(self.dstdir, 'missing')))
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestStageTimer,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -0,0 +1,107 @@
+import unittest, os, sys, shutil, json
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import perf, perf_report
+
+
+def make_record(image, start, stages, task='ortho', sensor='WV02', bands=4, rc=0, megapixels=100.0):
+    return {
+        'task': task, 'image': image, 'sensor': sensor, 'bands': bands, 'rc': rc, 'megapixels': megapixels,
+        'start': start,
+        'stages': [{'stage': name, 'wall': wall, 'cpu': wall / 2.0, 'read_bytes': 1000, 'write_bytes': None}
+                   for name, wall in stages],
+        'total': {'wall': sum([wall for name, wall in stages]), 'cpu': 1.0, 'read_bytes': 1000,
+                  'write_bytes': 10},
+    }
+
+
+class TestPerfReport(unittest.TestCase):
+
+    def setUp(self):
+        self.logdir = os.path.join(__test_dir__, 'tmp_perf_report')
+        os.makedirs(os.path.join(self.logdir, 'run1'))
+        self.records = [
+            make_record('a.ntf', '2024-01-01T10:00:00', [('metadata', 2.0), ('warp', 100.0)]),
+            make_record('b.ntf', '2024-01-01T10:00:30', [('metadata', 4.0), ('warp', 300.0)], sensor='WV03',
+                        bands=8, rc=1),
+            make_record('c.ntf', '2024-01-02T10:00:00', [('metadata', 6.0), ('warp', 200.0)]),
+        ]
+
+    def write_log(self, path, records):
+        with open(os.path.join(self.logdir, path), 'w') as f:
+            f.write('01-01-2024 10:00:00 INFO- Working Dir: /scratch\n')
+            for record in records:
+                f.write('01-01-2024 10:00:00 INFO- {}{}\n'.format(perf.STAGE_TIMES_MARKER, json.dumps(record)))
+
+    def test_read_records(self):
+        ## each image's record is in its own log and in the job output
+        self.write_log('run1/a.log', self.records[:1])
+        self.write_log('run1/b.log', self.records[1:2])
+        self.write_log('run1/Or0001.o1234', self.records[:2])
+        self.write_log('c.log', self.records[2:])
+        self.write_log('notes.txt', self.records)
+
+        logfiles = list(perf_report.iter_log_files([self.logdir]))
+        self.assertEqual(len(logfiles), 4)
+        records = perf_report.read_records(logfiles)
+        self.assertEqual(sorted([r['image'] for r in records]), ['a.ntf', 'b.ntf', 'c.ntf'])
+
+        records = perf_report.read_records(perf_report.iter_log_files([self.logdir], ['*.txt']))
+        self.assertEqual(len(records), 3)
+
+    def test_percentile(self):
+        self.assertIsNone(perf_report.percentile([], 50))
+        self.assertEqual(perf_report.percentile([3, 1, 2], 50), 2)
+        self.assertEqual(perf_report.percentile([1, 2, 3, 4], 50), 2.5)
+        self.assertEqual(perf_report.percentile([1, 2, 3, 4], 100), 4)
+
+    def test_stage_rows(self):
+        report = perf_report.PerfReport(self.records)
+        rows = report.get_stage_rows()
+        self.assertEqual([row[:3] for row in rows], [['ortho', 'metadata', 3], ['ortho', 'warp', 3]])
+        warp = rows[1]
+        self.assertEqual(warp[3:7], [200.0, 280.0, 298.0, 300.0])
+        self.assertAlmostEqual(warp[8], 100.0 * 600 / 612)
+        self.assertEqual(warp[9], 0.5)
+        self.assertIsNone(warp[11])
+
+    def test_group_rows(self):
+        report = perf_report.PerfReport(self.records)
+        self.assertEqual([row[:4] for row in report.get_group_rows('sensor')],
+                         [['ortho', 'WV02', 2, 0], ['ortho', 'WV03', 1, 1]])
+        self.assertEqual([row[:3] for row in report.get_group_rows('bands')], [['ortho', 4, 2], ['ortho', 8, 1]])
+
+    def test_slowest_and_runs(self):
+        report = perf_report.PerfReport(self.records, slowest=2)
+        self.assertEqual([(row[1], row[5]) for row in report.get_slowest_rows()],
+                         [('b.ntf', 'warp (300s)'), ('c.ntf', 'warp (200s)')])
+
+        runs = report.get_run_rows()
+        self.assertEqual([row[:3] for row in runs], [['2024-01-01', 2, 1], ['2024-01-02', 1, 0]])
+        ## the first day runs from 10:00:00 until 10:05:34
+        self.assertAlmostEqual(runs[0][3], 334 / 3600.0)
+        self.assertAlmostEqual(runs[0][7], 200 / 406.0)
+
+        text = report.format()
+        self.assertIn('Throughput per run', text)
+        self.assertIn('warp (300s)', text)
+
+    def tearDown(self):
+        shutil.rmtree(self.logdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestPerfReport,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -0,0 +1,126 @@
+import unittest, os, sys, shutil
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import metadata_cache, runtime_model
+
+
+class ProcessArgs(object):
+    def __init__(self, dem=None, bundle_walltime=1.0, tasks_per_job=None, runtime_model=None):
+        self.dem = dem
+        self.bundle_walltime = bundle_walltime
+        self.tasks_per_job = tasks_per_job
+        self.runtime_model = runtime_model
+        self.metadata_cache = None
+
+
+class TestRuntimeModel(unittest.TestCase):
+
+    def setUp(self):
+        self.logdir = os.path.join(__test_dir__, 'tmp_runtime_model')
+        os.makedirs(os.path.join(self.logdir, 'subdir'))
+
+    def write_log(self, name, xsize, ysize, bands, runtime, dem=None):
+        lines = ['2024-01-01 10:00:00 INFO- Working Dir: /scratch']
+        if dem:
+            lines.append('2024-01-01 10:00:00 INFO- DEM: {}'.format(dem))
+        lines.append('2024-01-01 10:00:01 INFO- Source raster size: {} x {} pixels, {} bands'.format(
+            xsize, ysize, bands))
+        lines.append('2024-01-01 10:10:00 INFO- Total Processing Time: {}'.format(runtime))
+        path = os.path.join(self.logdir, name)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_parse_log(self):
+        path = self.write_log('a.log', 10000, 2000, 4, '0:10:30.500000', dem='/dems/gimp.tif')
+        self.assertEqual(runtime_model.parse_log(path), (80.0, True, 630.5))
+        path = self.write_log('b.log', 1000, 1000, 1, '1 day, 2:00:00')
+        self.assertEqual(runtime_model.parse_log(path), (1.0, False, 93600.0))
+
+        ## an image that did not finish is not a sample
+        with open(os.path.join(self.logdir, 'c.log'), 'w') as f:
+            f.write('Source raster size: 10 x 10 pixels, 1 bands\n')
+        self.assertIsNone(runtime_model.parse_log(os.path.join(self.logdir, 'c.log')))
+        self.assertIsNone(runtime_model.parse_log(os.path.join(self.logdir, 'missing.log')))
+
+    def test_calibrate(self):
+        ## DEM runtime = 100 + 2 * Mpix-bands; too few no-DEM logs to fit
+        self.write_log('a.log', 1000, 1000, 4, '0:01:48', dem='dem.tif')
+        self.write_log('subdir/b.log', 2000, 1000, 4, '0:01:56', dem='dem.tif')
+        self.write_log('subdir/c.log', 4000, 1000, 4, '0:02:12', dem='dem.tif')
+        self.write_log('d.log', 1000, 1000, 1, '0:01:00')
+        model = runtime_model.get_model(self.logdir)
+        intercept, slope = model.coefficients['dem']
+        self.assertAlmostEqual(intercept, 100.0)
+        self.assertAlmostEqual(slope, 2.0)
+        self.assertEqual(model.coefficients['nodem'], runtime_model.DEFAULT_COEFFICIENTS['nodem'])
+        self.assertEqual(model.samples, {'dem': 3, 'nodem': 1})
+
+        ## saved models are reloaded as is
+        jsonpath = os.path.join(self.logdir, 'model.json')
+        model.to_json(jsonpath)
+        loaded = runtime_model.get_model(jsonpath)
+        self.assertEqual(loaded.coefficients, model.coefficients)
+        self.assertAlmostEqual(loaded.predict(10, True), 120.0)
+        self.assertAlmostEqual(loaded.predict(10, False), 65.0)
+
+    def test_fit_line(self):
+        self.assertIsNone(runtime_model.fit_line([(1, 1)]))
+        self.assertIsNone(runtime_model.fit_line([(1, 1), (1, 2)]))
+        self.assertEqual(runtime_model.fit_line([(0, 10), (1, 8), (2, 6)]), (8.0, 0.0))
+
+    def test_pack_bundles(self):
+        items = [('a', 50), ('b', 40), ('c', 30), ('d', 20), ('e', 10), ('f', 150)]
+        bundles = runtime_model.pack_bundles(items, 100)
+        self.assertEqual(bundles, [(['f'], 150), (['a', 'b'], 90), (['c', 'd', 'e'], 60)])
+
+        bundles = runtime_model.pack_bundles(items, 100, max_tasks=2)
+        self.assertEqual([b for b, seconds in bundles], [['f'], ['a', 'b'], ['c', 'd'], ['e']])
+
+    def test_get_walltime(self):
+        self.assertEqual(runtime_model.get_walltime(60), runtime_model.MIN_WALLTIME)
+        self.assertEqual(runtime_model.get_walltime(3601), 5460)
+
+    def test_plan_bundles(self):
+        srcs = []
+        for i in range(3):
+            srcfp = os.path.join(self.logdir, 'img{}.tif'.format(i))
+            with open(srcfp, 'w') as f:
+                f.write('x')
+            srcs.append(srcfp)
+
+        ## raster sizes come from the metadata cache
+        args = ProcessArgs(dem='dem.tif', bundle_walltime=0.25)
+        args.metadata_cache = os.path.join(self.logdir, 'cache.sqlite')
+        cache = metadata_cache.get_cache_from_args(args)
+        for srcfp, mpix in zip(srcs, (600, 300, 300)):
+            cache.put(srcfp, metadata_cache.KIND_FOOTPRINT, {'xsize': mpix * 1000, 'ysize': 1000, 'bands': 1})
+
+        bundles = runtime_model.plan_bundles(srcs, args)
+        self.assertEqual(bundles, [([srcs[0]], 1080), ([srcs[1], srcs[2]], 1260)])
+
+        ## CSV rows use their own dem column
+        rows = [[srcfp, ''] for srcfp in srcs]
+        bundles = runtime_model.plan_bundles(rows, args, ['src', 'dem'])
+        self.assertEqual(bundles, [([rows[0], rows[1], rows[2]], 1200)])
+
+    def tearDown(self):
+        metadata_cache._cache_instances.clear()
+        shutil.rmtree(self.logdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestRuntimeModel,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
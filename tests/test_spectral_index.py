@@ -0,0 +1,84 @@
+import unittest, os, sys
+import numpy
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import spectral_index, utils
+
+
+class TestParseIndices(unittest.TestCase):
+
+    def test_builtin_and_expression(self):
+        indices = spectral_index.parse_indices('ndvi, NDWI,ratio=nir / red')
+        self.assertEqual([i.name for i in indices], ['ndvi', 'ndwi', 'ratio'])
+        self.assertEqual(indices[0].normalized_difference, ('nir', 'red'))
+        self.assertEqual(indices[2].expression, 'nir / red')
+        ## only built-in indices with reflectance constants need reflectance input
+        self.assertEqual([i.reflectance for i in spectral_index.parse_indices('evi,ndvi,x=nir+1')],
+                         [True, False, False])
+
+    def test_invalid(self):
+        for definition in ('bogus', 'x=__import__("os")', 'x=nir.real', 'x=nir[0]', 'x=(nir', 'ndvi,ndvi',
+                           'Bad Name=nir', ''):
+            with self.assertRaises(utils.InvalidArgumentError):
+                spectral_index.parse_indices(definition)
+
+    def test_unavailable_band(self):
+        index = spectral_index.parse_index('wv_soil')
+        with self.assertRaises(utils.InvalidArgumentError):
+            index.build_kernel(4, 16, 'Float32', {1: 0, 2: 0, 3: 0, 4: 0})
+
+    def test_output_paths(self):
+        self.assertEqual(spectral_index.get_output_paths('/out', 'img', ['ndvi']), ['/out/img_ndvi.tif'])
+        self.assertEqual(spectral_index.get_output_paths('/out', 'img', ['ndvi', 'ndwi']),
+                         ['/out/img_ndvi_ndwi.tif'])
+        self.assertEqual(spectral_index.get_output_paths('/out', 'img', ['ndvi', 'ndwi'], separate=True),
+                         ['/out/img_ndvi.tif', '/out/img_ndwi.tif'])
+
+
+class TestKernels(unittest.TestCase):
+
+    def setUp(self):
+        ## 4-band blocks: blue, green, red, nir
+        self.arrays = {
+            1: numpy.array([[10, 10, 10]], dtype=numpy.uint16),
+            2: numpy.array([[300, 0, 100]], dtype=numpy.uint16),
+            3: numpy.array([[100, 100, 0]], dtype=numpy.uint16),
+            4: numpy.array([[100, 300, 100]], dtype=numpy.uint16),
+        }
+        self.nodata = {1: 0, 2: 0, 3: 0, 4: 0}
+
+    def test_normalized_difference(self):
+        ndwi = spectral_index.parse_index('ndwi').build_kernel(4, 3, 'Float32', self.nodata)
+        self.assertEqual(ndwi.bands, (2, 4))
+        numpy.testing.assert_allclose(ndwi.compute_block(self.arrays), [[0.5, -9999, 0]])
+
+    def test_expression_int16(self):
+        ratio = spectral_index.parse_index('ratio=(nir - red) / b1').build_kernel(4, 3, 'Int16', self.nodata)
+        self.assertEqual(ratio.bands, (1, 3, 4))
+        result = ratio.compute_block(self.arrays)
+        self.assertEqual(result.dtype, numpy.int16)
+        self.assertEqual(result.tolist(), [[0, 20000, -9999]])
+
+    def test_expression_non_finite(self):
+        arrays = {3: numpy.array([[5.0, 0.0]], dtype=numpy.float32), 4: numpy.array([[1.0, 1.0]],
+                                                                                  dtype=numpy.float32)}
+        inverse = spectral_index.parse_index('inverse=nir / red').build_kernel(4, 2, 'Float32', {3: -1, 4: -1})
+        numpy.testing.assert_allclose(inverse.compute_block(arrays), [[0.2, -9999]])
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestParseIndices,
+        TestKernels,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -0,0 +1,137 @@
+import unittest, os, sys, shutil
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import staging
+
+
+class TestStaging(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = os.path.join(__test_dir__, 'tmp_staging_src')
+        self.wd = os.path.join(__test_dir__, 'tmp_staging_wd')
+        for d in (self.srcdir, self.wd):
+            os.makedirs(d)
+        self.srcfp = os.path.join(self.srcdir, 'WV02_20160715123456_10300100XXXXXXXX_16JUL15123456-M1BS-500123456010_01_P001.ntf')
+        with open(self.srcfp, 'wb') as f:
+            f.write(os.urandom(100003))
+
+    def touch(self, name):
+        path = os.path.join(self.srcdir, name)
+        with open(path, 'w') as f:
+            f.write(name)
+        return path
+
+    def test_copy_file(self):
+        dst = os.path.join(self.wd, os.path.basename(self.srcfp))
+        ## chunks that do not divide the file size, on more threads than chunks and on one thread
+        for chunk_size, threads in ((4096, 4), (1000000, 8), (7, 1)):
+            staging.copy_file(self.srcfp, dst, threads=threads, chunk_size=chunk_size)
+            with open(self.srcfp, 'rb') as a, open(dst, 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+            self.assertEqual(os.stat(dst).st_mtime, os.stat(self.srcfp).st_mtime)
+            self.assertFalse(os.path.exists(dst + staging.PART_SUFFIX))
+            os.remove(dst)
+
+        empty = self.touch('empty.ntf')
+        open(empty, 'w').close()
+        staging.copy_file(empty, os.path.join(self.wd, 'empty.ntf'))
+        self.assertEqual(os.path.getsize(os.path.join(self.wd, 'empty.ntf')), 0)
+
+    def test_failed_copy_leaves_no_file(self):
+        dst = os.path.join(self.wd, os.path.basename(self.srcfp))
+        with self.assertRaises(IOError):
+            staging.copy_file(self.srcfp + '.missing', dst)
+        self.assertEqual(os.listdir(self.wd), [])
+
+    def test_stage_list(self):
+        base = os.path.splitext(self.srcfp)[0]
+        for ext in ('.XML', '.RPB', '.IMD', '.jpg', '.tar', '.til'):
+            self.touch(os.path.basename(base) + ext)
+        self.touch('WV02_other-M1BS.xml')
+        strip_metadata = self.touch('16JUL15123456-M1BS-500123456010_01_P001.xml')
+
+        stage_list = staging.get_stage_list(self.srcfp)
+        self.assertEqual([os.path.basename(f)[len(os.path.basename(base)):] for f in stage_list],
+                         ['.ntf', '.IMD', '.RPB', '.XML', '.tar'])
+        self.assertEqual(staging.get_stage_list(self.srcfp, strip_metadata)[-1], strip_metadata)
+
+        copied = staging.copy_files(stage_list, self.wd)
+        self.assertEqual(len(copied), 5)
+        self.assertEqual(staging.copy_files(stage_list, self.wd), [])
+
+    def test_stage_list_rpc_txt(self):
+        ## GE01 and IK01 GeoTIFFs carry their RPCs in {base}_rpc.txt, which warp_image requires
+        srcfp = self.touch('GE01_20110307105821_1050410001518E00_11MAR07105821-M1BS-500657359080_01_P008.tif')
+        base = os.path.splitext(os.path.basename(srcfp))[0]
+        for name in (base + '_rpc.txt', base + '.pvl', base + '_browse.jpg', base + '_other.txt'):
+            self.touch(name)
+
+        stage_list = staging.get_stage_list(srcfp)
+        self.assertEqual([os.path.basename(f)[len(base):] for f in stage_list], ['.tif', '.pvl', '_rpc.txt'])
+
+    def tearDown(self):
+        for d in (self.srcdir, self.wd):
+            shutil.rmtree(d)
+
+
+class TestUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = os.path.join(__test_dir__, 'tmp_upload_wd')
+        self.dstdir = os.path.join(__test_dir__, 'tmp_upload_dst')
+        for d in (self.wd, self.dstdir):
+            os.makedirs(d)
+
+    def write(self, name, size=1000):
+        path = os.path.join(self.wd, name)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        return path
+
+    def test_upload(self):
+        uploader = staging.Uploader(queue_size=1, chunk_size=4096)
+        images = []
+        done = []
+        for i in range(3):
+            srcs = [self.write('image{}.xml'.format(i)), self.write('image{}.tif'.format(i), 100000)]
+            uploader.submit(srcs, self.dstdir, delete=True, callback=lambda i=i: done.append(i))
+            images.append(srcs)
+        self.assertEqual(uploader.wait(), [])
+        self.assertEqual(done, [0, 1, 2])
+
+        for srcs in images:
+            for src in srcs:
+                self.assertTrue(os.path.isfile(os.path.join(self.dstdir, os.path.basename(src))))
+                self.assertFalse(os.path.isfile(src))
+        self.assertFalse([f for f in os.listdir(self.dstdir) if f.endswith(staging.PART_SUFFIX)])
+
+    def test_failed_upload(self):
+        uploader = staging.Uploader()
+        srcs = [os.path.join(self.wd, 'missing.xml'), self.write('image.tif')]
+        uploader.submit(srcs, self.dstdir, delete=True)
+        self.assertEqual(uploader.wait(), srcs)
+        ## nothing is deleted and the image is not uploaded after a sidecar fails
+        self.assertTrue(os.path.isfile(srcs[1]))
+        self.assertEqual(os.listdir(self.dstdir), [])
+
+    def tearDown(self):
+        for d in (self.wd, self.dstdir):
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestStaging,
+        TestUploader,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
@@ -0,0 +1,108 @@
+import unittest, os, sys, shutil
+import numpy as np
+from osgeo import gdal
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+testdata_dir = os.path.join(__test_dir__, 'testdata')
+
+from lib import stream_writer
+
+
+class TestParsers(unittest.TestCase):
+
+    def test_parse_creation_options(self):
+        co = '-co "PHOTOMETRIC=MINISBLACK" -co "TILED=YES" -co COMPRESS=LZW '
+        self.assertEqual(stream_writer.parse_creation_options(co), ['PHOTOMETRIC=MINISBLACK', 'TILED=YES',
+                                                                    'COMPRESS=LZW'])
+
+    def test_parse_band_list(self):
+        self.assertEqual(stream_writer.parse_band_list("-b 5 -b 3 -b 2 ", 8), [5, 3, 2])
+        self.assertEqual(stream_writer.parse_band_list("", 4), [1, 2, 3, 4])
+
+    def test_stretch_block(self):
+        xp, fp = stream_writer.parse_lut("0:10,2047:200")
+        block = np.array([[0, 1023.5, 2047, 4000]], dtype=np.float32)
+        out = stream_writer.stretch_block(block, xp, fp, 0, np.uint8)
+        self.assertEqual(out.tolist(), [[0, 105, 200, 200]])
+        ## a warp with its own nodata value
+        block = np.array([[-9999, 0, 2047]], dtype=np.float32)
+        out = stream_writer.stretch_block(block, xp, fp, 65535, np.uint16, src_nodata=-9999)
+        self.assertEqual(out.tolist(), [[65535, 10, 200]])
+
+
+class TestWriteStretched(unittest.TestCase):
+
+    def setUp(self):
+        self.dstdir = os.path.join(__test_dir__, 'tmp_output')
+        if not os.path.isdir(self.dstdir):
+            os.makedirs(self.dstdir)
+        self.srcfp = os.path.join(self.dstdir, 'stream_src.tif')
+        ds = gdal.GetDriverByName('GTiff').Create(self.srcfp, 700, 600, 3, gdal.GDT_Float32,
+                                                  options=['TILED=YES'])
+        ds.SetGeoTransform([0, 2, 0, 1200, 0, -2])
+        rng = np.random.default_rng(0)
+        for band in range(1, 4):
+            data = rng.uniform(1, 2047, (600, 700)).astype(np.float32)
+            data[:50, :] = 0
+            ds.GetRasterBand(band).WriteArray(data)
+        ds = None
+        self.luts = ["0:{},2047:{}".format(b, 200 - b) for b in range(3)]
+
+    def test_matches_vrt_lut(self):
+        ## reference output through a LUT VRT, as calc_stats builds for the translate writer
+        vrtfp = os.path.join(self.dstdir, 'stream_ref.vrt')
+        vds = gdal.GetDriverByName('VRT').CreateCopy(vrtfp, gdal.Open(self.srcfp), 0)
+        for band in range(1, 4):
+            vds.GetRasterBand(band).SetMetadataItem("source_0", (
+                '<ComplexSource><SourceFilename relativeToVRT="0">{}</SourceFilename>'
+                '<SourceBand>{}</SourceBand><LUT>{}</LUT><NODATA>0</NODATA></ComplexSource>'
+            ).format(self.srcfp, band, self.luts[band - 1]), "vrt_sources")
+            vds.GetRasterBand(band).SetNoDataValue(0)
+        vds = None
+        ref = gdal.Translate(os.path.join(self.dstdir, 'stream_ref.tif'), vrtfp, outputType=gdal.GDT_Byte)
+
+        dstfp = os.path.join(self.dstdir, 'stream_dst.tif')
+        rc = stream_writer.write_stretched(self.srcfp, dstfp, self.luts, 0, 'Byte', 'GTiff',
+                                           '-co "TILED=YES" -co "COMPRESS=LZW" ', ref.GetProjection(),
+                                           threads=2, max_memory=1)
+        self.assertEqual(rc, 0)
+
+        ds = gdal.Open(dstfp)
+        for band in range(1, 4):
+            out = ds.GetRasterBand(band).ReadAsArray()
+            expected = ref.GetRasterBand(band).ReadAsArray()
+            self.assertLessEqual(np.abs(out.astype(int) - expected.astype(int)).max(), 1)
+            self.assertEqual(ds.GetRasterBand(band).GetNoDataValue(), 0)
+            self.assertIsNotNone(ds.GetRasterBand(band).GetMetadataItem('STATISTICS_MEAN'))
+        ds = None
+        ref = None
+
+    def test_band_selection_and_copy_format(self):
+        dstfp = os.path.join(self.dstdir, 'stream_dst_cog.tif')
+        rc = stream_writer.write_stretched(self.srcfp, dstfp, self.luts, 0, 'Byte', 'COG', '-co COMPRESS=LZW ',
+                                           '', band_list=[3, 1])
+        self.assertEqual(rc, 0)
+        self.assertFalse(os.path.isfile(os.path.join(self.dstdir, 'stream_dst_cog_stream.tif')))
+        ds = gdal.Open(dstfp)
+        self.assertEqual(ds.RasterCount, 2)
+        ds = None
+
+    def tearDown(self):
+        shutil.rmtree(self.dstdir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestParsers,
+        TestWriteStretched,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)
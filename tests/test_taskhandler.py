@@ -1,4 +1,4 @@
-import unittest, os, sys
+import unittest, os, sys, shutil
 
 __test_dir__ = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(__test_dir__))
@@ -26,6 +26,164 @@ class TestConvertArgs(unittest.TestCase):
         self.assertNotIn('to_remove', arg_str)
         
         
+class TestParallelTaskHandler(unittest.TestCase):
+
+    def test_order_tasks_by_cost(self):
+        tasks = [
+            taskhandler.Task('small', 't1', 'python', '', task_cost=10),
+            taskhandler.Task('unknown1', 't2', 'python', ''),
+            taskhandler.Task('large', 't3', 'python', '', task_cost=3000),
+            taskhandler.Task('unknown2', 't4', 'python', ''),
+            taskhandler.Task('medium', 't5', 'python', '', task_cost=500),
+        ]
+        self.assertEqual([t.name for t in taskhandler.order_tasks_by_cost(tasks)],
+                         ['large', 'medium', 'small', 'unknown1', 'unknown2'])
+
+    def test_get_task_cost(self):
+        self.assertEqual(taskhandler.get_task_cost(__file__, None, os.path.join(__test_dir__, 'missing.tif')),
+                         os.path.getsize(__file__))
+
+    def test_run_tasks(self):
+        tasks = [
+            taskhandler.Task('ok', 't1', '"{}"'.format(sys.executable), '-c "pass"', task_cost=1),
+            taskhandler.Task('fail', 't2', '"{}"'.format(sys.executable), '-c "import sys; sys.exit(3)"',
+                             task_cost=2),
+        ]
+        task_handler = taskhandler.ParallelTaskHandler(min(2, taskhandler.mp.cpu_count()))
+        results = task_handler.run_tasks(tasks)
+        self.assertEqual(results, {'ok': 0, 'fail': 3})
+        self.assertEqual(len(task_handler.task_results), 2)
+        for job_name, rc, duration in task_handler.task_results:
+            self.assertGreaterEqual(duration, 0)
+
+    def test_run_tasks_in_process(self):
+        logfile = os.path.join(__test_dir__, 'tmp_in_process.log')
+        tasks = [
+            taskhandler.Task('ok', 't1', 'python', '', return_code, [0], task_logfile=logfile),
+            taskhandler.Task('fail', 't2', 'python', '', return_code, [2]),
+            taskhandler.Task('error', 't3', 'python', '', raise_error, []),
+        ]
+        task_handler = taskhandler.ParallelTaskHandler(min(2, taskhandler.mp.cpu_count()), in_process=True)
+        try:
+            results = task_handler.run_tasks(tasks)
+            self.assertEqual(results, {'ok': 0, 'fail': 2, 'error': 1})
+            with open(logfile) as f:
+                self.assertIn('Returning 0', f.read())
+        finally:
+            if os.path.isfile(logfile):
+                os.remove(logfile)
+
+        ## tasks without a method can only run as commands
+        with self.assertRaises(RuntimeError):
+            task_handler.run_tasks([taskhandler.Task('cmd', 't1', 'python', '-c "pass"')])
+
+
+def return_code(rc):
+    taskhandler.logger.info('Returning %i', rc)
+    return rc
+
+
+def raise_error():
+    raise ValueError('task error')
+
+
+class TestArraySubmission(unittest.TestCase):
+
+    def setUp(self):
+        ## stand-in scheduler commands that record their arguments
+        self.tmpdir = os.path.join(__test_dir__, 'tmp_array')
+        self.bindir = os.path.join(self.tmpdir, 'bin')
+        os.makedirs(self.bindir)
+        self.submit_log = os.path.join(self.tmpdir, 'submit.log')
+        for cmd in ('sinfo', 'sbatch', 'pbsnodes', 'qsub'):
+            fake = os.path.join(self.bindir, cmd)
+            with open(fake, 'w') as f:
+                f.write('#!/bin/sh\necho {} "$@" >> "{}"\n'.format(cmd, self.submit_log))
+            os.chmod(fake, 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.bindir + os.pathsep + self.path
+        self.qsubscript = os.path.join(os.path.dirname(__test_dir__), 'slurm_ortho.sh')
+        self.tasks = [taskhandler.Task('img{}.tif'.format(i), 'Or{:04g}'.format(i), 'python',
+                                       'pgc_ortho.py --epsg 3031 "img{}.tif" "dst"'.format(i)) for i in range(1, 6)]
+
+    def read_submissions(self):
+        with open(self.submit_log) as f:
+            return [line for line in f.read().splitlines() if line.split()[0] in ('sbatch', 'qsub')]
+
+    def test_slurm_array(self):
+        task_handler = taskhandler.SLURMTaskHandler(self.qsubscript, '-p batch', array_dir=self.tmpdir,
+                                                    array_limit=10, array_job_name='Or', max_array_size=2)
+        task_handler.run_tasks(self.tasks)
+        submissions = self.read_submissions()
+        self.assertEqual(len(submissions), 3)
+        self.assertIn('--array=1-2%10', submissions[0])
+        self.assertIn('--array=1-2%10', submissions[1])
+        ## the one task left over is submitted as a normal job, not as an array of one
+        self.assertNotIn('--array', submissions[2])
+        self.assertIn('-J Or0005 --export=p1=', submissions[2])
+        self.assertTrue(submissions[0].endswith(self.qsubscript))
+
+        manifest = submissions[0].split('--export=manifest=')[1].split()[0]
+        with open(manifest) as f:
+            self.assertEqual(f.read().splitlines(), ['python {}'.format(t.cmd) for t in self.tasks[:2]])
+
+    def test_pbs_array(self):
+        task_handler = taskhandler.PBSTaskHandler(self.qsubscript, array_dir=self.tmpdir)
+        task_handler.run_tasks(self.tasks)
+        submissions = self.read_submissions()
+        self.assertEqual(len(submissions), 1)
+        self.assertIn('-N Or0001 -J 1-5 -v manifest=', submissions[0])
+
+        ## one job per task without array_dir
+        os.remove(self.submit_log)
+        taskhandler.SLURMTaskHandler(self.qsubscript).run_tasks(self.tasks)
+        self.assertEqual(len(self.read_submissions()), 5)
+
+    def test_split_arrays(self):
+        tasks = [taskhandler.Task('img{}.tif'.format(i), 'Or{:04g}'.format(i), 'python',
+                                  'pgc_ortho.py "img{}.tif" "dst"'.format(i)) for i in range(1, 1002)]
+        self.assertEqual([len(c) for c in taskhandler.split_array_tasks(tasks)], [501, 500])
+        self.assertEqual([len(c) for c in taskhandler.split_array_tasks(tasks[:1000])], [1000])
+        self.assertEqual(taskhandler.split_array_tasks([]), [])
+
+        ## 1001 tasks are submitted as two arrays by both handlers
+        taskhandler.PBSTaskHandler(self.qsubscript, array_dir=self.tmpdir).run_tasks(tasks)
+        taskhandler.SLURMTaskHandler(self.qsubscript, array_dir=self.tmpdir).run_tasks(tasks)
+        submissions = self.read_submissions()
+        self.assertEqual(len(submissions), 4)
+        self.assertIn('-J 1-501 ', submissions[0])
+        self.assertIn('-J 1-500 ', submissions[1])
+        self.assertIn('--array=1-501 ', submissions[2])
+        self.assertIn('--array=1-500 ', submissions[3])
+
+        ## a single task is a normal job with either handler
+        os.remove(self.submit_log)
+        taskhandler.PBSTaskHandler(self.qsubscript, array_dir=self.tmpdir).run_tasks(tasks[:1])
+        taskhandler.SLURMTaskHandler(self.qsubscript, array_dir=self.tmpdir).run_tasks(tasks[:1])
+        submissions = self.read_submissions()
+        self.assertEqual(len(submissions), 2)
+        self.assertIn('-N Or0001 -v p1=', submissions[0])
+        self.assertIn('-J Or0001 --export=p1=', submissions[1])
+
+    def test_walltime(self):
+        self.tasks[0].walltime = 5400
+        self.tasks[1].walltime = 600
+        taskhandler.SLURMTaskHandler(self.qsubscript, '-p batch').run_tasks(self.tasks[:3])
+        submissions = self.read_submissions()
+        self.assertIn('-p batch -t 1:30:00 ', submissions[0])
+        self.assertIn('-t 0:10:00 ', submissions[1])
+        self.assertNotIn(' -t ', submissions[2])
+
+        ## an array job requests the longest walltime of its tasks
+        os.remove(self.submit_log)
+        taskhandler.PBSTaskHandler(self.qsubscript, array_dir=self.tmpdir).run_tasks(self.tasks)
+        self.assertIn('-l walltime=1:30:00 ', self.read_submissions()[0])
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.tmpdir)
+
+
 class Args(object):
     def __init__(self):
         self.boolean = True
@@ -41,6 +199,8 @@ if __name__ == '__main__':
         
     test_cases = [
         TestConvertArgs,
+        TestParallelTaskHandler,
+        TestArraySubmission,
     ]
     
     suites = []
@@ -0,0 +1,83 @@
+import unittest, os, sys, shutil, time
+
+__test_dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(__test_dir__))
+
+from lib import journal, warp_cache
+
+
+class TestWarpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = os.path.join(__test_dir__, 'tmp_warp_cache')
+        os.makedirs(self.cache_dir)
+
+    def add_entry(self, name, size, last_used):
+        path = warp_cache.get_entry_path(self.cache_dir, name + '.ntf', '0123456789abcdef0123')
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        with open(journal.get_journal_path(path), 'w') as f:
+            f.write('{}')
+        os.utime(journal.get_journal_path(path), (last_used, last_used))
+        return path
+
+    def test_entry_path(self):
+        path = warp_cache.get_entry_path(self.cache_dir, 'image.ntf', '0123456789abcdef0123')
+        self.assertEqual(path, os.path.join(self.cache_dir, 'image_0123456789abcdef_warp.tif'))
+
+    def test_evict(self):
+        now = time.time()
+        oldest = self.add_entry('a', 1000, now - 300)
+        in_use = self.add_entry('b', 1000, now - 200)
+        newer = self.add_entry('c', 1000, now - 100)
+        ## a warp being written by another run counts towards the size
+        part = newer + '.1234.part'
+        with open(part, 'wb') as f:
+            f.write(b'\0' * 1000)
+
+        self.assertEqual(warp_cache.evict(self.cache_dir, 4000), [])
+        self.assertEqual(warp_cache.evict(self.cache_dir, 2500, keep=[in_use]), [oldest, newer])
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         sorted([os.path.basename(f) for f in (in_use, journal.get_journal_path(in_use), part)]))
+
+        ## the warp being written is never deleted, even when the cache is over its size
+        self.assertEqual(warp_cache.evict(self.cache_dir, 0, keep=[in_use]), [])
+        self.assertTrue(os.path.isfile(part))
+
+    def test_evict_stale_part(self):
+        now = time.time()
+        entry = self.add_entry('a', 1000, now - 100)
+        stale = entry + '.1234.part'
+        with open(stale, 'wb') as f:
+            f.write(b'\0' * 1000)
+        os.utime(stale, (now - warp_cache.STALE_PART_AGE - 60, now - warp_cache.STALE_PART_AGE - 60))
+
+        ## a .part file left over by an interrupted run is removed and no longer counts towards the size
+        self.assertEqual(warp_cache.evict(self.cache_dir, 1000), [stale])
+        self.assertTrue(os.path.isfile(entry))
+
+    def test_touch(self):
+        now = time.time()
+        first = self.add_entry('a', 1000, now - 300)
+        second = self.add_entry('b', 1000, now - 200)
+        warp_cache.touch(first)
+        self.assertGreater(warp_cache.get_last_used(first), warp_cache.get_last_used(second))
+        self.assertEqual(warp_cache.evict(self.cache_dir, 1000), [second])
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+if __name__ == '__main__':
+
+    test_cases = [
+        TestWarpCache,
+    ]
+
+    suites = []
+    for test_case in test_cases:
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case)
+        suites.append(suite)
+
+    alltests = unittest.TestSuite(suites)
+    unittest.TextTestRunner(verbosity=2).run(alltests)